@@ -0,0 +1,188 @@
+# ----------------------------------------------------------------
+# Batch OCR for bulk receipt imports (zip archives or folders of receipts).
+# OCR is fanned out across a ProcessPoolExecutor - each receipt is CPU work
+# (decoding, sharpening, Tesseract) - and as each one finishes its text is
+# handed to a small thread pool for structuring (parser.py) - the Gemini call
+# for receipts the local parser can't read is just waiting on the network.
+# At most OCR_BATCH_AI_CONCURRENCY of those are running at once so a big
+# batch doesn't hit the API's rate limits.
+# Results come back one dict per file as they finish (not in input order),
+# ready to be written out as NDJSON by the ocr_batch command or the batch API.
+# Receipts seen before are answered from the result cache (result_cache.py).
+#
+# This module must not import models at the top: pool processes are spawned
+# and import it before Django is set up.
+# ref https://docs.python.org/3/library/concurrent.futures.html
+# ----------------------------------------------------------------
+
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+from django.conf import settings
+
+from . import metrics
+from .parser import structure_receipt
+from .uploads import file_type
+from .utils import allowed_file, extract_text_from_bytes
+
+
+def iter_files(paths):
+    """(name, bytes) for every receipt in the given files, folders and zip archives."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    yield from iter_files([os.path.join(root, name)])
+            continue
+        with open(path, "rb") as f:
+            if file_type(f) == "zip":
+                with zipfile.ZipFile(f) as archive:
+                    yield from iter_zip(archive, prefix=os.path.basename(path))
+            elif allowed_file(f):
+                yield path, f.read()
+
+
+def iter_uploads(uploads):
+    """(name, bytes) for uploaded receipts, opening any zip archives among them."""
+    for upload in uploads:
+        if file_type(upload) == "zip":
+            with zipfile.ZipFile(upload) as archive:
+                yield from iter_zip(archive, prefix=upload.name)
+        elif allowed_file(upload):
+            yield upload.name, upload.read()
+
+
+def iter_zip(archive, prefix=""):
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        with archive.open(info) as f:
+            if allowed_file(f):
+                yield f"{prefix}/{info.filename}" if prefix else info.filename, f.read()
+
+
+def ocr_file(name, data):
+    """Runs in a pool process: OCR one receipt and time it."""
+    start = time.perf_counter()
+    # Keep anything the OCR libraries print out of the NDJSON written to stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        text = extract_text_from_bytes(data, name)
+    metrics.flush()  # let the metrics endpoint see this pool process's timings
+    return text, time.perf_counter() - start
+
+
+def ai_file(text):
+    start = time.perf_counter()
+    return structure_receipt(text), time.perf_counter() - start
+
+
+class InlineExecutor:
+    """Runs tasks straight away in this process (used for --processes 1 and in tests)."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def process_batch(files, processes=None, use_ai=True):
+    """OCR (and optionally AI-extract) every (name, bytes) in `files`, yielding results as they finish."""
+    from . import result_cache
+
+    processes = processes or settings.OCR_BATCH_PROCESSES
+    if processes > 1:
+        ocr_pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+    else:
+        ocr_pool = InlineExecutor()
+    ai_pool = ThreadPoolExecutor(settings.OCR_BATCH_AI_CONCURRENCY) if use_ai else None
+
+    pending = {}  # future -> (stage, result dict so far)
+    files = iter(files)
+    try:
+        while True:
+            # Keep a couple of receipts per process queued up, but don't read the
+            # whole archive into memory at once
+            while sum(stage == "ocr" for stage, _ in pending.values()) < processes * 2:
+                try:
+                    name, data = next(files)
+                except StopIteration:
+                    break
+                result = {"file": name, "cache_key": result_cache.key_for_bytes(data)}
+                cached = result_cache.lookup(result["cache_key"])
+                if cached is not None:
+                    yield finish(result, ok=True, cached=True, **cached)
+                    continue
+                pending[ocr_pool.submit(ocr_file, name, data)] = ("ocr", result)
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, result = pending.pop(future)
+                try:
+                    value, seconds = future.result()
+                except Exception as e:
+                    yield finish(result, ok=False, error=f"{stage} failed: {e}")
+                    continue
+                result.setdefault("timings", {})[stage] = round(seconds, 3)
+
+                if stage == "ocr":
+                    result["extracted_text"] = value
+                    if value.startswith("Error"):
+                        yield finish(result, ok=False, error=value)
+                    elif ai_pool is None:
+                        yield finish(result, ok=True)
+                    else:
+                        pending[ai_pool.submit(ai_file, value)] = ("ai", result)
+                else:
+                    result["structured_data"] = value
+                    error = value.get("error") if isinstance(value, dict) else None
+                    if error is None:
+                        result_cache.store(result["cache_key"], result)
+                    yield finish(result, ok=error is None, error=error)
+    finally:
+        ocr_pool.shutdown(wait=False, cancel_futures=True)
+        if ai_pool is not None:
+            ai_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def finish(result, **fields):
+    result = {**result, **{k: v for k, v in fields.items() if v is not None}}
+    result.pop("cache_key", None)
+    return result
+
+
+def ndjson_lines(results):
+    """One JSON line per file, then a summary line."""
+    start = time.perf_counter()
+    total = failed = 0
+    for result in results:
+        total += 1
+        failed += not result["ok"]
+        yield json.dumps(result) + "\n"
+    yield json.dumps(
+        {"summary": {"files": total, "failed": failed, "seconds": round(time.perf_counter() - start, 3)}}
+    ) + "\n"
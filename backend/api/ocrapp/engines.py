@@ -0,0 +1,179 @@
+# ----------------------------------------------------------------
+# OCR engines behind one interface, with fallback and racing.
+# Tesseract is quick and reads most receipts well, but on a crumpled or dim
+# receipt it can come back with a handful of words; EasyOCR is slower but
+# copes better with those. recognise() tries the engines in OCR_ENGINES in
+# order and moves on to the next one when a result has fewer than
+# OCR_MIN_WORDS words (or the engine fails or times out).
+#
+# With OCR_RACE on, all the engines start at once and the first acceptable
+# result wins - a hard receipt then costs about as long as the engine that
+# can read it, instead of Tesseract's time plus EasyOCR's. That uses more
+# CPU per receipt, so it is off by default.
+#
+# Each engine has a timeout (OCR_ENGINE_TIMEOUTS). Tesseract runs as a
+# subprocess and is killed when it is up; EasyOCR can't be interrupted, so
+# we just stop waiting for it. The "stub" engine returns fixed text, for
+# tests and for running the app without any OCR installed (OCR_ENGINES=["stub"]).
+# ref https://github.com/madmaze/pytesseract#functions
+# ----------------------------------------------------------------
+
+import logging
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import pytesseract
+from django.conf import settings
+
+from . import registry
+from .metrics import incr, stage
+
+logger = logging.getLogger(__name__)
+
+# Part of the result cache key too (see result_cache.py)
+TESSERACT_CONFIG = "--psm 4"
+
+
+class Engine(ABC):
+    name = ""
+    enforces_timeout = False  # True if read() stops itself at self.timeout
+
+    @abstractmethod
+    def read(self, image):
+        """Text in a greyscale numpy image."""
+
+    @property
+    def timeout(self):
+        return settings.OCR_ENGINE_TIMEOUTS.get(self.name)
+
+
+class TesseractEngine(Engine):
+    name = "tesseract"
+    enforces_timeout = True
+
+    def read(self, image):
+        pytesseract.pytesseract.tesseract_cmd = settings.OCR_TESSERACT_CMD
+        # pytesseract kills the tesseract process and raises RuntimeError at the timeout
+        return pytesseract.image_to_string(
+            image, lang="eng", config=TESSERACT_CONFIG, timeout=self.timeout or 0
+        )
+
+
+class EasyOCREngine(Engine):
+    name = "easyocr"
+
+    def read(self, image):
+        reader = registry.get("easyocr")  # loaded once per process, see registry.py
+        return "\n".join(reader.readtext(image, detail=0))
+
+
+class StubEngine(Engine):
+    """Returns `text` after `delay` seconds without looking at the image."""
+
+    name = "stub"
+
+    def __init__(self, text="Latte 3.00\nTotal 3.00", delay=0):
+        self.text = text
+        self.delay = delay
+
+    def read(self, image):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.text
+
+
+ENGINES = {
+    "tesseract": TesseractEngine(),
+    "easyocr": EasyOCREngine(),
+    "stub": StubEngine(),
+}
+
+
+def word_count(text):
+    return len(text.split()) if text else 0
+
+
+def acceptable(text):
+    return word_count(text) >= settings.OCR_MIN_WORDS
+
+
+def run(engine, image):
+    """Run one engine within its timeout; raises TimeoutError if it takes too long."""
+    with stage(engine.name):
+        if engine.timeout is None or engine.enforces_timeout:
+            return engine.read(image)
+        # Engines that can't be interrupted run on a thread we can stop waiting for
+        pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            return pool.submit(engine.read, image).result(timeout=engine.timeout)
+        except FutureTimeout:
+            raise TimeoutError(f"{engine.name} took longer than {engine.timeout}s")
+        finally:
+            pool.shutdown(wait=False)
+
+
+def recognise(image, names=None):
+    """Text from the first engine in `names` (default OCR_ENGINES) that reads enough words.
+    If none does, the longest result is returned; if every engine failed, the last error is raised."""
+    engines = [ENGINES[name] for name in names or settings.OCR_ENGINES]
+    if settings.OCR_RACE and len(engines) > 1:
+        return race(image, engines)
+
+    best, error = None, None
+    for engine in engines:
+        try:
+            text = run(engine, image)
+        except Exception as e:
+            incr(f"{engine.name}_errors")
+            logger.warning("OCR engine %s failed: %s", engine.name, e)
+            error = e
+            continue
+        if acceptable(text):
+            return text
+        if best is None or word_count(text) > word_count(best):
+            best = text
+        if engine is not engines[-1]:
+            incr("ocr_fallbacks")
+    if best is None:
+        raise error
+    return best
+
+
+def race(image, engines):
+    """Start every engine at once and return the first acceptable result."""
+    pool = ThreadPoolExecutor(max_workers=len(engines))
+    futures = {pool.submit(run, engine, image): engine for engine in engines}
+    # Give up on everything once the slowest engine's timeout has passed
+    timeouts = [engine.timeout for engine in engines]
+    deadline = None if None in timeouts else time.monotonic() + max(timeouts)
+    best, error = None, None
+    try:
+        pending = set(futures)
+        while pending:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                error = TimeoutError("no OCR engine finished in time")
+                break
+            for future in done:
+                engine = futures[future]
+                try:
+                    text = future.result()
+                except Exception as e:
+                    incr(f"{engine.name}_errors")
+                    logger.warning("OCR engine %s failed: %s", engine.name, e)
+                    error = e
+                    continue
+                if acceptable(text):
+                    incr(f"race_won_{engine.name}")
+                    return text
+                if best is None or word_count(text) > word_count(best):
+                    best = text
+    finally:
+        # Don't wait for the losers - Tesseract stops itself at its timeout
+        pool.shutdown(wait=False, cancel_futures=True)
+    if best is None:
+        raise error
+    return best
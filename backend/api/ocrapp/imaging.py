@@ -0,0 +1,138 @@
+# ----------------------------------------------------------------
+# Geometry clean-up for receipt photos before OCR.
+# Phone photos arrive at 12 MP or more, mostly table top around a narrow
+# strip of paper, and Tesseract's time grows with the number of pixels it
+# has to scan. Before sharpening, preprocess_image (utils.py) now:
+#   1. crops to the receipt - the largest bright region in the photo,
+#   2. rescales so text is about OCR_TARGET_TEXT_HEIGHT pixels tall, which
+#      is the size Tesseract reads best (usually a big cut for phone photos),
+#   3. straightens the text if the photo was taken at a slight angle.
+# Everything is measured on a small proxy copy of the image (at most
+# PROXY_SIDE pixels on a side) and then applied once to the full image, so
+# these steps cost a few milliseconds even on a 12 MP frame.
+# ref https://tesseract-ocr.github.io/tessdoc/ImproveQuality.html#rescaling
+# ref https://docs.opencv.org/4.x/d4/d73/tutorial_py_contours_begin.html
+# ----------------------------------------------------------------
+
+import cv2
+import numpy as np
+
+PROXY_SIDE = 1000
+
+# The receipt must cover between these fractions of the photo to be cropped to
+# (anything else is more likely to be a shadow or the whole frame)
+MIN_RECEIPT_AREA = 0.10
+MAX_RECEIPT_AREA = 0.95
+
+# Scaling is skipped when it would change the size by less than this
+SCALE_TOLERANCE = 0.15
+MIN_SCALE, MAX_SCALE = 0.2, 2.0
+
+# Skew corrections outside this range (degrees) are ignored
+MIN_SKEW, MAX_SKEW = 0.5, 15
+
+
+def proxy(image):
+    """A small copy of the image and the factor it was shrunk by."""
+    factor = min(1.0, PROXY_SIDE / max(image.shape[:2]))
+    if factor == 1.0:
+        return image, factor
+    small = cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    return small, factor
+
+
+def text_mask(image):
+    """White-on-black mask of the dark marks (text) on the paper."""
+    _, mask = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return mask
+
+
+def receipt_region(image):
+    """(top, bottom, left, right) of the receipt in the image, or None if it can't be found."""
+    small, factor = proxy(image)
+    blurred = cv2.GaussianBlur(small, (5, 5), 0)
+    _, paper = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Close up the gaps the printed text leaves in the paper
+    paper = cv2.morphologyEx(paper, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+
+    contours, _ = cv2.findContours(paper, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    largest = max(contours, key=cv2.contourArea)
+    x, y, w, h = cv2.boundingRect(largest)
+    if not MIN_RECEIPT_AREA <= (w * h) / (small.shape[0] * small.shape[1]) <= MAX_RECEIPT_AREA:
+        return None
+
+    # Back to full-size coordinates, with a small margin so no text is clipped
+    margin = int(0.02 * max(image.shape[:2]))
+    top = max(0, int(y / factor) - margin)
+    left = max(0, int(x / factor) - margin)
+    bottom = min(image.shape[0], int((y + h) / factor) + margin)
+    right = min(image.shape[1], int((x + w) / factor) + margin)
+    return top, bottom, left, right
+
+
+def crop_to_receipt(image):
+    region = receipt_region(image)
+    if region is None:
+        return image
+    top, bottom, left, right = region
+    return image[top:bottom, left:right]
+
+
+def characters(small):
+    """Stats and centres of the blobs in a proxy image that are shaped like characters -
+    not specks, ruled lines, or the table showing round the edge of the paper."""
+    _, _, stats, centroids = cv2.connectedComponentsWithStats(text_mask(small), connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    keep = (heights >= 3) & (heights <= small.shape[0] / 10) & (widths <= heights * 3)
+    return stats[1:][keep], centroids[1:][keep]
+
+
+def text_height(image):
+    """Median height (in pixels of `image`) of the characters, or None if no text was found."""
+    small, factor = proxy(image)
+    stats, _ = characters(small)
+    if len(stats) < 5:
+        return None
+    return float(np.median(stats[:, cv2.CC_STAT_HEIGHT])) / factor
+
+
+def normalize_scale(image, target_height):
+    """Resize so characters are about target_height pixels tall."""
+    height = text_height(image)
+    if not height:
+        return image
+    scale = min(MAX_SCALE, max(MIN_SCALE, target_height / height))
+    if abs(scale - 1) < SCALE_TOLERANCE:
+        return image
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=interpolation)
+
+
+def skew_angle(image):
+    """Angle (degrees) the text is rotated by, from the box round the characters' centres."""
+    small, _ = proxy(image)
+    _, centres = characters(small)
+    if len(centres) < 20:
+        return 0.0
+    angle = cv2.minAreaRect(centres.astype(np.float32))[2]
+    # minAreaRect's angle can describe the same box several ways - fold it into [-45, 45)
+    if angle >= 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    return angle
+
+
+def deskew(image):
+    angle = skew_angle(image)
+    if not MIN_SKEW <= abs(angle) <= MAX_SKEW:
+        return image
+    h, w = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    # Fill the corners that rotate in with white paper rather than black
+    return cv2.warpAffine(
+        image, matrix, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=255
+    )
@@ -0,0 +1,162 @@
+# ----------------------------------------------------------------
+# A small database-backed job queue for receipt OCR.
+# OCR plus the Gemini call take several seconds per receipt, which used to
+# tie up a web worker for the whole time. Now the upload views just save the
+# file, add an OcrJob row and return its id straight away. Worker processes
+# (python manage.py ocr_worker) claim queued jobs and run them, and clients
+# poll - or long-poll with ?wait= - the job endpoint for the result.
+#
+# Claiming is a compare-and-swap: UPDATE ... SET status='running' WHERE
+# id=<job> AND status='queued'. Only one worker can win that update, so two
+# workers never run the same job, on SQLite or PostgreSQL alike.
+# ref https://docs.djangoproject.com/en/5.1/ref/models/querysets/#update
+# ----------------------------------------------------------------
+
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+
+from . import metrics, result_cache
+from .models import OcrJob
+from .pipeline import QueueFull, process_receipt
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(uploaded_file, folder="receipts", cache_key="", profile=False):
+    """Save an upload and queue it for OCR. Raises QueueFull if the queue is at its limit."""
+    if cache_key:
+        # The same receipt is already waiting - share that job rather than doing it twice
+        in_flight = OcrJob.objects.filter(
+            cache_key=cache_key, status__in=[OcrJob.QUEUED, OcrJob.RUNNING]
+        ).first()
+        if in_flight is not None:
+            return in_flight
+
+    queued = OcrJob.objects.filter(status=OcrJob.QUEUED).count()
+    if queued >= settings.OCR_MAX_QUEUED_JOBS:
+        raise QueueFull(f"{queued} receipts are already waiting")
+
+    name = default_storage.save(f"{folder}/{uploaded_file.name}", uploaded_file)
+    return OcrJob.objects.create(file=name, cache_key=cache_key, profile_requested=profile)
+
+
+def claim(worker):
+    """Take the oldest queued job for this worker, or None if there is nothing to do."""
+    for _ in range(5):
+        job = (
+            OcrJob.objects.filter(status=OcrJob.QUEUED)
+            .order_by("created_at")
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if job is None:
+            return None
+        claimed = OcrJob.objects.filter(pk=job, status=OcrJob.QUEUED).update(
+            status=OcrJob.RUNNING,
+            worker=worker,
+            started_at=timezone.now(),
+            attempts=F("attempts") + 1,
+        )
+        if claimed:
+            return OcrJob.objects.get(pk=job)
+        # Another worker got there first - try the next one
+    return None
+
+
+def run(job, use_ai=True):
+    """Process a claimed job and store the outcome."""
+    try:
+        with metrics.stage("job"), metrics.profiled(job.profile_requested) as profile:
+            result = process_receipt(job.file, use_ai=use_ai)
+    except Exception as e:
+        logger.exception("OCR job %s failed", job.pk)
+        retry = job.attempts < settings.OCR_JOB_MAX_ATTEMPTS
+        metrics.incr("jobs_retried" if retry else "jobs_failed")
+        changes = {
+            "status": OcrJob.QUEUED if retry else OcrJob.FAILED,
+            "error": str(e),
+            "finished_at": None if retry else timezone.now(),
+        }
+    else:
+        changes = {
+            "status": OcrJob.DONE,
+            "extracted_text": result["extracted_text"],
+            "structured_data": result["structured_data"],
+            "error": "",
+            "finished_at": timezone.now(),
+            "profile_report": profile.report,
+        }
+        metrics.incr("jobs_done")
+
+    # Only write back if the job is still ours (it may have been requeued as stale)
+    updated = OcrJob.objects.filter(
+        pk=job.pk, status=OcrJob.RUNNING, worker=job.worker
+    ).update(**changes)
+    if updated and changes["status"] == OcrJob.DONE and use_ai:
+        result_cache.store(job.cache_key, result)
+    metrics.flush()
+
+
+def requeue_stale():
+    """Put back jobs whose worker died (or hung) part way through."""
+    cutoff = timezone.now() - timedelta(seconds=settings.OCR_JOB_TIMEOUT)
+    stale = OcrJob.objects.filter(status=OcrJob.RUNNING, started_at__lt=cutoff)
+    stale.filter(attempts__lt=settings.OCR_JOB_MAX_ATTEMPTS).update(status=OcrJob.QUEUED)
+    stale.update(
+        status=OcrJob.FAILED, error="Timed out while processing", finished_at=timezone.now()
+    )
+
+
+def work(worker, burst=False, poll_interval=1.0, max_jobs=None, use_ai=True, should_stop=None):
+    """Keep claiming and running jobs. With burst=True, stop once the queue is empty."""
+    done = 0
+    while not (should_stop and should_stop()):
+        if max_jobs is not None and done >= max_jobs:
+            break
+        close_old_connections()
+        job = claim(worker)
+        if job is None:
+            requeue_stale()
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        run(job, use_ai=use_ai)
+        done += 1
+    return done
+
+
+async def wait_for(job_id, timeout, interval=0.25):
+    """Long-poll: return the job once it has finished or `timeout` seconds have passed.
+    Async, so under an ASGI server a waiting request doesn't hold a thread."""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = await OcrJob.objects.aget(pk=job_id)
+        if job.finished or time.monotonic() >= deadline:
+            return job
+        await asyncio.sleep(interval)
+
+
+def job_payload(job):
+    data = {
+        "job_id": str(job.pk),
+        "status": job.status,
+        "status_url": reverse("ocr-job", args=[job.pk]),
+    }
+    if job.status == OcrJob.DONE:
+        data["extracted_text"] = job.extracted_text
+        data["structured_data"] = job.structured_data
+    elif job.status == OcrJob.FAILED:
+        data["error"] = job.error
+    if job.profile_report:
+        data["profile"] = job.profile_report
+    return data
@@ -0,0 +1,165 @@
+# ----------------------------------------------------------------
+# The LLM behind generate_json_ai, behind a small client interface.
+# OCR_LLM_BACKEND picks the client:
+#   "gemini" - the real thing (Google's Gemini API, model OCR_GEMINI_MODEL)
+#   "fake"   - an in-process stand-in for load tests and offline benchmarks.
+#              It waits a configurable time, then answers with JSON built
+#              from the receipt text in the prompt. A configurable share of
+#              calls fail with the same exceptions the Gemini client raises,
+#              or come back as broken JSON, so the job queue's retries,
+#              the result cache and the error handling can be exercised
+#              without calling Google. Settings are in OCR_FAKE_LLM.
+# The backend can also be set with the OCR_LLM_BACKEND environment variable,
+# which reaches spawned worker processes too (see bench_ocr_jobs --fake-llm).
+#
+# Whichever backend it is, client() wraps it in ResilientClient: every call
+# has a timeout (OCR_LLM_TIMEOUT), transient errors are retried with backoff,
+# and a circuit breaker fails calls straight away while the upstream keeps
+# failing (see resilience.py), so a slow Gemini can't tie up every worker.
+# ref https://googleapis.dev/python/google-api-core/latest/exceptions.html
+# ----------------------------------------------------------------
+
+import asyncio
+import json
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+
+from . import registry
+from .resilience import CircuitBreaker, retry, retry_async
+
+
+class LLMClient(ABC):
+    name = ""
+
+    @abstractmethod
+    def generate(self, prompt, timeout=None):
+        """The model's reply to `prompt`, as text. Raises DeadlineExceeded after `timeout` seconds."""
+
+    async def generate_async(self, prompt, timeout=None):
+        # Clients without an async API use a thread
+        return await asyncio.to_thread(self.generate, prompt, timeout)
+
+
+class GeminiClient(LLMClient):
+    name = "gemini"
+
+    def generate(self, prompt, timeout=None):
+        # The model is configured once per process and reused (see registry.py)
+        model = registry.get("gemini")
+        options = {"timeout": timeout} if timeout else None
+        return model.generate_content(prompt, request_options=options).text
+
+    async def generate_async(self, prompt, timeout=None):
+        model = registry.get("gemini")
+        options = {"timeout": timeout} if timeout else None
+        response = await model.generate_content_async(prompt, request_options=options)
+        return response.text
+
+
+class FakeLLMClient(LLMClient):
+    """Deterministic for a given seed: the same sequence of calls gets the same delays and failures."""
+
+    name = "fake"
+
+    def __init__(self, latency=1.0, jitter=0.0, error_rate=0.0, malformed_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def generate(self, prompt, timeout=None):
+        delay, roll = self.next_call()
+        if timeout and delay > timeout:
+            time.sleep(timeout)
+            raise google_exceptions.DeadlineExceeded(f"fake LLM: no reply within {timeout}s")
+        time.sleep(delay)
+        return self.reply(prompt, roll)
+
+    async def generate_async(self, prompt, timeout=None):
+        delay, roll = self.next_call()
+        if timeout and delay > timeout:
+            await asyncio.sleep(timeout)
+            raise google_exceptions.DeadlineExceeded(f"fake LLM: no reply within {timeout}s")
+        await asyncio.sleep(delay)
+        return self.reply(prompt, roll)
+
+    def next_call(self):
+        """How long this call takes, and the dice roll that decides whether it fails."""
+        with self.lock:
+            self.calls += 1
+            roll = self.random.random()
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        return delay, roll
+
+    def reply(self, prompt, roll):
+        if roll < self.error_rate:
+            raise google_exceptions.ServiceUnavailable("fake LLM: simulated upstream error")
+        reply = json.dumps(self.answer(prompt))
+        if roll < self.error_rate + self.malformed_rate:
+            return "```json\n" + reply[: len(reply) // 2]  # cut off part way, like a truncated reply
+        return "```json\n" + reply + "\n```"
+
+    def answer(self, prompt):
+        # Imported here as parser.py imports utils.py, which imports this module
+        from .parser import parse_receipt
+
+        text = prompt.split("Extracted text:\n", 1)[-1]
+        parsed = parse_receipt(text)
+        parsed.pop("confidence")
+        return parsed
+
+
+class ResilientClient(LLMClient):
+    """Adds the timeout, retries and circuit breaker to another client."""
+
+    def __init__(self, client):
+        self.client = client
+        self.name = client.name
+        self.breaker = CircuitBreaker(
+            "llm",
+            failure_threshold=settings.OCR_LLM_BREAKER_FAILURES,
+            reset_timeout=settings.OCR_LLM_BREAKER_RESET,
+        )
+
+    def generate(self, prompt, timeout=None):
+        timeout = timeout or settings.OCR_LLM_TIMEOUT
+        return self.breaker.call(
+            lambda: retry(
+                lambda: self.client.generate(prompt, timeout=timeout),
+                retries=settings.OCR_LLM_RETRIES,
+                backoff=settings.OCR_LLM_BACKOFF,
+                max_backoff=settings.OCR_LLM_BACKOFF_MAX,
+                name="llm",
+            )
+        )
+
+    async def generate_async(self, prompt, timeout=None):
+        timeout = timeout or settings.OCR_LLM_TIMEOUT
+        return await self.breaker.call_async(
+            lambda: retry_async(
+                lambda: self.client.generate_async(prompt, timeout=timeout),
+                retries=settings.OCR_LLM_RETRIES,
+                backoff=settings.OCR_LLM_BACKOFF,
+                max_backoff=settings.OCR_LLM_BACKOFF_MAX,
+                name="llm",
+            )
+        )
+
+
+CLIENTS = {
+    "gemini": GeminiClient,
+    "fake": lambda: FakeLLMClient(**settings.OCR_FAKE_LLM),
+}
+
+
+def client():
+    """This process's LLM client for settings.OCR_LLM_BACKEND, wrapped in ResilientClient."""
+    return registry.get("llm")
@@ -0,0 +1,109 @@
+# ------------------------------------------------------------------
+# Load benchmark: the async upload view served WSGI-style vs ASGI-style
+# while Gemini is slow.
+# Both runs post the same receipts to /api/ocr-extract/async/, with OCR
+# replaced by the stub engine (a fixed --ocr-ms per receipt) and Gemini by
+# the offline fake (--llm-latency seconds per call), so only the server model
+# differs:
+#   wsgi - Django's WSGI handler on a pool of --threads threads, like
+#          `gunicorn --threads 8 mycoffeeapp.wsgi`: each request holds a
+#          thread until its LLM call returns.
+#   asgi - Django's ASGI handler on one event loop, like
+#          `uvicorn mycoffeeapp.asgi:application`: requests wait on the LLM
+#          together and only the OCR uses threads (OCR_ASYNC_OCR_THREADS).
+# Nothing is sent to Google and the uploads go to a temporary folder.
+# usage: python manage.py bench_ocr_async --requests 200 --threads 8 --llm-latency 1.5
+# ------------------------------------------------------------------
+
+import asyncio
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import cv2
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from api.ocrapp import engines, registry
+from api.ocrapp.management.commands.bench_ocr_jobs import millis
+
+RECEIPT = cv2.imencode(".png", np.full((40, 40), 255, dtype=np.uint8))[1].tobytes()
+
+
+def upload(i):
+    # Different bytes each time so no request is answered from the result cache
+    return {"image": SimpleUploadedFile(f"bench-{i}.png", RECEIPT + str(i).encode())}
+
+
+class Command(BaseCommand):
+    help = "Compare WSGI-style and ASGI-style throughput of the async OCR view with a slow LLM"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--threads", type=int, default=8, help="WSGI worker threads")
+        parser.add_argument("--concurrency", type=int, default=200, help="ASGI requests in flight")
+        parser.add_argument("--llm-latency", type=float, default=1.5)
+        parser.add_argument("--ocr-ms", type=float, default=50)
+
+    def handle(self, *args, **options):
+        media = tempfile.mkdtemp()
+        stub = engines.StubEngine(delay=options["ocr_ms"] / 1000)
+        overrides = override_settings(
+            ALLOWED_HOSTS=["testserver"],
+            MEDIA_ROOT=media,
+            OCR_ENGINES=["stub"],
+            OCR_LLM_BACKEND="fake",
+            OCR_FAKE_LLM={"latency": options["llm_latency"], "jitter": options["llm_latency"] / 5},
+            OCR_PARSER_ENABLED=False,
+            OCR_RESULT_CACHE_ENABLED=False,
+            OCR_ASYNC_MAX_PENDING=options["requests"] + 1,
+        )
+        try:
+            with overrides, patch.dict(engines.ENGINES, {"stub": stub}):
+                registry.reset()
+                self.report("wsgi", *self.run_wsgi(options["requests"], options["threads"]))
+                self.report("asgi", *asyncio.run(self.run_asgi(options["requests"], options["concurrency"])))
+        finally:
+            registry.reset()
+            shutil.rmtree(media, ignore_errors=True)
+
+    def run_wsgi(self, count, threads):
+        url = reverse("ocr-extract-async")
+
+        def one(i):
+            start = time.perf_counter()
+            status = Client().post(url, upload(i)).status_code
+            return status, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(one, range(count)))
+        return results, time.perf_counter() - start
+
+    async def run_asgi(self, count, concurrency):
+        url = reverse("ocr-extract-async")
+        client = AsyncClient()
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with limit:
+                start = time.perf_counter()
+                status = (await client.post(url, upload(i))).status_code
+                return status, time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(count)))
+        return results, time.perf_counter() - start
+
+    def report(self, mode, results, elapsed):
+        latencies = [seconds for _, seconds in results]
+        failed = sum(status != 200 for status, _ in results)
+        self.stdout.write(
+            f"{mode}  {len(results) / elapsed:8.2f} req/s  p50 {millis(latencies, 0.5):8.0f}ms  "
+            f"p95 {millis(latencies, 0.95):8.0f}ms" + (f"  ({failed} failed)" if failed else "")
+        )
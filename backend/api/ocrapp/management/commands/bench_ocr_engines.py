@@ -0,0 +1,58 @@
+# ------------------------------------------------------------------
+# Benchmark for the OCR engine registry (api/ocrapp/registry.py).
+# Runs the sample receipts through EasyOCR "cold" (a new Reader for every
+# receipt, as the old code did) and "warm" (one shared Reader), and times
+# setting up the Gemini model the same way. Gemini itself is not called,
+# so no API usage is charged - any non-empty TOKEN_API_GEMINI will do.
+# usage: python manage.py bench_ocr_engines --receipts 5
+# ------------------------------------------------------------------
+
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.ocrapp import registry
+from api.ocrapp.management.commands.bench_ocr_jobs import sample_receipts
+from api.ocrapp.utils import easyocr_extract_text
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+
+class Command(BaseCommand):
+    help = "Compare cold and warm OCR engine calls"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--receipts", type=int, default=5)
+        parser.add_argument("--engines", nargs="+", default=["easyocr", "gemini"])
+
+    def handle(self, *args, **options):
+        receipts = sample_receipts()[: options["receipts"]]
+        benches = {
+            "easyocr": lambda path: easyocr_extract_text(path),
+            "gemini": lambda path: registry.get("gemini"),
+        }
+
+        for name in options["engines"]:
+            run = benches[name]
+            try:
+                # Cold: drop the engine before every receipt, like the old per-call setup
+                cold = []
+                for path in receipts:
+                    registry.reset()
+                    cold.append(timed(lambda: run(path)))
+                # Warm: the engine is already loaded
+                warm = [timed(lambda: run(path)) for path in receipts]
+            except Exception as e:
+                self.stderr.write(f"{name}: could not run ({e})")
+                continue
+
+            self.stdout.write(
+                f"{name:<8} cold {statistics.median(cold):10.2f}ms  "
+                f"warm {statistics.median(warm):10.2f}ms  per receipt (median)"
+            )
+        registry.reset()
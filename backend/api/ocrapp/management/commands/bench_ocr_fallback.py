@@ -0,0 +1,55 @@
+# ------------------------------------------------------------------
+# Benchmark for OCR engine fallback and racing (api/ocrapp/engines.py).
+# Runs the preprocessed sample receipts through recognise() one engine after
+# another ("fallback", the default) and with all engines at once ("race"),
+# and reports median / p95 / worst time per receipt plus how many receipts
+# no engine could read properly. Racing should mostly help the worst times.
+# usage: python manage.py bench_ocr_fallback --engines tesseract easyocr --repeat 3
+# ------------------------------------------------------------------
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from api.ocrapp import engines
+from api.ocrapp.management.commands.bench_ocr_jobs import millis, sample_receipts
+from api.ocrapp.utils import load_image, preprocess_image
+
+
+class Command(BaseCommand):
+    help = "Compare OCR latency with engine fallback and with engines racing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--engines", nargs="+", default=None, help="Defaults to OCR_ENGINES")
+        parser.add_argument("--repeat", type=int, default=1)
+
+    def handle(self, *args, **options):
+        images = []
+        for path in sample_receipts():
+            with open(path, "rb") as f:
+                images.append(preprocess_image(load_image(f.read()), path))
+        if not images:
+            self.stderr.write("No sample receipts found")
+            return
+
+        names = options["engines"]
+        for mode, race in (("fallback", False), ("race", True)):
+            timings, poor, failed = [], 0, 0
+            with override_settings(OCR_RACE=race):
+                for _ in range(options["repeat"]):
+                    for image in images:
+                        start = time.perf_counter()
+                        try:
+                            text = engines.recognise(image, names)
+                        except Exception:
+                            failed += 1
+                            continue
+                        finally:
+                            timings.append(time.perf_counter() - start)
+                        poor += not engines.acceptable(text)
+
+            self.stdout.write(
+                f"{mode:<9} p50 {millis(timings, 0.5):9.1f}ms  p95 {millis(timings, 0.95):9.1f}ms  "
+                f"max {max(timings) * 1000:9.1f}ms  too few words {poor}  failed {failed}"
+            )
@@ -0,0 +1,113 @@
+# ------------------------------------------------------------------
+# Throughput benchmark for the OCR job queue.
+# Queues copies of the sample receipts in media/receipts, then drains the
+# queue with 1, 2, 4... worker processes and reports receipts per second and
+# how long each receipt took to process. The Gemini step is skipped unless
+# --ai is given (it is slow, costs money and needs an API key), or --fake-llm,
+# which runs it against the offline stand-in in llm.py (see OCR_FAKE_LLM).
+# Needs a database the worker processes can share (not in-memory SQLite).
+# The bench jobs and their files are deleted afterwards.
+# usage: python manage.py bench_ocr_jobs --jobs 24 --processes 1 2 4 [--fake-llm]
+# ------------------------------------------------------------------
+
+import os
+import time
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from api.ocrapp import registry
+from api.ocrapp.models import OcrJob
+from api.ocrapp.pipeline import process_receipt
+from api.ocrapp.worker import start_pool
+
+SAMPLE_DIR = os.path.join(settings.MEDIA_ROOT, "receipts")
+
+
+def sample_receipts():
+    """The original sample images (not the _preprocessed/_sharpened copies OCR leaves behind)."""
+    return sorted(
+        os.path.join(SAMPLE_DIR, name)
+        for name in os.listdir(SAMPLE_DIR)
+        if name.lower().endswith((".jpg", ".jpeg", ".png"))
+        and not name.rsplit(".", 1)[0].endswith(("_preprocessed", "_sharpened"))
+    )
+
+
+def millis(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+
+
+class Command(BaseCommand):
+    help = "Benchmark receipt OCR throughput with different numbers of worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--jobs", type=int, default=12)
+        parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+        parser.add_argument("--ai", action="store_true", help="Include the Gemini call")
+        parser.add_argument("--fake-llm", action="store_true", help="Include the AI step, using the offline fake")
+
+    def handle(self, *args, **options):
+        samples = sample_receipts()
+        if not samples:
+            raise CommandError(f"No sample receipts found in {SAMPLE_DIR}")
+        use_ai = options["ai"] or options["fake_llm"]
+        if options["fake_llm"]:
+            # Through the environment so the spawned workers use the fake too
+            os.environ["OCR_LLM_BACKEND"] = settings.OCR_LLM_BACKEND = "fake"
+            registry.reset()
+        jobs = options["jobs"]
+
+        self.stdout.write(
+            f"{jobs} receipts from {len(samples)} samples, AI {settings.OCR_LLM_BACKEND if use_ai else 'off'}"
+        )
+
+        # Baseline: one after another, like the old in-request code path
+        names = self.upload(samples, jobs)
+        start = time.perf_counter()
+        for name in names:
+            process_receipt(name, use_ai=use_ai)
+        elapsed = time.perf_counter() - start
+        self.cleanup(names)
+        self.stdout.write(f"{'in request (serial)':<22} {jobs / elapsed:7.2f} receipts/s")
+
+        for processes in options["processes"]:
+            names = self.upload(samples, jobs)
+            queued = [OcrJob.objects.create(file=name).pk for name in names]
+            start_pool(processes, burst=True, use_ai=use_ai)
+
+            # Timed from the first job starting, so the workers' start-up (importing
+            # OpenCV, torch...) is left out - in production they are already running
+            finished = list(OcrJob.objects.filter(pk__in=queued))
+            first = min(job.started_at for job in finished)
+            last = max(job.finished_at or job.started_at for job in finished)
+            elapsed = max((last - first).total_seconds(), 1e-6)
+            durations = [
+                (job.finished_at - job.started_at).total_seconds()
+                for job in finished
+                if job.finished_at
+            ]
+            failed = sum(job.status != OcrJob.DONE for job in finished)
+            self.stdout.write(
+                f"{processes} worker process(es)    {jobs / elapsed:7.2f} receipts/s  "
+                f"per receipt p50 {millis(durations, 0.5):8.0f}ms  p95 {millis(durations, 0.95):8.0f}ms"
+                + (f"  ({failed} failed)" if failed else "")
+            )
+            OcrJob.objects.filter(pk__in=queued).delete()
+            self.cleanup(names)
+
+    def upload(self, samples, count):
+        names = []
+        for i in range(count):
+            path = samples[i % len(samples)]
+            with open(path, "rb") as f:
+                name = f"bench-{i}-{os.path.basename(path)}"
+                names.append(default_storage.save(f"receipts/bench/{name}", ContentFile(f.read())))
+        return names
+
+    def cleanup(self, names):
+        for name in names:
+            default_storage.delete(name)
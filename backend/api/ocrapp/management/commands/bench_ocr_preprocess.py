@@ -0,0 +1,107 @@
+# ------------------------------------------------------------------
+# Benchmark and accuracy check for the receipt clean-up in imaging.py.
+# Every sample receipt is OCR'd twice: "full frame" (sharpen the whole photo,
+# as before) and "cleaned" (crop to the receipt, rescale, deskew, sharpen).
+# For each it reports pixels handed to Tesseract, preprocessing and OCR time,
+# and accuracy - similarity to <receipt>.txt next to the image if there is
+# one, otherwise how closely the cleaned text matches the full frame text.
+# Without a Tesseract binary only the image sizes and preprocessing times are shown.
+# The bundled samples are small web images; --photo-scale 6 blows them up to
+# roughly the size of a 12 MP phone photo.
+# usage: python manage.py bench_ocr_preprocess [--receipts 5] [--target-height 30] [--photo-scale 6]
+# ------------------------------------------------------------------
+
+import difflib
+import os
+import statistics
+import time
+
+import cv2
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from api.ocrapp.management.commands.bench_ocr_jobs import sample_receipts
+from api.ocrapp.engines import ENGINES
+from api.ocrapp.utils import load_image, preprocess_image
+
+FULL_FRAME = dict(OCR_CROP_TO_RECEIPT=False, OCR_NORMALIZE_SCALE=False, OCR_DESKEW=False)
+CLEANED = dict(OCR_CROP_TO_RECEIPT=True, OCR_NORMALIZE_SCALE=True, OCR_DESKEW=True)
+
+
+def similarity(a, b):
+    # Compare word by word so line breaks and spacing don't count against a result
+    return difflib.SequenceMatcher(None, a.split(), b.split()).ratio()
+
+
+def expected_text(path):
+    truth = path.rsplit(".", 1)[0] + ".txt"
+    if os.path.exists(truth):
+        with open(truth) as f:
+            return f.read()
+    return None
+
+
+class Command(BaseCommand):
+    help = "Compare OCR time and accuracy with and without cropping/rescaling/deskewing receipts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--receipts", type=int, default=None)
+        parser.add_argument("--target-height", type=int, default=None)
+        parser.add_argument("--photo-scale", type=float, default=1.0, help="Enlarge the samples by this much first")
+
+    def handle(self, *args, **options):
+        receipts = sample_receipts()[: options["receipts"]]
+        cleaned = dict(CLEANED)
+        if options["target_height"]:
+            cleaned["OCR_TARGET_TEXT_HEIGHT"] = options["target_height"]
+
+        totals = {"full frame": [], "cleaned": []}
+        for path in receipts:
+            with open(path, "rb") as f:
+                image = load_image(f.read())
+            if options["photo_scale"] != 1:
+                image = cv2.resize(image, None, fx=options["photo_scale"], fy=options["photo_scale"])
+            truth = expected_text(path)
+            texts = {}
+            for mode, overrides in (("full frame", FULL_FRAME), ("cleaned", cleaned)):
+                with override_settings(OCR_SAVE_INTERMEDIATES=False, **overrides):
+                    start = time.perf_counter()
+                    processed = preprocess_image(image, path)
+                    prep = time.perf_counter() - start
+                try:
+                    start = time.perf_counter()
+                    texts[mode] = ENGINES["tesseract"].read(processed)
+                    ocr = time.perf_counter() - start
+                except OSError:  # includes TesseractNotFoundError
+                    texts[mode], ocr = None, None
+                totals[mode].append((prep, ocr, processed.size))
+
+                line = (
+                    f"{os.path.basename(path):<24} {mode:<10} "
+                    f"{processed.shape[1]:>5}x{processed.shape[0]:<5} "
+                    f"prep {prep * 1000:8.1f}ms"
+                )
+                if ocr is not None:
+                    line += f"  ocr {ocr * 1000:8.1f}ms"
+                    if truth is not None:
+                        line += f"  accuracy {similarity(texts[mode], truth):.2f}"
+                self.stdout.write(line)
+
+            if truth is None and None not in texts.values():
+                self.stdout.write(
+                    f"{'':<24} cleaned text matches full frame text {similarity(texts['cleaned'], texts['full frame']):.2f}"
+                )
+
+        if not receipts:
+            self.stderr.write("No sample receipts found")
+            return
+        for mode, timings in totals.items():
+            prep = statistics.median(t[0] for t in timings) * 1000
+            ocr = [t[1] for t in timings if t[1] is not None]
+            pixels = statistics.median(t[2] for t in timings) / 1e6
+            summary = f"{mode:<10} median {pixels:5.1f} MP  prep {prep:8.1f}ms"
+            if ocr:
+                summary += f"  median ocr {statistics.median(ocr) * 1000:8.1f}ms"
+            else:
+                summary += "  (tesseract not installed - OCR not timed)"
+            self.stdout.write(summary)
@@ -0,0 +1,34 @@
+# ------------------------------------------------------------------
+# OCRs a batch of receipts - image/PDF files, folders of them, or zip
+# archives - in parallel and writes one NDJSON line per receipt (text,
+# structured data, timings or the error), then a summary line.
+# usage: python manage.py ocr_batch partner_receipts.zip receipts/ --processes 4 > results.ndjson
+# ------------------------------------------------------------------
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.ocrapp.batch import iter_files, ndjson_lines, process_batch
+
+
+class Command(BaseCommand):
+    help = "OCR many receipts at once and write the results as NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Receipt files, folders or zip archives")
+        parser.add_argument("--processes", type=int, default=settings.OCR_BATCH_PROCESSES)
+        parser.add_argument("--no-ai", action="store_true", help="Only run OCR, skip Gemini")
+        parser.add_argument("--output", help="Write to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        results = process_batch(
+            iter_files(options["paths"]),
+            processes=options["processes"],
+            use_ai=not options["no_ai"],
+        )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.writelines(ndjson_lines(results))
+        else:
+            for line in ndjson_lines(results):
+                self.stdout.write(line, ending="")
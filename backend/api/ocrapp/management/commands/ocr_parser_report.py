@@ -0,0 +1,75 @@
+# ------------------------------------------------------------------
+# How much of the receipt corpus the local parser (api/ocrapp/parser.py)
+# handles without Gemini.
+# The corpus is the OCR text of every finished job and cached result, plus
+# any text files (or receipt images, which are OCR'd) given on the command
+# line. For receipts Gemini has already structured, the parser's total is
+# checked against Gemini's so a fast path that is quick but wrong shows up.
+# usage: python manage.py ocr_parser_report [--min-confidence 0.8] [paths ...]
+# ------------------------------------------------------------------
+
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.ocrapp.batch import iter_files
+from api.ocrapp.models import OcrJob, OcrResult
+from api.ocrapp.parser import parse_receipt
+from api.ocrapp.utils import extract_text_from_bytes
+
+
+def same_total(a, b):
+    try:
+        return abs(float(a) - float(b)) < 0.005
+    except (TypeError, ValueError):
+        return False
+
+
+class Command(BaseCommand):
+    help = "Report how many receipts the local parser can structure without Gemini"
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*", help="Extra .txt files, receipt images or folders")
+        parser.add_argument("--min-confidence", type=float, default=None)
+
+    def handle(self, *args, **options):
+        threshold = options["min_confidence"] or settings.OCR_PARSER_MIN_CONFIDENCE
+
+        corpus = {}  # text -> structured data we already have for it (or None)
+        for model in (OcrJob.objects.filter(status=OcrJob.DONE), OcrResult.objects.all()):
+            for text, data in model.values_list("extracted_text", "structured_data").iterator():
+                corpus.setdefault(text, data)
+        for path in options["paths"]:
+            if path.endswith(".txt"):
+                with open(path) as f:
+                    corpus.setdefault(f.read(), None)
+            else:
+                for name, data in iter_files([path]):
+                    corpus.setdefault(extract_text_from_bytes(data, name), None)
+        corpus = {text: data for text, data in corpus.items() if text and not text.startswith("Error")}
+        if not corpus:
+            self.stderr.write("No receipt text found")
+            return
+
+        fast = checked = agreed = 0
+        scores = Counter()
+        for text, known in corpus.items():
+            parsed = parse_receipt(text)
+            scores[min(int(parsed["confidence"] * 10), 9)] += 1
+            if parsed["confidence"] < threshold:
+                continue
+            fast += 1
+            if isinstance(known, dict) and known.get("source") != "parser" and "total_price" in known:
+                checked += 1
+                agreed += same_total(parsed["total_price"], known["total_price"])
+
+        total = len(corpus)
+        self.stdout.write(f"receipts        {total}")
+        self.stdout.write(f"fast path       {fast} ({fast / total:.0%}) at confidence >= {threshold}")
+        self.stdout.write(f"sent to Gemini  {total - fast} ({(total - fast) / total:.0%})")
+        if checked:
+            self.stdout.write(f"totals matching Gemini's on the fast path: {agreed}/{checked}")
+        self.stdout.write("confidence:")
+        for bucket in range(10):
+            self.stdout.write(f"  {bucket / 10:.1f}-{(bucket + 1) / 10:.1f}  {scores[bucket]}")
@@ -0,0 +1,34 @@
+# ------------------------------------------------------------------
+# Runs the OCR workers that process uploaded receipts (see api/ocrapp/jobs.py).
+# Keep this running alongside the web server, otherwise uploads stay queued.
+# usage: python manage.py ocr_worker --processes 2
+#        python manage.py ocr_worker --burst   (process the queue, then exit)
+# ------------------------------------------------------------------
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.ocrapp.worker import start_pool
+
+
+class Command(BaseCommand):
+    help = "Run worker processes for the receipt OCR queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=settings.OCR_WORKER_PROCESSES,
+            help="How many receipts can be processed at once",
+        )
+        parser.add_argument("--burst", action="store_true", help="Exit once the queue is empty")
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Starting {options['processes']} OCR worker(s)")
+        start_pool(
+            options["processes"],
+            burst=options["burst"],
+            poll_interval=options["poll_interval"],
+        )
+        self.stdout.write("OCR workers stopped")
@@ -0,0 +1,342 @@
+# ----------------------------------------------------------------
+# Lightweight timing and profiling for the OCR pipeline.
+# When a receipt takes 8 seconds this shows where the time went: each stage
+# (decode, preprocess, PDF rasterise, Tesseract, Gemini...) records its
+# duration in a histogram, alongside counters (cache hits, failed jobs...),
+# gauges (circuit breaker state) and image sizes. GET /api/ocr-metrics/ shows them as JSON or, with
+# ?format=prometheus, in Prometheus' text format.
+#
+# OCR runs in separate worker processes, so each process keeps its numbers in
+# memory and writes a snapshot ({pid}.json) to OCR_METRICS_DIR after every
+# job; the endpoint adds up all the snapshots. When a process has exited, the
+# next collect() folds its counters and histograms into its own
+# retired-{pid}.json and deletes the file - so totals keep the work of dead
+# processes, their gauges (an open breaker, say) stop counting, and the
+# directory only holds a file or two per live process. The directory is
+# meant to be local to one machine, since PIDs are checked there. With OCR_METRICS_ENABLED off, stage()
+# hands back a shared do-nothing context manager, so the cost is one setting
+# lookup per stage.
+#
+# profiled() captures a cProfile (or pyinstrument, if installed and chosen)
+# report for a single receipt - see the X-OCR-Profile header in views.py.
+# ref https://prometheus.io/docs/concepts/metric_types/#histogram
+# ref https://docs.python.org/3/library/profile.html
+# ----------------------------------------------------------------
+
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+from django.conf import settings
+
+# Upper bounds of the histogram buckets
+TIME_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+SIZE_BUCKETS_PX = [250_000, 500_000, 1_000_000, 2_000_000, 4_000_000, 8_000_000, 16_000_000]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        return {"buckets": self.buckets, "counts": self.counts, "count": self.count, "sum": self.sum}
+
+
+class Metrics:
+    """This process's stage timings, image sizes and counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()  # PDF pages are OCR'd on several threads
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.sizes = {}
+            self.counters = {}
+            self.gauges = {}
+
+    def observe_ms(self, name, ms):
+        with self._lock:
+            self.stages.setdefault(name, Histogram(TIME_BUCKETS_MS)).observe(ms)
+
+    def observe_size(self, name, pixels):
+        with self._lock:
+            self.sizes.setdefault(name, Histogram(SIZE_BUCKETS_PX)).observe(pixels)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stages": {name: h.snapshot() for name, h in self.stages.items()},
+                "sizes": {name: h.snapshot() for name, h in self.sizes.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+            }
+
+
+metrics = Metrics()
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        metrics.observe_ms(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+_NOOP = contextlib.nullcontext()
+
+
+def stage(name):
+    """`with stage("tesseract"): ...` records how long the block took."""
+    if not settings.OCR_METRICS_ENABLED:
+        return _NOOP
+    return _Stage(name)
+
+
+def incr(name, amount=1):
+    if settings.OCR_METRICS_ENABLED:
+        metrics.incr(name, amount)
+
+
+def set_gauge(name, value):
+    if settings.OCR_METRICS_ENABLED:
+        metrics.set_gauge(name, value)
+
+
+def observe_image(name, image):
+    """Record the size (in pixels) of a numpy image."""
+    if settings.OCR_METRICS_ENABLED:
+        metrics.observe_size(name, image.shape[0] * image.shape[1])
+
+
+# -- sharing between processes --------------------------------------
+
+
+def flush():
+    """Write this process's numbers to OCR_METRICS_DIR so the metrics endpoint can see them."""
+    if not settings.OCR_METRICS_ENABLED:
+        return
+    os.makedirs(settings.OCR_METRICS_DIR, exist_ok=True)
+    path = os.path.join(settings.OCR_METRICS_DIR, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(metrics.snapshot(), f)
+    os.replace(path + ".tmp", path)  # atomic, so a reader never sees half a file
+
+
+def _alive(pid):
+    if os.name == "nt":  # os.kill would end the process there; just keep its file
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # it exists, but belongs to another user
+        return True
+    return True
+
+
+def _merge(total, snapshot, gauges=True):
+    for kind in ("stages", "sizes"):
+        for name, h in snapshot.get(kind, {}).items():
+            merged = total[kind].setdefault(
+                name, {"buckets": h["buckets"], "counts": [0] * len(h["counts"]), "count": 0, "sum": 0.0}
+            )
+            merged["counts"] = [a + b for a, b in zip(merged["counts"], h["counts"])]
+            merged["count"] += h["count"]
+            merged["sum"] += h["sum"]
+    for kind in ("counters", "gauges") if gauges else ("counters",):
+        for name, value in snapshot.get(kind, {}).items():
+            total[kind][name] = total[kind].get(name, 0) + value
+
+
+def _empty():
+    return {"stages": {}, "sizes": {}, "counters": {}, "gauges": {}}
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+_retire_lock = threading.Lock()
+
+
+def _retire(dead):
+    """Fold the snapshot files of exited processes into this process's retired-{pid}.json."""
+    directory = settings.OCR_METRICS_DIR
+    mine = os.path.join(directory, f"retired-{os.getpid()}.json")
+    with _retire_lock:
+        retired = _read(mine) or _empty()
+        claimed = []
+        for name in dead:
+            path = os.path.join(directory, name)
+            claim = f"{path}.{os.getpid()}.claim"
+            try:
+                os.replace(path, claim)  # only one process gets to claim each file
+            except OSError:
+                continue
+            snapshot = _read(claim)
+            if snapshot is not None:
+                _merge(retired, snapshot, gauges=False)
+            claimed.append(claim)
+        if not claimed:
+            return
+        with open(mine + ".tmp", "w") as f:
+            json.dump(retired, f)
+        os.replace(mine + ".tmp", mine)
+        for claim in claimed:
+            os.remove(claim)
+
+
+def collect():
+    """All processes' numbers added together."""
+    total = _empty()
+    _merge(total, metrics.snapshot())
+    directory = settings.OCR_METRICS_DIR
+    if not os.path.isdir(directory):
+        return total
+
+    dead = []
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        pid = stem.removeprefix("retired-")
+        if ext != ".json" or not pid.isdigit():
+            continue  # .tmp / .claim files, or something else left in the directory
+        pid = int(pid)
+        if pid == os.getpid():
+            # Our in-memory numbers are newer than our file; our retired file is added below
+            continue
+        if not _alive(pid):
+            dead.append(name)
+            continue
+        snapshot = _read(os.path.join(directory, name))
+        if snapshot is not None:
+            _merge(total, snapshot)
+
+    if dead:
+        _retire(dead)
+    _merge(total, _read(os.path.join(directory, f"retired-{os.getpid()}.json")) or _empty())
+    # Gauges are added up too, e.g. llm_breaker_open is the number of live processes whose breaker is open
+    return total
+
+
+def percentile(h, q):
+    """Estimate the q (0-1) quantile of a histogram snapshot, the way Prometheus'
+    histogram_quantile does: linear interpolation inside the bucket it falls in."""
+    if not h["count"]:
+        return None
+    rank = q * h["count"]
+    running, lower = 0, 0
+    for bound, count in zip(h["buckets"], h["counts"]):
+        if count and running + count >= rank:
+            return lower + (bound - lower) * (rank - running) / count
+        running += count
+        lower = bound
+    return lower  # in the +Inf bucket - the best we can say is "more than the last bound"
+
+
+def clear():
+    """Forget every process's numbers (used by tests and after a deploy)."""
+    metrics.reset()
+    if os.path.isdir(settings.OCR_METRICS_DIR):
+        for name in os.listdir(settings.OCR_METRICS_DIR):
+            os.remove(os.path.join(settings.OCR_METRICS_DIR, name))
+
+
+def prometheus_text(total):
+    lines = []
+    for kind, metric in (("stages", "ocr_stage_ms"), ("sizes", "ocr_image_pixels")):
+        lines.append(f"# TYPE {metric} histogram")
+        for name, h in sorted(total[kind].items()):
+            running = 0
+            for bound, count in zip(h["buckets"] + ["+Inf"], h["counts"]):
+                running += count
+                lines.append(f'{metric}_bucket{{name="{name}",le="{bound}"}} {running}')
+            lines.append(f'{metric}_sum{{name="{name}"}} {h["sum"]:.3f}')
+            lines.append(f'{metric}_count{{name="{name}"}} {h["count"]}')
+    lines.append("# TYPE ocr_events_total counter")
+    for name, value in sorted(total["counters"].items()):
+        lines.append(f'ocr_events_total{{event="{name}"}} {value}')
+    lines.append("# TYPE ocr_state gauge")
+    for name, value in sorted(total["gauges"].items()):
+        lines.append(f'ocr_state{{name="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+# -- profiling ------------------------------------------------------
+
+
+class Profile:
+    report = ""
+
+
+@contextlib.contextmanager
+def profiled(enabled=True):
+    """Profile the block; the text report is on the yielded object afterwards."""
+    result = Profile()
+    if not enabled:
+        yield result
+        return
+
+    if settings.OCR_PROFILER == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            Profiler = None
+        if Profiler is not None:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield result
+            finally:
+                profiler.stop()
+                result.report = profiler.output_text()
+            return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield result
+    finally:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(30)
+        result.report = out.getvalue()
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ocrapp', '0002_ocrresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ocrjob',
+            name='profile_report',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='ocrjob',
+            name='profile_requested',
+            field=models.BooleanField(default=False),
+        ),
+    ]
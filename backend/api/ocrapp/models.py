@@ -0,0 +1,70 @@
+# ----------------------------------------------------------------
+# Models for the OCR app.
+# OcrJob is a receipt waiting for (or finished with) OCR + AI extraction.
+# The table doubles as the job queue, so no separate broker is needed -
+# see jobs.py for how workers claim and run them.
+# OcrResult caches finished results by file contents (see result_cache.py).
+# ----------------------------------------------------------------
+
+import uuid
+
+from django.db import models
+
+
+class OcrJob(models.Model):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    # A random id, so one person can't poll for someone else's receipt
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    file = models.CharField(max_length=255)  # name of the upload in default_storage
+    cache_key = models.CharField(max_length=64, blank=True, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+
+    extracted_text = models.TextField(blank=True)
+    structured_data = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    # Set by the X-OCR-Profile header - the worker profiles this job (see metrics.py)
+    profile_requested = models.BooleanField(default=False)
+    profile_report = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers look for the oldest queued job
+            models.Index(fields=["status", "created_at"], name="ocr_job_queue_idx"),
+        ]
+
+    def __str__(self):
+        return f"OcrJob {self.id} ({self.status})"
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+
+class OcrResult(models.Model):
+    # sha256 of the uploaded bytes + the OCR settings used
+    key = models.CharField(max_length=64, primary_key=True)
+    extracted_text = models.TextField()
+    structured_data = models.JSONField(null=True, blank=True)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"OcrResult {self.key[:12]}"
@@ -0,0 +1,205 @@
+# ----------------------------------------------------------------
+# Rule-based receipt parser - a fast path that skips Gemini.
+# Most till receipts look alike: the shop name at the top, a date, one line
+# per item ending in a price, and a TOTAL line. parse_receipt() reads those
+# with precompiled regexes and a lexicon of drinks, and scores how sure it is.
+# The strongest signal is arithmetic: if the item prices add up to the
+# printed total, the prices were read correctly.
+#
+# structure_receipt() uses the parsed result when its confidence is at least
+# OCR_PARSER_MIN_CONFIDENCE and only calls Gemini (generate_json_ai) otherwise,
+# which saves a network round trip and an API call for every well-printed
+# receipt. `manage.py ocr_parser_report` shows how much of the receipt
+# corpus stays on the fast path.
+#
+# Drink names are normalised the same way as PriceSubmission.save
+# ("flat white" -> "Flat White") so parsed items match submitted prices.
+# ref https://docs.python.org/3/library/re.html
+# ----------------------------------------------------------------
+
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+
+from .metrics import incr, stage
+from .utils import generate_json_ai, generate_json_ai_async
+
+BEVERAGES = [
+    "americano",
+    "babyccino",
+    "black coffee",
+    "cafe au lait",
+    "cappuccino",
+    "chai latte",
+    "coffee",
+    "cold brew",
+    "cortado",
+    "dirty chai",
+    "double espresso",
+    "espresso",
+    "filter coffee",
+    "flat white",
+    "frappe",
+    "frappuccino",
+    "green tea",
+    "hot chocolate",
+    "iced americano",
+    "iced coffee",
+    "iced latte",
+    "latte",
+    "long black",
+    "macchiato",
+    "matcha latte",
+    "mocha",
+    "piccolo",
+    "pour over",
+    "ristretto",
+    "tea",
+]
+
+# Longest names first so "iced latte" wins over "latte"
+BEVERAGE_RE = re.compile(
+    r"\b(" + "|".join(re.escape(name) for name in sorted(BEVERAGES, key=len, reverse=True)) + r")\b",
+    re.IGNORECASE,
+)
+
+# "2 x Flat White   £6.40 A" -> quantity, name, price (a trailing VAT code is allowed)
+ITEM_RE = re.compile(
+    r"^\s*(?:(?P<qty>\d{1,2})\s*[xX@]?\s+)?(?P<name>.*?[A-Za-z].*?)[\s.:]*"
+    r"[£$€]?\s*(?P<price>-?\d{1,4}[.,]\d{2})\s*[A-Z*]?\s*$"
+)
+TOTAL_RE = re.compile(r"\b(grand\s+total|total|amount\s+due|balance\s+due|to\s+pay)\b", re.IGNORECASE)
+SUBTOTAL_RE = re.compile(r"\bsub[\s-]?total\b", re.IGNORECASE)
+# Priced lines that aren't things that were bought
+NOT_ITEM_RE = re.compile(
+    r"\b(vat|tax|change|cash|card|visa|mastercard|amex|contactless|tendered|paid|tip|gratuity|balance|total)\b",
+    re.IGNORECASE,
+)
+NOT_NAME_RE = re.compile(
+    r"(\d{3}[\s-]?\d{3,4}[\s-]?\d{3,4}|www\.|https?:|@|\b(tel|phone|vat\s+(no|reg)|receipt|invoice|order|table|server)\b)",
+    re.IGNORECASE,
+)
+
+MONTHS = {m: i for i, m in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1
+)}
+NUMERIC_DATE_RE = re.compile(r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})\b")
+ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+TEXT_DATE_RE = re.compile(
+    r"\b(\d{1,2})(?:st|nd|rd|th)?\s+(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?,?\s+(\d{4}|\d{2})\b",
+    re.IGNORECASE,
+)
+
+# What each part found is worth towards the confidence score - without the
+# prices adding up a receipt can't reach the default OCR_PARSER_MIN_CONFIDENCE
+WEIGHTS = {"items": 0.3, "total": 0.2, "adds_up": 0.3, "date": 0.1, "establishment": 0.1}
+
+
+def normalise_beverage(name):
+    """Same normalisation as PriceSubmission.save, so "flat white" -> "Flat White"."""
+    return name.strip().title()
+
+
+def to_decimal(text):
+    try:
+        return Decimal(text.replace(",", "."))
+    except InvalidOperation:
+        return None
+
+
+def find_date(text):
+    """The first plausible date on the receipt as YYYY-MM-DD (UK day-first), or None."""
+    candidates = []
+    for m in ISO_DATE_RE.finditer(text):
+        candidates.append((m.start(), int(m[1]), int(m[2]), int(m[3])))
+    for m in NUMERIC_DATE_RE.finditer(text):
+        candidates.append((m.start(), int(m[3]), int(m[2]), int(m[1])))
+    for m in TEXT_DATE_RE.finditer(text):
+        candidates.append((m.start(), int(m[3]), MONTHS[m[2].lower()[:3]], int(m[1])))
+
+    for _, year, month, day in sorted(candidates):
+        if year < 100:
+            year += 2000
+        try:
+            return date(year, month, day).isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def find_establishment(lines):
+    """The shop name: the first wordy line near the top that isn't an address detail."""
+    for line in lines[:5]:
+        letters = sum(c.isalpha() for c in line)
+        if letters < 3 or NOT_NAME_RE.search(line) or ITEM_RE.match(line) or find_date(line):
+            continue
+        name = " ".join(line.split())
+        return name.title() if name.isupper() else name
+    return None
+
+
+def parse_receipt(text):
+    """Establishment, date, drinks and total from OCR text, plus a 0-1 confidence score."""
+    lines = [line for line in text.splitlines() if line.strip()]
+    items, total, line_sum = [], None, Decimal(0)
+
+    for line in lines:
+        match = ITEM_RE.match(line)
+        if not match:
+            continue
+        price = to_decimal(match["price"])
+        if price is None:
+            continue
+        if TOTAL_RE.search(line) and not SUBTOTAL_RE.search(line):
+            total = price  # the last total wins (some tills print one per tender)
+            continue
+        if NOT_ITEM_RE.search(line) or SUBTOTAL_RE.search(line):
+            continue
+        line_sum += price
+        beverage = BEVERAGE_RE.search(match["name"])
+        if beverage:
+            items.append({
+                "name": normalise_beverage(beverage[1]),
+                "quantity": int(match["qty"] or 1),
+                "price": float(price),
+            })
+
+    parsed = {
+        "establishment": find_establishment(lines),
+        "date": find_date(text),
+        "items": items,
+        "total_price": float(total) if total is not None else None,
+    }
+    found = {
+        "items": bool(items),
+        "total": total is not None,
+        "adds_up": total is not None and line_sum == total,
+        "date": parsed["date"] is not None,
+        "establishment": parsed["establishment"] is not None,
+    }
+    parsed["confidence"] = round(sum(WEIGHTS[part] for part, ok in found.items() if ok), 2)
+    return parsed
+
+
+def structure_receipt(text):
+    """Structured JSON for OCR text: the local parser's if it is confident, otherwise Gemini's."""
+    return fast_path(text) or generate_json_ai(text)
+
+
+async def structure_receipt_async(text):
+    return fast_path(text) or await generate_json_ai_async(text)
+
+
+def fast_path(text):
+    """The parsed receipt if the parser is confident enough, otherwise None."""
+    if not settings.OCR_PARSER_ENABLED or text.startswith("Error"):
+        return None
+    with stage("parser"):
+        parsed = parse_receipt(text)
+    if parsed["confidence"] >= settings.OCR_PARSER_MIN_CONFIDENCE:
+        incr("parser_fast_path")
+        return {**parsed, "source": "parser"}
+    incr("parser_fallbacks")
+    return None
@@ -0,0 +1,82 @@
+# ----------------------------------------------------------------
+# The receipt pipeline: OCR the image, then turn the text into structured
+# JSON - with the local parser when it is confident, otherwise Gemini (parser.py).
+# Shared by the job workers (jobs.py) and anything else that needs to process
+# a receipt.
+#
+# process_upload_async() is the same pipeline for the async views: the OCR
+# (CPU work) runs on a small thread pool of OCR_ASYNC_OCR_THREADS and the
+# Gemini call is awaited, so one ASGI worker can have hundreds of uploads in
+# flight while only a few are using the CPU. in_flight() caps how many can
+# be waiting at once (OCR_ASYNC_MAX_PENDING).
+# ref https://docs.python.org/3/library/asyncio-eventloop.html#executing-code-in-thread-or-process-pools
+# ----------------------------------------------------------------
+
+import asyncio
+import contextlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .parser import structure_receipt, structure_receipt_async
+from .utils import extract_text_from_bytes
+
+
+class QueueFull(Exception):
+    """Raised when too many receipts are already waiting to be processed."""
+
+
+def extract_stored(name):
+    """OCR text of an upload saved in default_storage.
+    The file is read once; decoding and preprocessing all happen in memory."""
+    with default_storage.open(name, "rb") as f:
+        data = f.read()
+    return extract_text_from_bytes(data, name)
+
+
+def process_receipt(name, use_ai=True):
+    """Run OCR (and optionally AI extraction) on an upload saved in default_storage."""
+    extracted_text = extract_stored(name)
+    structured_data = structure_receipt(extracted_text) if use_ai else None
+    return {"extracted_text": extracted_text, "structured_data": structured_data}
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+def ocr_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.OCR_ASYNC_OCR_THREADS, thread_name_prefix="ocr")
+        return _executor
+
+
+@contextlib.contextmanager
+def in_flight():
+    """Count an upload being processed; raises QueueFull beyond OCR_ASYNC_MAX_PENDING."""
+    global _in_flight
+    with _in_flight_lock:
+        if _in_flight >= settings.OCR_ASYNC_MAX_PENDING:
+            raise QueueFull(f"{_in_flight} receipts are already being processed")
+        _in_flight += 1
+    try:
+        yield
+    finally:
+        with _in_flight_lock:
+            _in_flight -= 1
+
+
+async def process_upload_async(name, use_ai=True):
+    """OCR (and optionally AI-extract) an upload saved in default_storage, without blocking the event loop.
+    The file is only read into memory by the OCR thread that works on it, so uploads
+    waiting their turn don't hold their bytes."""
+    loop = asyncio.get_running_loop()
+    extracted_text = await loop.run_in_executor(ocr_executor(), extract_stored, name)
+    structured_data = await structure_receipt_async(extracted_text) if use_ai else None
+    return {"extracted_text": extracted_text, "structured_data": structured_data}
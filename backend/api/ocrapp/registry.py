@@ -0,0 +1,89 @@
+# ----------------------------------------------------------------
+# One shared instance of each OCR / AI engine per process.
+# Creating an easyocr.Reader loads its detection and recognition models from
+# disk (seconds, and hundreds of MB), and the Gemini client was being
+# configured and rebuilt for every receipt. The registry creates each engine
+# the first time it is asked for and hands back the same one after that.
+# Workers can create them up front (OCR_WARM_ENGINES) so the first receipt
+# doesn't pay for it.
+#
+# Engines are dropped in a forked child, since torch threads and the gRPC
+# channel behind Gemini don't survive a fork - the child just builds its own.
+# ref https://docs.python.org/3/library/os.html#os.register_at_fork
+# ----------------------------------------------------------------
+
+import logging
+import os
+import threading
+
+import google.generativeai as genai
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _easyocr_reader():
+    import easyocr  # imported here as it loads torch, which only the EasyOCR engine needs
+
+    return easyocr.Reader(settings.OCR_EASYOCR_LANGUAGES, gpu=settings.OCR_EASYOCR_GPU)
+
+
+def _gemini_model():
+    api_key = os.getenv("TOKEN_API_GEMINI")  # Gemini API Key is stored in .env file
+    if not api_key:
+        raise ValueError("API Key is missing. Set TOKEN_API_GEMINI in .env")
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(settings.OCR_GEMINI_MODEL)
+
+
+def _llm_client():
+    from . import llm  # llm.py imports this module
+
+    return llm.ResilientClient(llm.CLIENTS[settings.OCR_LLM_BACKEND]())
+
+
+FACTORIES = {
+    "easyocr": _easyocr_reader,
+    "gemini": _gemini_model,
+    "llm": _llm_client,  # the client generate_json_ai talks to, see llm.py
+}
+
+_engines = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def reset():
+    """Forget every engine (they are rebuilt on next use)."""
+    global _lock, _pid
+    _engines.clear()
+    # A fresh lock too: after a fork the old one may be held by a thread that no longer exists
+    _lock = threading.Lock()
+    _pid = os.getpid()
+
+
+os.register_at_fork(after_in_child=reset)
+
+
+def get(name):
+    """The shared engine called `name`, created on first use."""
+    if os.getpid() != _pid:
+        reset()  # forked without going through os.fork() (e.g. some process managers)
+
+    engine = _engines.get(name)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(name)
+            if engine is None:
+                engine = _engines[name] = FACTORIES[name]()
+    return engine
+
+
+def warm(names=None):
+    """Create engines ahead of time (defaults to settings.OCR_WARM_ENGINES)."""
+    for name in settings.OCR_WARM_ENGINES if names is None else names:
+        try:
+            get(name)
+        except Exception as e:
+            # Not fatal - the engine is tried again when a receipt needs it
+            logger.warning("Could not load OCR engine %s: %s", name, e)
@@ -0,0 +1,135 @@
+# ----------------------------------------------------------------
+# Retries and a circuit breaker for calls to flaky upstream services (Gemini).
+# retry() repeats a call that failed with a transient error (503, 429,
+# timeouts, dropped connections), waiting longer each time - exponential
+# backoff with jitter so workers that failed together don't all retry
+# together.
+# CircuitBreaker stops calling an upstream that keeps failing: after
+# `failure_threshold` failures in a row it "opens" and every call fails
+# straight away with CircuitOpen, instead of each request waiting for its
+# own timeout. After `reset_timeout` seconds one trial call is let through
+# ("half open"); if it works the breaker closes again, if not it stays open.
+# Both have async versions for the async views (retry_async, call_async).
+# ref https://martinfowler.com/bliki/CircuitBreaker.html
+# ref https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+# ----------------------------------------------------------------
+
+import asyncio
+import random
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+from .metrics import incr, set_gauge
+
+# Errors worth trying again - anything else (bad API key, bad request...) won't fix itself
+TRANSIENT_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.TooManyRequests,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+def retry(func, retries, backoff, max_backoff, transient=TRANSIENT_ERRORS, name="call", sleep=time.sleep):
+    """Call func(), retrying transient errors up to `retries` times with exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except transient:
+            if attempt == retries:
+                raise
+            incr(f"{name}_retries")
+            sleep(backoff_delay(attempt, backoff, max_backoff))
+
+
+async def retry_async(func, retries, backoff, max_backoff, transient=TRANSIENT_ERRORS, name="call"):
+    """retry() for a coroutine function; waits with asyncio.sleep so the event loop keeps going."""
+    for attempt in range(retries + 1):
+        try:
+            return await func()
+        except transient:
+            if attempt == retries:
+                raise
+            incr(f"{name}_retries")
+            await asyncio.sleep(backoff_delay(attempt, backoff, max_backoff))
+
+
+def backoff_delay(attempt, backoff, max_backoff):
+    # "Full jitter": anywhere between 0 and the exponential delay
+    return random.uniform(0, min(max_backoff, backoff * 2**attempt))
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream that the breaker has marked as unhealthy."""
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def call(self, func):
+        self._before_call()
+        try:
+            result = func()
+        except Exception:
+            self._failed()
+            raise
+        self._succeeded()
+        return result
+
+    async def call_async(self, func):
+        self._before_call()
+        try:
+            result = await func()
+        except Exception:
+            self._failed()
+            raise
+        self._succeeded()
+        return result
+
+    def _before_call(self):
+        """Raise CircuitOpen unless a call may go ahead."""
+        with self.lock:
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self.trial_running):
+                incr(f"{self.name}_short_circuited")
+                raise CircuitOpen(f"{self.name} is unavailable (circuit open)")
+            if self.state == self.HALF_OPEN:
+                self.trial_running = True
+
+    def _failed(self):
+        with self.lock:
+            self.trial_running = False
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    incr(f"{self.name}_breaker_opened")
+                self.opened_at = self.clock()
+                self._set_state(self.OPEN)
+
+    def _succeeded(self):
+        with self.lock:
+            self.trial_running = False
+            self.failures = 0
+            self._set_state(self.CLOSED)
+
+    def _set_state(self, state):
+        self.state = state
+        # 1 for the current state and 0 for the others, so each is its own time series
+        for each in (self.CLOSED, self.OPEN, self.HALF_OPEN):
+            set_gauge(f"{self.name}_breaker_{each}", int(each == state))
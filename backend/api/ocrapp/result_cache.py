@@ -0,0 +1,114 @@
+# ----------------------------------------------------------------
+# Cache of finished OCR + AI results, keyed by what was uploaded.
+# People often upload the same receipt photo more than once, and every copy
+# used to pay for Tesseract and a Gemini round-trip again. The key is the
+# sha256 of the file's bytes plus the OCR settings (engines, Tesseract config,
+# crop/scale/deskew and sharpening settings, PDF settings, parser and Gemini
+# model), so changing any of those is a miss.
+# Results live in the OcrResult table, which is kept to
+# OCR_RESULT_CACHE_MAX_ENTRIES by dropping the least recently used rows.
+# ref https://docs.python.org/3/library/hashlib.html
+# ----------------------------------------------------------------
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import utils
+from .metrics import incr
+from .models import OcrResult
+
+
+def config_fingerprint():
+    return json.dumps(
+        {
+            "engines": [settings.OCR_ENGINES, settings.OCR_MIN_WORDS, settings.OCR_RACE],
+            "tesseract": utils.TESSERACT_CONFIG,
+            "kernel": utils.SHARPEN_KERNEL,
+            "imaging": [
+                settings.OCR_CROP_TO_RECEIPT,
+                settings.OCR_NORMALIZE_SCALE,
+                settings.OCR_TARGET_TEXT_HEIGHT,
+                settings.OCR_DESKEW,
+            ],
+            "pdf": [
+                settings.OCR_PDF_DPI,
+                settings.OCR_PDF_MAX_PAGES,
+                settings.OCR_PDF_TEXT_MIN_CHARS,
+            ],
+            "ai": [
+                settings.OCR_LLM_BACKEND,
+                settings.OCR_GEMINI_MODEL,
+                settings.OCR_PARSER_ENABLED,
+                settings.OCR_PARSER_MIN_CONFIDENCE,
+            ],
+        },
+        sort_keys=True,
+    )
+
+
+def key_for(uploaded_file):
+    """Cache key for an upload, or "" when the cache is turned off."""
+    return _key(uploaded_file.chunks())
+
+
+def key_for_bytes(data):
+    return _key([data])
+
+
+def _key(chunks):
+    if not settings.OCR_RESULT_CACHE_ENABLED:
+        return ""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    digest.update(config_fingerprint().encode())
+    return digest.hexdigest()
+
+
+def lookup(key):
+    """The cached {"extracted_text", "structured_data"} for a key, or None."""
+    if not key:
+        return None
+    result = OcrResult.objects.filter(key=key).first()
+    incr("cache_hits" if result else "cache_misses")
+    if result is None:
+        return None
+    OcrResult.objects.filter(key=key).update(hits=F("hits") + 1, last_used=timezone.now())
+    return {"extracted_text": result.extracted_text, "structured_data": result.structured_data}
+
+
+def cacheable(result):
+    """Errors aren't cached, so the next upload of the receipt gets another try."""
+    data = result["structured_data"]
+    return (
+        not result["extracted_text"].startswith("Error")
+        and isinstance(data, dict)
+        and "error" not in data
+    )
+
+
+def store(key, result):
+    if not key or not cacheable(result):
+        return
+    OcrResult.objects.update_or_create(
+        key=key,
+        defaults={
+            "extracted_text": result["extracted_text"],
+            "structured_data": result["structured_data"],
+            "last_used": timezone.now(),
+        },
+    )
+    evict()
+
+
+def evict(max_entries=None):
+    """Drop the least recently used results beyond the size limit."""
+    max_entries = settings.OCR_RESULT_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+    if OcrResult.objects.count() <= max_entries:
+        return
+    stale = OcrResult.objects.order_by("-last_used").values_list("key", flat=True)[max_entries:]
+    OcrResult.objects.filter(key__in=list(stale)).delete()
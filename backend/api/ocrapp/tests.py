@@ -11,20 +11,44 @@ from django.urls import reverse
 import os
 import unittest
 from unittest.mock import patch, MagicMock
-from api.ocrapp import utils
+from api.ocrapp import engines, imaging, registry, utils
+from django.conf import settings
+from django.test import override_settings
+import cv2
 import numpy as np
+import tempfile
+import time
+from PIL import Image
+
+
+# A small white PNG, encoded in memory like an upload
+def png_bytes():
+    return cv2.imencode(".png", np.full((20, 20), 255, dtype=np.uint8))[1].tobytes()
+
+
+# Uploads are checked by their first bytes, so fake ones start like a real JPEG
+JPEG = b"\xff\xd8\xff\xe0"
 
 
 class OCRUtilsTests(unittest.TestCase):
+    # Engines are shared per process, so don't let one test's mocks leak into the next
+    def setUp(self):
+        registry.reset()
+        # Tesseract only - falling back to EasyOCR would load its models
+        engines_only = override_settings(OCR_ENGINES=["tesseract"])
+        engines_only.enable()
+        self.addCleanup(engines_only.disable)
 
-    # Tests that valid file extensions are accepted
+    # Tests that receipt file types are accepted, whatever they are called
     def test_allowed_file_valid(self):
-        self.assertTrue(utils.allowed_file("receipt.jpg"))
-        self.assertTrue(utils.allowed_file("file.PDF"))
+        self.assertTrue(utils.allowed_file(SimpleUploadedFile("receipt.jpg", JPEG + b"photo")))
+        self.assertTrue(utils.allowed_file(SimpleUploadedFile("receipt", png_bytes())))
+        self.assertTrue(utils.allowed_file(SimpleUploadedFile("file.PDF", b"%PDF-1.4")))
 
-    # Tests that invalid file extensions are rejected
+    # Tests that other files are rejected, even with a receipt's extension
     def test_allowed_file_invalid(self):
-        self.assertFalse(utils.allowed_file("file.exe"))
+        self.assertFalse(utils.allowed_file(SimpleUploadedFile("file.exe", b"MZ\x90\x00")))
+        self.assertFalse(utils.allowed_file(SimpleUploadedFile("receipt.jpg", b"MZ\x90\x00")))
 
     # Simulates successful conversion from HEIC to JPG
     @patch("subprocess.run")
@@ -47,25 +71,73 @@ class OCRUtilsTests(unittest.TestCase):
         self.assertIsNone(result)
 
     # Simulates Tesseract returning no text and checks error handling
-    @patch("api.ocrapp.utils.pytesseract.image_to_string", return_value="   ")
-    @patch("api.ocrapp.utils.preprocess_image", return_value="dummy.png")
-    @patch("PIL.Image.open")
-    def test_extract_text_no_text(self, mock_image, mock_preprocess, mock_ocr):
-        result = utils.extract_text("dummy.jpg")
+    @patch("pytesseract.image_to_string", return_value="   ")
+    def test_extract_text_no_text(self, mock_ocr):
+        result = utils.extract_text_from_bytes(png_bytes(), "dummy.png")
         self.assertEqual(result, "Error: No text found in OCR.")
 
     # This simulates a crash in preprocessing and checks error response
     @patch("api.ocrapp.utils.preprocess_image", side_effect=Exception("crash"))
     def test_extract_text_generic_exception(self, mock_preprocess):
-        result = utils.extract_text("crash.jpg")
+        result = utils.extract_text_from_bytes(png_bytes(), "crash.jpg")
+        self.assertIn("Error processing file", result)
+
+    # Files that aren't images come back as an error rather than crashing
+    def test_extract_text_undecodable_file(self):
+        result = utils.extract_text_from_bytes(b"not an image", "broken.jpg")
         self.assertIn("Error processing file", result)
 
     # Simulates an empty PDF and ensures correct error message
-    @patch("api.ocrapp.utils.convert_from_path", return_value=[])
-    def test_extract_text_empty_pdf(self, mock_convert):
-        result = utils.extract_text("empty.pdf")
+    @patch("api.ocrapp.utils.pdfinfo_from_bytes", return_value={"Pages": 0})
+    def test_extract_text_empty_pdf(self, mock_info):
+        result = utils.extract_text_from_bytes(b"%PDF-1.4", "empty.pdf")
         self.assertEqual(result, "Error: No images found in PDF.")
 
+    # Pages with a text layer skip rasterising and OCR altogether
+    @patch("api.ocrapp.utils.convert_from_bytes")
+    @patch("api.ocrapp.utils.subprocess.run")
+    @patch("api.ocrapp.utils.pdfinfo_from_bytes", return_value={"Pages": 2})
+    def test_pdf_text_layer_used(self, mock_info, mock_run, mock_convert):
+        mock_run.return_value = MagicMock(
+            stdout=b"Latte 3.00 Flat White 3.20\fTotal paid 6.20 thank you\f"
+        )
+        result = utils.extract_text_from_bytes(b"%PDF-1.4", "invoice.pdf")
+        self.assertEqual(result, "Latte 3.00 Flat White 3.20\n\nTotal paid 6.20 thank you")
+        mock_convert.assert_not_called()
+
+    # Only pages without text are rasterised, and the text is merged in page order
+    @patch("pytesseract.image_to_string", return_value="Scanned page")
+    @patch("api.ocrapp.utils.convert_from_bytes")
+    @patch("api.ocrapp.utils.subprocess.run")
+    @patch("api.ocrapp.utils.pdfinfo_from_bytes", return_value={"Pages": 3})
+    def test_pdf_only_scanned_pages_ocrd(self, mock_info, mock_run, mock_convert, mock_ocr):
+        mock_run.return_value = MagicMock(
+            stdout=b"Page one has plenty of text\f\fPage three has plenty of text\f"
+        )
+        mock_convert.return_value = [Image.new("L", (20, 20), 255)]
+        result = utils.extract_text_from_bytes(b"%PDF-1.4", "invoice.pdf")
+        self.assertEqual(
+            result.split("\n\n"),
+            ["Page one has plenty of text", "Scanned page", "Page three has plenty of text"],
+        )
+        self.assertEqual(mock_convert.call_args.kwargs["first_page"], 2)
+        self.assertEqual(mock_convert.call_args.kwargs["last_page"], 2)
+
+    # Without pdftotext every page is OCR'd, up to the page limit
+    @override_settings(OCR_PDF_MAX_PAGES=2, OCR_PDF_WORKERS=1)
+    @patch("pytesseract.image_to_string", side_effect=["First", "Second"])
+    @patch("api.ocrapp.utils.convert_from_bytes")
+    @patch("api.ocrapp.utils.subprocess.run", side_effect=FileNotFoundError)
+    @patch("api.ocrapp.utils.pdfinfo_from_bytes", return_value={"Pages": 50})
+    def test_pdf_page_limit(self, mock_info, mock_run, mock_convert, mock_ocr):
+        mock_convert.return_value = [Image.new("L", (20, 20), 255) for _ in range(2)]
+        result = utils.extract_text_from_bytes(b"%PDF-1.4", "long.pdf")
+        self.assertEqual(result, "First\n\nSecond")
+        self.assertEqual(mock_convert.call_args.kwargs["last_page"], 2)
+
+    def test_page_runs(self):
+        self.assertEqual(utils.page_runs([1, 2, 3, 5, 7, 8]), [(1, 3), (5, 5), (7, 8)])
+
     # Mocks EasyOCR and checks if text is correctly extracted
     @patch("easyocr.Reader")
     def test_easyocr_extract_text(self, mock_reader_class):
@@ -75,57 +147,54 @@ class OCRUtilsTests(unittest.TestCase):
         text = utils.easyocr_extract_text("sample.jpg")
         self.assertIn("Latte", text)
 
-    # And this ensures preprocessed image file is saved successfully
-    @patch("cv2.imread")
-    @patch("cv2.filter2D")
-    @patch("cv2.imwrite")
-    @patch("os.path.exists", return_value=True)
-    def test_preprocess_image_saves_file(
-        self, mock_exists, mock_imwrite, mock_filter2D, mock_imread
-    ):
-        mock_imread.return_value = MagicMock()
-        mock_filter2D.return_value = MagicMock()
-        result = utils.preprocess_image("sample.jpg")
-        self.assertIn("_preprocessed.png", result)
-
-    # Checks behavior when image save fails but path still returns
-    @patch("cv2.imread", return_value=np.zeros((100, 100), dtype=np.uint8))
-    @patch("cv2.filter2D", return_value=np.zeros((100, 100), dtype=np.uint8))
-    @patch("cv2.imwrite", return_value=False)
-    @patch("os.path.exists", return_value=False)
-    def test_preprocess_image_save_failure(
-        self, mock_exists, mock_imwrite, mock_filter2D, mock_imread
-    ):
-        result = utils.preprocess_image("fail_save.jpg")
-        self.assertIn("_preprocessed.png", result)
+    # Preprocessing happens in memory and nothing is written to disk
+    @patch("api.ocrapp.utils.default_storage.save")
+    def test_preprocess_image_in_memory(self, mock_save):
+        image = np.zeros((100, 100), dtype=np.uint8)
+        result = utils.preprocess_image(image, "sample.jpg")
+        self.assertEqual(result.shape, (100, 100))
+        mock_save.assert_not_called()
+
+    # In debug mode the preprocessed image is kept for inspection
+    @override_settings(OCR_SAVE_INTERMEDIATES=True)
+    @patch("api.ocrapp.utils.default_storage.save", return_value="ocr_debug/sample_preprocessed.png")
+    def test_preprocess_image_debug_save(self, mock_save):
+        utils.preprocess_image(np.zeros((100, 100), dtype=np.uint8), "receipts/sample.jpg")
+        self.assertEqual(mock_save.call_args[0][0], "ocr_debug/sample_preprocessed.png")
 
-    # Simulates Tesseract OCR flow and checks extracted content
-    @patch("api.ocrapp.utils.preprocess_image")
+    # Simulates Tesseract OCR flow and checks the image is handed over as an array
     @patch("pytesseract.image_to_string")
-    def test_extract_text_with_tesseract(self, mock_ocr, mock_preprocess):
-        mock_ocr.return_value = "Latte \u00a33.00"
-        mock_preprocess.return_value = "sample_preprocessed.png"
-        with patch("PIL.Image.open"):  # mock Image.open
-            result = utils.extract_text("sample.jpg")
+    def test_extract_text_with_tesseract(self, mock_ocr):
+        mock_ocr.return_value = "Latte \u00a33.00 Total"
+        result = utils.extract_text_from_bytes(png_bytes(), "sample.png")
         self.assertIn("Latte", result)
+        self.assertIsInstance(mock_ocr.call_args[0][0], np.ndarray)
 
     # Simulates EasyOCR flow and checks extracted content
-    @patch("api.ocrapp.utils.preprocess_image")
-    @patch("api.ocrapp.utils.easyocr_extract_text")
-    def test_extract_text_with_easyocr(self, mock_easyocr, mock_preprocess):
+    @patch("api.ocrapp.engines.EasyOCREngine.read")
+    def test_extract_text_with_easyocr(self, mock_easyocr):
         mock_easyocr.return_value = "Latte 3.00"
-        mock_preprocess.return_value = "sample_preprocessed.png"
-        result = utils.extract_text("sample.jpg", use_easyocr=True)
+        result = utils.extract_text_from_bytes(png_bytes(), "sample.png", use_easyocr=True)
         self.assertIn("Latte", result)
 
+    # extract_text still works on a file path
+    # (three words, so the default OCR_ENGINES don't fall back to a real EasyOCR)
+    @patch("pytesseract.image_to_string", return_value="Latte 3.00 Total")
+    def test_extract_text_from_path(self, mock_ocr):
+        with tempfile.NamedTemporaryFile(suffix=".png") as f:
+            f.write(png_bytes())
+            f.flush()
+            self.assertEqual(utils.extract_text(f.name), "Latte 3.00 Total")
+        self.assertIn("Error processing file", utils.extract_text("missing.jpg"))
+
     # Checks error returned when trying to generate AI JSON from poor input
     def test_generate_json_ai_with_poor_text(self):
         result = utils.generate_json_ai("hi")
         self.assertIn("error", result)
 
     # Simulates successful Gemini AI JSON generation
-    @patch("api.ocrapp.utils.genai.GenerativeModel")
-    @patch("api.ocrapp.utils.genai.configure")
+    @patch("google.generativeai.GenerativeModel")
+    @patch("google.generativeai.configure")
     @patch("os.getenv", return_value="fake-key")
     def test_generate_json_ai_success(
         self, mock_getenv, mock_configure, mock_model_class
@@ -140,8 +209,8 @@ class OCRUtilsTests(unittest.TestCase):
         self.assertEqual(result["establishment"], "Cafe")
 
     # This simulates AI returning invalid JSON and checks error handling
-    @patch("api.ocrapp.utils.genai.GenerativeModel")
-    @patch("api.ocrapp.utils.genai.configure")
+    @patch("google.generativeai.GenerativeModel")
+    @patch("google.generativeai.configure")
     @patch("os.getenv", return_value="fake-key")
     def test_generate_json_ai_invalid_json(
         self, mock_getenv, mock_configure, mock_model_class
@@ -156,6 +225,156 @@ class OCRUtilsTests(unittest.TestCase):
         self.assertIn("error", result)
 
 
+# Tests the per-process engine registry
+class OCREngineRegistryTests(unittest.TestCase):
+    def setUp(self):
+        registry.reset()
+        self.factory = MagicMock(side_effect=lambda: object())
+        self.patcher = patch.dict(registry.FACTORIES, {"fake": self.factory})
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        registry.reset()
+
+    # The engine is only created once and then reused
+    def test_engine_reused(self):
+        self.assertIs(registry.get("fake"), registry.get("fake"))
+        self.assertEqual(self.factory.call_count, 1)
+
+    # A forked child builds its own engine instead of using the parent's
+    def test_new_engine_after_fork(self):
+        first = registry.get("fake")
+        with patch("api.ocrapp.registry.os.getpid", return_value=-1):
+            self.assertIsNot(registry.get("fake"), first)
+
+    # Warming creates the engines up front and doesn't fail on a broken one
+    def test_warm(self):
+        with patch.dict(registry.FACTORIES, {"broken": MagicMock(side_effect=OSError)}):
+            with self.assertLogs("api.ocrapp.registry", "WARNING"):
+                registry.warm(["fake", "broken"])
+        self.assertEqual(self.factory.call_count, 1)
+        registry.get("fake")
+        self.assertEqual(self.factory.call_count, 1)
+
+    # EasyOCR's Reader is only constructed once across calls
+    @patch("easyocr.Reader")
+    def test_easyocr_reader_reused(self, mock_reader_class):
+        mock_reader_class.return_value.readtext.return_value = ["Latte"]
+        utils.easyocr_extract_text("a.jpg")
+        utils.easyocr_extract_text("b.jpg")
+        mock_reader_class.assert_called_once()
+
+
+# Tests choosing between OCR engines, falling back and racing
+class OCREngineTests(unittest.TestCase):
+    def use(self, **stubs):
+        patcher = patch.dict(engines.ENGINES, stubs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # The first engine that reads enough words wins and the rest aren't run
+    @override_settings(OCR_MIN_WORDS=3)
+    def test_first_good_result_used(self):
+        self.use(a=engines.StubEngine("Latte 3.00 Total 3.00"), b=MagicMock())
+        self.assertEqual(engines.recognise(None, ["a", "b"]), "Latte 3.00 Total 3.00")
+        engines.ENGINES["b"].read.assert_not_called()
+
+    # Too few words (or an error) moves on to the next engine
+    @override_settings(OCR_MIN_WORDS=3)
+    def test_fallback(self):
+        broken = MagicMock(timeout=None, enforces_timeout=False)
+        broken.name = "broken"
+        broken.read.side_effect = RuntimeError("crashed")
+        self.use(a=engines.StubEngine("L@tte"), b=broken, c=engines.StubEngine("Latte 3.00 Total 3.00"))
+        with self.assertLogs("api.ocrapp.engines", "WARNING"):
+            self.assertEqual(engines.recognise(None, ["a", "b", "c"]), "Latte 3.00 Total 3.00")
+
+    # If nothing reads enough words the best attempt is kept; if everything fails the error is raised
+    @override_settings(OCR_MIN_WORDS=3)
+    def test_best_effort_and_failure(self):
+        self.use(a=engines.StubEngine("L@tte"), b=engines.StubEngine("Latte 3.00"))
+        self.assertEqual(engines.recognise(None, ["a", "b"]), "Latte 3.00")
+        with patch("pytesseract.image_to_string", side_effect=RuntimeError("Tesseract process timeout")):
+            with self.assertLogs("api.ocrapp.engines", "WARNING"):
+                self.assertRaises(RuntimeError, engines.recognise, None, ["tesseract"])
+
+    # Engines that can't stop themselves are abandoned at their timeout
+    @override_settings(OCR_ENGINE_TIMEOUTS={"stub": 0.05})
+    def test_timeout(self):
+        self.use(stub=engines.StubEngine(delay=1))
+        with self.assertLogs("api.ocrapp.engines", "WARNING"):
+            self.assertRaises(TimeoutError, engines.recognise, None, ["stub"])
+
+    # Racing returns the quickest acceptable result without waiting for the slow engine
+    @override_settings(OCR_RACE=True, OCR_MIN_WORDS=3, OCR_ENGINE_TIMEOUTS={})
+    def test_race(self):
+        self.use(
+            slow=engines.StubEngine("Slow but readable receipt", delay=1),
+            poor=engines.StubEngine("L@tte"),
+            fast=engines.StubEngine("Latte 3.00 Total 3.00", delay=0.05),
+        )
+        start = time.perf_counter()
+        self.assertEqual(engines.recognise(None, ["slow", "poor", "fast"]), "Latte 3.00 Total 3.00")
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    # Tesseract's location and timeout come from the settings
+    @override_settings(OCR_TESSERACT_CMD="/usr/local/bin/tesseract", OCR_ENGINE_TIMEOUTS={"tesseract": 7})
+    @patch("pytesseract.image_to_string", return_value="Latte 3.00 Total 3.00")
+    def test_tesseract_settings(self, mock_ocr):
+        engines.recognise(None, ["tesseract"])
+        self.assertEqual(engines.pytesseract.pytesseract.tesseract_cmd, "/usr/local/bin/tesseract")
+        self.assertEqual(mock_ocr.call_args.kwargs["timeout"], 7)
+
+
+# A fake phone photo: a receipt with ~35px tall text, tilted by `angle`, lying on a dark table
+def receipt_photo(angle=0):
+    paper = np.full((2200, 900), 245, dtype=np.uint8)
+    for i in range(30):
+        cv2.putText(paper, f"LATTE {i} 3.{i:02d}", (60, 80 + i * 65), cv2.FONT_HERSHEY_SIMPLEX, 1.6, 0, 3)
+    matrix = cv2.getRotationMatrix2D((450, 1100), angle, 1.0)
+    paper = cv2.warpAffine(paper, matrix, (900, 2200), borderValue=245)
+    photo = np.full((3000, 2400), 60, dtype=np.uint8)
+    photo[400:2600, 700:1600] = paper
+    return photo
+
+
+# Tests the crop / rescale / deskew steps that run before OCR
+class OCRImagingTests(unittest.TestCase):
+    # Cropping keeps the receipt and drops most of the table round it
+    def test_crop_to_receipt(self):
+        cropped = imaging.crop_to_receipt(receipt_photo())
+        self.assertLess(cropped.size, receipt_photo().size / 2)
+        self.assertGreaterEqual(cropped.shape[0], 2200)
+        self.assertGreaterEqual(cropped.shape[1], 900)
+
+    # A photo with nothing to find in it is left alone
+    def test_blank_image_unchanged(self):
+        image = np.zeros((100, 100), dtype=np.uint8)
+        self.assertIs(imaging.crop_to_receipt(image), image)
+        self.assertIs(imaging.normalize_scale(image, 30), image)
+        self.assertIs(imaging.deskew(image), image)
+
+    # Text is resized to about the target height
+    def test_normalize_scale(self):
+        photo = receipt_photo()
+        self.assertAlmostEqual(imaging.text_height(photo), 35, delta=5)
+        smaller = imaging.normalize_scale(photo, 15)
+        self.assertLess(smaller.shape[0], photo.shape[0] / 2)
+        self.assertAlmostEqual(imaging.text_height(smaller), 15, delta=3)
+
+    # A tilted receipt is measured and straightened
+    def test_deskew(self):
+        cropped = imaging.crop_to_receipt(receipt_photo(angle=4))
+        self.assertAlmostEqual(abs(imaging.skew_angle(cropped)), 4, delta=0.5)
+        self.assertLess(abs(imaging.skew_angle(imaging.deskew(cropped))), 1)
+
+    # preprocess_image hands Tesseract a smaller image when the text is bigger than needed
+    @override_settings(OCR_TARGET_TEXT_HEIGHT=20)
+    def test_preprocess_shrinks_photo(self):
+        self.assertLess(utils.preprocess_image(receipt_photo()).size, receipt_photo().size / 4)
+
+
 # Ensures the test file can run on its own
 if __name__ == "__main__":
     unittest.main()
@@ -173,3 +392,740 @@ class OCRExtractEndpointTest(TestCase):
         response = self.client.post("/api/ocr-extract/")
         self.assertEqual(response.status_code, 400)
         self.assertIn("error", response.json())
+
+
+# Tests for the OCR job queue (jobs.py) and the job endpoints
+import shutil
+from datetime import timedelta
+from django.utils import timezone
+from api.ocrapp import jobs
+from api.ocrapp.models import OcrJob
+
+TEMP_MEDIA = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA, OCR_MAX_QUEUED_JOBS=3, OCR_JOB_MAX_ATTEMPTS=2)
+class OCRJobQueueTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA, ignore_errors=True)
+
+    def upload(self, url="/api/ocr-extract/", field="image"):
+        image = SimpleUploadedFile("receipt.jpg", JPEG + b"fake image", content_type="image/jpeg")
+        return self.client.post(url, {field: image})
+
+    # Uploading returns a job id straight away without running OCR
+    @patch("api.ocrapp.pipeline.extract_text_from_bytes")
+    def test_upload_returns_job(self, mock_extract):
+        response = self.upload()
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        self.assertEqual(data["status"], "queued")
+        self.assertEqual(data["status_url"], f"/api/ocr-jobs/{data['job_id']}/")
+        mock_extract.assert_not_called()
+
+    # The upload view in mycoffeeapp queues jobs too
+    def test_upload_file_returns_job(self):
+        response = self.upload("/api/upload/", "file")
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(OcrJob.objects.get().file.startswith("uploads/"))
+
+    # A worker runs the job and the results appear on the job endpoint
+    @patch("api.ocrapp.parser.generate_json_ai", return_value={"establishment": "Cafe"})
+    @patch("api.ocrapp.pipeline.extract_text_from_bytes", return_value="Latte 3.00")
+    def test_worker_processes_job(self, mock_extract, mock_ai):
+        job_id = self.upload().json()["job_id"]
+        self.assertEqual(jobs.work("test", burst=True), 1)
+
+        data = self.client.get(f"/api/ocr-jobs/{job_id}/").json()
+        self.assertEqual(data["status"], "done")
+        self.assertEqual(data["extracted_text"], "Latte 3.00")
+        self.assertEqual(data["structured_data"], {"establishment": "Cafe"})
+
+    # A job can only be claimed once
+    def test_claim_is_exclusive(self):
+        OcrJob.objects.create(file="receipts/a.jpg")
+        self.assertIsNotNone(jobs.claim("one"))
+        self.assertIsNone(jobs.claim("two"))
+
+    # Errors are retried, then the job is marked as failed
+    @patch("api.ocrapp.pipeline.extract_text_from_bytes", side_effect=RuntimeError("boom"))
+    def test_failed_job_is_retried(self, mock_extract):
+        self.upload()
+        job = OcrJob.objects.get()
+        with self.assertLogs("api.ocrapp.jobs", "ERROR"):
+            jobs.work("test", burst=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), ("failed", 2, "boom"))
+
+    # Uploads are refused once the queue is full
+    def test_queue_limit(self):
+        for _ in range(3):
+            OcrJob.objects.create(file="receipts/a.jpg")
+        response = self.upload()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+
+    # Jobs left running by a dead worker are put back in the queue
+    def test_stale_jobs_requeued(self):
+        job = OcrJob.objects.create(file="receipts/a.jpg", status=OcrJob.RUNNING, attempts=1)
+        OcrJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=1))
+        jobs.requeue_stale()
+        job.refresh_from_db()
+        self.assertEqual(job.status, OcrJob.QUEUED)
+
+    # Long polling gives up after ?wait= seconds and returns the current status
+    def test_long_poll_times_out(self):
+        job = OcrJob.objects.create(file="receipts/a.jpg")
+        response = self.client.get(f"/api/ocr-jobs/{job.pk}/?wait=0.3")
+        self.assertEqual(response.json()["status"], "queued")
+        self.assertEqual(self.client.get(f"/api/ocr-jobs/{job.pk}/?wait=x").status_code, 400)
+
+    # A long poll returns as soon as the job finishes, and other requests carry on meanwhile
+    async def test_long_poll_returns_when_done(self):
+        import asyncio
+
+        job = await OcrJob.objects.acreate(file="receipts/a.jpg")
+
+        async def finish():
+            await asyncio.sleep(0.3)
+            await OcrJob.objects.filter(pk=job.pk).aupdate(status=OcrJob.DONE)
+
+        started = time.monotonic()
+        response, _ = await asyncio.gather(self.async_client.get(f"/api/ocr-jobs/{job.pk}/?wait=10"), finish())
+        self.assertEqual(response.json()["status"], "done")
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_unknown_job(self):
+        response = self.client.get("/api/ocr-jobs/00000000-0000-0000-0000-000000000000/")
+        self.assertEqual(response.status_code, 404)
+
+
+# Tests the cache of OCR results for receipts uploaded more than once
+from api.ocrapp import result_cache
+from api.ocrapp.models import OcrResult
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA, OCR_RESULT_CACHE_MAX_ENTRIES=2)
+class OCRResultCacheTests(TestCase):
+    def upload(self, content=b"same receipt"):
+        image = SimpleUploadedFile("receipt.jpg", JPEG + content, content_type="image/jpeg")
+        return self.client.post("/api/ocr-extract/", {"image": image})
+
+    # A receipt that was processed before is answered from the cache without a new job
+    @patch("api.ocrapp.parser.generate_json_ai", return_value={"establishment": "Cafe"})
+    @patch("api.ocrapp.pipeline.extract_text_from_bytes", return_value="Latte 3.00")
+    def test_repeat_upload_served_from_cache(self, mock_extract, mock_ai):
+        self.upload()
+        jobs.work("test", burst=True)
+
+        response = self.upload()
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data["cached"])
+        self.assertEqual(data["structured_data"], {"establishment": "Cafe"})
+        self.assertEqual(OcrJob.objects.count(), 1)
+        self.assertEqual(mock_extract.call_count, 1)
+        self.assertEqual(OcrResult.objects.get().hits, 1)
+
+    # The same receipt uploaded again while it is still queued shares the job
+    def test_in_flight_upload_shares_job(self):
+        first = self.upload().json()["job_id"]
+        self.assertEqual(self.upload().json()["job_id"], first)
+        self.assertNotEqual(self.upload(b"another receipt").json()["job_id"], first)
+
+    # Failed OCR / AI results are not cached
+    @patch("api.ocrapp.parser.generate_json_ai", return_value={"error": "too poor"})
+    @patch("api.ocrapp.pipeline.extract_text_from_bytes", return_value="hi")
+    def test_errors_not_cached(self, mock_extract, mock_ai):
+        self.upload()
+        jobs.work("test", burst=True)
+        self.assertFalse(OcrResult.objects.exists())
+        self.assertEqual(self.upload().status_code, 202)
+
+    # Changing the OCR settings changes the key
+    def test_key_includes_config(self):
+        image = SimpleUploadedFile("receipt.jpg", JPEG + b"same receipt")
+        key = result_cache.key_for(image)
+        with patch("api.ocrapp.utils.TESSERACT_CONFIG", "--psm 6"):
+            self.assertNotEqual(result_cache.key_for(image), key)
+
+    # Only the most recently used results are kept
+    def test_lru_eviction(self):
+        result = {"extracted_text": "Latte", "structured_data": {}}
+        result_cache.store("a" * 64, result)
+        result_cache.store("b" * 64, result)
+        result_cache.lookup("a" * 64)
+        result_cache.store("c" * 64, result)
+        self.assertEqual(
+            sorted(OcrResult.objects.values_list("key", flat=True)), ["a" * 64, "c" * 64]
+        )
+
+
+# Tests batch OCR (batch.py), the ocr_batch command and the batch API
+import io
+import json
+import zipfile
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from api.ocrapp import batch
+
+
+def fake_ocr(data, name):
+    return "Error: No text found in OCR." if b"blank" in data else f"Latte 3.00 from {name}"
+
+
+@patch("api.ocrapp.parser.generate_json_ai", return_value={"establishment": "Cafe"})
+@patch("api.ocrapp.batch.extract_text_from_bytes", side_effect=fake_ocr)
+class OCRBatchTests(TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        with open(os.path.join(self.folder, "a.jpg"), "wb") as f:
+            f.write(JPEG + b"receipt a")
+        with open(os.path.join(self.folder, "notes.txt"), "wb") as f:
+            f.write(b"not a receipt")
+        self.zip_path = os.path.join(self.folder, "partner.zip")
+        with zipfile.ZipFile(self.zip_path, "w") as archive:
+            archive.writestr("b.png", png_bytes() + b"receipt b")
+            archive.writestr("c.jpg", JPEG + b"blank")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    # Folders and zip archives are expanded, skipping files that aren't receipts
+    def test_iter_files(self, mock_ocr, mock_ai):
+        names = [os.path.basename(name) for name, _ in batch.iter_files([self.folder])]
+        self.assertEqual(names, ["a.jpg", "b.png", "c.jpg"])
+
+    # Every file gets a result with timings, and failures are reported per file
+    def test_process_batch(self, mock_ocr, mock_ai):
+        results = {
+            os.path.basename(r["file"]): r
+            for r in batch.process_batch(batch.iter_files([self.folder]), processes=1)
+        }
+        self.assertTrue(results["a.jpg"]["ok"])
+        self.assertEqual(results["a.jpg"]["structured_data"], {"establishment": "Cafe"})
+        self.assertEqual(set(results["a.jpg"]["timings"]), {"ocr", "ai"})
+        self.assertFalse(results["c.jpg"]["ok"])
+        self.assertEqual(results["c.jpg"]["error"], "Error: No text found in OCR.")
+        self.assertEqual(mock_ai.call_count, 2)  # not called for the failed OCR
+
+        # Running the batch again is served from the result cache
+        again = list(batch.process_batch(batch.iter_files([self.folder]), processes=1))
+        self.assertEqual(sum(r.get("cached", False) for r in again), 2)
+        self.assertEqual(mock_ai.call_count, 2)
+
+    # The command writes NDJSON with a summary line at the end
+    def test_ocr_batch_command(self, mock_ocr, mock_ai):
+        out = io.StringIO()
+        call_command("ocr_batch", self.zip_path, "--processes", "1", "--no-ai", stdout=out)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[-1]["summary"]["files"], 2)
+        self.assertEqual(lines[-1]["summary"]["failed"], 1)
+        mock_ai.assert_not_called()
+
+    # The API streams NDJSON back, and is for staff only
+    @override_settings(OCR_BATCH_PROCESSES=1)
+    def test_batch_api(self, mock_ocr, mock_ai):
+        from rest_framework.test import APIClient
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        with open(self.zip_path, "rb") as f:
+            upload = SimpleUploadedFile("partner.zip", f.read())
+        single = SimpleUploadedFile("d.jpg", JPEG + b"receipt d")
+        client = APIClient()
+
+        self.assertEqual(client.post("/api/ocr-batch/", {"files": [single]}).status_code, 401)
+        user = User.objects.create_user(username="user", password="pass123")
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+        self.assertEqual(client.post("/api/ocr-batch/", {"files": [single]}).status_code, 403)
+        # A logged in session isn't enough, so a cross-site form can't start a batch
+        staff = User.objects.create_user(username="staff", password="pass123", is_staff=True)
+        client.credentials()
+        client.force_login(staff)
+        self.assertEqual(client.post("/api/ocr-batch/", {"files": [single]}).status_code, 401)
+
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(staff)}")
+        single.seek(0)  # the refused requests above read it
+        response = client.post("/api/ocr-batch/", {"files": [upload, single]})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(
+            sorted(line["file"] for line in lines[:-1]),
+            ["d.jpg", "partner.zip/b.png", "partner.zip/c.jpg"],
+        )
+        self.assertEqual(lines[-1]["summary"]["failed"], 1)
+
+
+# Tests the OCR stage timings, metrics endpoint and profiling header
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.ocrapp import metrics
+
+METRICS_DIR = tempfile.mkdtemp()
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA, OCR_METRICS_DIR=METRICS_DIR, OCR_METRICS_ENABLED=True, OCR_ENGINES=["tesseract"]
+)
+class OCRMetricsTests(TestCase):
+    def setUp(self):
+        metrics.clear()
+        self.staff = User.objects.create_user(username="staff", password="pass123", is_staff=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)
+
+    # Each stage's time lands in its histogram, along with image sizes
+    @patch("pytesseract.image_to_string", return_value="Latte 3.00 Total")
+    def test_stages_recorded(self, mock_ocr):
+        utils.extract_text_from_bytes(png_bytes(), "receipt.png")
+        snapshot = metrics.metrics.snapshot()
+        for name in ("decode", "preprocess", "tesseract"):
+            self.assertEqual(snapshot["stages"][name]["count"], 1)
+        self.assertEqual(snapshot["sizes"]["upload"]["sum"], 400)
+
+    # Turned off, nothing is recorded
+    @override_settings(OCR_METRICS_ENABLED=False)
+    def test_disabled(self):
+        with metrics.stage("tesseract"):
+            pass
+        metrics.incr("cache_hits")
+        self.assertEqual(metrics.metrics.snapshot(), {"stages": {}, "sizes": {}, "counters": {}, "gauges": {}})
+
+    # Numbers written by other processes are added together
+    def test_collect_merges_processes(self):
+        metrics.incr("jobs_done")
+        with open(os.path.join(METRICS_DIR, "999999.json"), "w") as f:
+            json.dump({"stages": {}, "sizes": {}, "counters": {"jobs_done": 2}}, f)
+        self.assertEqual(metrics.collect()["counters"]["jobs_done"], 3)
+
+    # An exited process's counts are kept, but its gauges stop counting and its file goes
+    def test_collect_retires_dead_processes(self):
+        import subprocess
+        import sys
+
+        child = subprocess.Popen([sys.executable, "-c", "pass"])
+        child.wait()
+        with open(os.path.join(METRICS_DIR, f"{child.pid}.json"), "w") as f:
+            json.dump({"counters": {"jobs_done": 2}, "gauges": {"llm_breaker_open": 1}}, f)
+        with open(os.path.join(METRICS_DIR, "notes.json"), "w") as f:
+            f.write("{}")  # not a snapshot - ignored
+
+        for _ in range(2):  # the second time the counts come from retired-{pid}.json
+            total = metrics.collect()
+            self.assertEqual(total["counters"]["jobs_done"], 2)
+            self.assertEqual(total["gauges"], {})
+        self.assertEqual(
+            sorted(os.listdir(METRICS_DIR)), sorted(["notes.json", f"retired-{os.getpid()}.json"])
+        )
+
+    # The endpoint shows timings from the workers, as JSON or Prometheus text
+    @patch("api.ocrapp.parser.generate_json_ai", return_value={"establishment": "Cafe"})
+    @patch("api.ocrapp.pipeline.extract_text_from_bytes", return_value="Latte 3.00")
+    def test_metrics_endpoint(self, mock_extract, mock_ai):
+        self.assertEqual(self.client.get("/api/ocr-metrics/").status_code, 401)
+        self.client.force_login(self.staff)  # a session isn't enough, it takes a JWT
+        self.assertEqual(self.client.get("/api/ocr-metrics/").status_code, 401)
+
+        self.client.post("/api/ocr-extract/", {"image": SimpleUploadedFile("r.jpg", JPEG + b"abc")})
+        jobs.work("test", burst=True)
+        # Make it look like the job ran in another worker process, which only left its file
+        os.replace(
+            os.path.join(METRICS_DIR, f"{os.getpid()}.json"), os.path.join(METRICS_DIR, "1.json")
+        )
+        metrics.metrics.reset()
+
+        token = f"Bearer {AccessToken.for_user(self.staff)}"
+        data = self.client.get("/api/ocr-metrics/", HTTP_AUTHORIZATION=token).json()
+        self.assertEqual(data["stages"]["job"]["count"], 1)
+        self.assertEqual(data["counters"]["jobs_done"], 1)
+
+        response = self.client.get("/api/ocr-metrics/?format=prometheus", HTTP_AUTHORIZATION=token)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        text = response.content.decode()
+        self.assertIn('ocr_stage_ms_count{name="job"} 1', text)
+        self.assertIn('ocr_events_total{event="jobs_done"} 1', text)
+
+    # Staff can ask for a profile of one receipt with the X-OCR-Profile header
+    @patch("api.ocrapp.parser.generate_json_ai", return_value={"establishment": "Cafe"})
+    @patch("api.ocrapp.pipeline.extract_text_from_bytes", return_value="Latte 3.00")
+    def test_profile_header(self, mock_extract, mock_ai):
+        image = SimpleUploadedFile("r.jpg", JPEG + b"abc")
+        anonymous = self.client.post("/api/ocr-extract/", {"image": image}, HTTP_X_OCR_PROFILE="1")
+        self.assertFalse(OcrJob.objects.get(pk=anonymous.json()["job_id"]).profile_requested)
+        image = SimpleUploadedFile("r1.jpg", JPEG + b"abcde")
+        bad_token = self.client.post(
+            "/api/ocr-extract/", {"image": image}, HTTP_X_OCR_PROFILE="1", HTTP_AUTHORIZATION="Bearer nonsense"
+        )
+        self.assertFalse(OcrJob.objects.get(pk=bad_token.json()["job_id"]).profile_requested)
+
+        image = SimpleUploadedFile("r2.jpg", JPEG + b"abcd")
+        job_id = self.client.post(
+            "/api/ocr-extract/", {"image": image}, HTTP_X_OCR_PROFILE="1",
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.staff)}",
+        ).json()["job_id"]
+        jobs.work("test", burst=True)
+        data = self.client.get(f"/api/ocr-jobs/{job_id}/").json()
+        self.assertIn("function calls", data["profile"])
+
+
+# Tests for the rule-based parser that lets clear receipts skip Gemini
+from api.ocrapp import parser
+from priceapp.models import PriceSubmission
+
+TILL_RECEIPT = """THE DAILY GRIND
+12 High Street, Belfast
+Tel: 028 9012 3456
+Date: 14/03/2025 10:32
+2 x Flat White      £6.40
+Oat Latte            3.45 A
+Croissant            2.50
+SUBTOTAL            12.35
+VAT 20%              2.06
+TOTAL               £12.35
+Card                12.35
+"""
+
+
+class OCRParserTests(TestCase):
+    # A typical till receipt is read completely and with full confidence
+    def test_parse_till_receipt(self):
+        parsed = parser.parse_receipt(TILL_RECEIPT)
+        self.assertEqual(parsed["establishment"], "The Daily Grind")
+        self.assertEqual(parsed["date"], "2025-03-14")
+        self.assertEqual(
+            parsed["items"],
+            [
+                {"name": "Flat White", "quantity": 2, "price": 6.4},
+                {"name": "Latte", "quantity": 1, "price": 3.45},
+            ],
+        )
+        self.assertEqual(parsed["total_price"], 12.35)
+        self.assertEqual(parsed["confidence"], 1.0)
+
+    # Prices that don't add up to the total (a misread digit) lower the confidence
+    def test_misread_price_lowers_confidence(self):
+        parsed = parser.parse_receipt(TILL_RECEIPT.replace("3.45 A", "8.45 A"))
+        self.assertLess(parsed["confidence"], settings.OCR_PARSER_MIN_CONFIDENCE)
+        self.assertLess(parser.parse_receipt("blurry 3.2 nothing")["confidence"], 0.5)
+
+    def test_find_date(self):
+        self.assertEqual(parser.find_date("2025-03-14 10:00"), "2025-03-14")
+        self.assertEqual(parser.find_date("14.03.25"), "2025-03-14")
+        self.assertEqual(parser.find_date("Friday 14th March 2025"), "2025-03-14")
+        self.assertIsNone(parser.find_date("99/99/2025"))
+
+    # Drink names come out the same as PriceSubmission stores them
+    def test_beverage_names_match_submissions(self):
+        submission = PriceSubmission.objects.create(
+            establishment="Cafe", date="2025-03-14", beverage=" flat white ", price="3.20", submitter_name="a"
+        )
+        self.assertEqual(parser.normalise_beverage(" flat white "), submission.beverage)
+
+    # Gemini is only called when the parser isn't confident
+    @patch("api.ocrapp.parser.generate_json_ai", return_value={"establishment": "Cafe"})
+    def test_structure_receipt(self, mock_ai):
+        self.assertEqual(parser.structure_receipt(TILL_RECEIPT)["source"], "parser")
+        mock_ai.assert_not_called()
+        self.assertEqual(parser.structure_receipt("Latte 3.00"), {"establishment": "Cafe"})
+        with override_settings(OCR_PARSER_ENABLED=False):
+            parser.structure_receipt(TILL_RECEIPT)
+        self.assertEqual(mock_ai.call_count, 2)
+
+    # The report counts the corpus kept on the fast path
+    def test_parser_report(self):
+        OcrResult.objects.create(key="a", extracted_text=TILL_RECEIPT, structured_data={"total_price": "12.35"})
+        OcrResult.objects.create(key="b", extracted_text="Latte 3.00", structured_data={})
+        out = io.StringIO()
+        call_command("ocr_parser_report", stdout=out)
+        self.assertIn("fast path       1 (50%)", out.getvalue())
+        self.assertIn("totals matching Gemini's on the fast path: 1/1", out.getvalue())
+
+
+# Tests for the LLM client interface and its offline fake
+from django.test import SimpleTestCase
+from api.ocrapp import llm
+
+
+@override_settings(OCR_LLM_BACKEND="fake")
+class OCRFakeLLMTests(SimpleTestCase):
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+
+    # The fake answers with JSON built from the receipt text, after its latency
+    @override_settings(OCR_FAKE_LLM={"latency": 0.05})
+    def test_fake_answers_from_text(self):
+        self.assertIsInstance(llm.client().client, llm.FakeLLMClient)
+        start = time.perf_counter()
+        result = utils.generate_json_ai(TILL_RECEIPT)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+        self.assertEqual(result["establishment"], "The Daily Grind")
+        self.assertEqual(result["total_price"], 12.35)
+
+    # Upstream errors and broken JSON come back as errors, just like Gemini's
+    @override_settings(OCR_LLM_RETRIES=0)
+    def test_fake_failures(self):
+        with override_settings(OCR_FAKE_LLM={"latency": 0, "error_rate": 1}):
+            registry.reset()
+            self.assertIn("Failed to generate", utils.generate_json_ai(TILL_RECEIPT)["error"])
+        with override_settings(OCR_FAKE_LLM={"latency": 0, "malformed_rate": 1}):
+            registry.reset()
+            self.assertIn("Failed to parse", utils.generate_json_ai(TILL_RECEIPT)["error"])
+
+    # The same seed gives the same run of failures
+    def test_fake_is_deterministic(self):
+        def outcomes():
+            fake = llm.FakeLLMClient(latency=0, error_rate=0.5, seed=7)
+            results = []
+            for _ in range(20):
+                try:
+                    fake.generate("Extracted text:\nLatte 3.00")
+                    results.append(True)
+                except Exception:
+                    results.append(False)
+            return results
+
+        self.assertEqual(outcomes(), outcomes())
+        self.assertIn(False, outcomes())
+        self.assertIn(True, outcomes())
+
+
+# Tests for the timeouts, retries and circuit breaker around the LLM
+from google.api_core import exceptions as google_exceptions
+from api.ocrapp import resilience
+
+
+class FakeClock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class OCRResilienceTests(SimpleTestCase):
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+
+    # Transient errors are retried with growing waits; others aren't retried at all
+    def test_retry(self):
+        waits = []
+        func = MagicMock(side_effect=[google_exceptions.ServiceUnavailable("503"), TimeoutError(), "ok"])
+        result = resilience.retry(func, retries=2, backoff=1, max_backoff=8, sleep=waits.append)
+        self.assertEqual(result, "ok")
+        self.assertEqual(len(waits), 2)
+        self.assertTrue(0 <= waits[0] <= 1 and 0 <= waits[1] <= 2)
+
+        func = MagicMock(side_effect=ValueError("bad key"))
+        self.assertRaises(ValueError, resilience.retry, func, 2, 1, 8, sleep=waits.append)
+        self.assertEqual(func.call_count, 1)
+
+    # The breaker opens after repeated failures, fails fast, then lets one trial call through
+    def test_circuit_breaker(self):
+        clock = FakeClock()
+        breaker = resilience.CircuitBreaker("test", failure_threshold=2, reset_timeout=30, clock=clock)
+        failing = MagicMock(side_effect=ConnectionError)
+        for _ in range(2):
+            self.assertRaises(ConnectionError, breaker.call, failing)
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertRaises(resilience.CircuitOpen, breaker.call, failing)
+        self.assertEqual(failing.call_count, 2)
+
+        # A failed trial call opens it again; a good one closes it
+        clock.now = 31
+        self.assertRaises(ConnectionError, breaker.call, failing)
+        self.assertRaises(resilience.CircuitOpen, breaker.call, failing)
+        clock.now = 62
+        self.assertEqual(breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.assertEqual(metrics.metrics.snapshot()["gauges"]["test_breaker_closed"], 1)
+
+    # A slow upstream is cut off at the timeout
+    @override_settings(
+        OCR_LLM_BACKEND="fake", OCR_FAKE_LLM={"latency": 5}, OCR_LLM_TIMEOUT=0.05, OCR_LLM_RETRIES=0
+    )
+    def test_timeout(self):
+        start = time.perf_counter()
+        self.assertIn("no reply within", utils.generate_json_ai(TILL_RECEIPT)["error"])
+        self.assertLess(time.perf_counter() - start, 1)
+
+    # While Gemini is down, receipts get an OCR-text-only answer straight away
+    @override_settings(
+        OCR_LLM_BACKEND="fake",
+        OCR_FAKE_LLM={"latency": 0, "error_rate": 1},
+        OCR_LLM_RETRIES=1,
+        OCR_LLM_BACKOFF=0,
+        OCR_LLM_BREAKER_FAILURES=2,
+    )
+    def test_fails_fast_when_upstream_down(self):
+        for _ in range(2):
+            self.assertIn("Failed to generate", utils.generate_json_ai(TILL_RECEIPT)["error"])
+        self.assertEqual(llm.client().client.calls, 4)  # each with one retry
+        result = utils.generate_json_ai(TILL_RECEIPT)
+        self.assertTrue(result["ai_unavailable"])
+        self.assertEqual(llm.client().client.calls, 4)
+
+    def test_percentile(self):
+        h = metrics.Histogram([10, 20, 40])
+        for value in [5] * 50 + [15] * 45 + [30] * 5:
+            h.observe(value)
+        self.assertEqual(metrics.percentile(h.snapshot(), 0.5), 10)
+        self.assertEqual(metrics.percentile(h.snapshot(), 0.95), 20)
+        self.assertIsNone(metrics.percentile(metrics.Histogram([10]).snapshot(), 0.5))
+
+
+# Tests for the async upload views
+import asyncio
+from django.test import AsyncClient
+
+ASYNC_SETTINGS = dict(
+    OCR_ENGINES=["stub"],
+    OCR_LLM_BACKEND="fake",
+    OCR_FAKE_LLM={"latency": 0.2},
+    OCR_PARSER_ENABLED=False,
+    MEDIA_ROOT=TEMP_MEDIA,
+)
+
+
+@override_settings(**ASYNC_SETTINGS)
+class OCRAsyncViewTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.addCleanup(shutil.rmtree, TEMP_MEDIA, ignore_errors=True)
+
+    def upload(self, client, i, url="/api/ocr-extract/async/", field="image"):
+        image = SimpleUploadedFile(f"r{i}.png", png_bytes() + str(i).encode())
+        return client.post(url, {field: image})
+
+    # The results come back in the response, and the file is kept like the queued path keeps it
+    async def test_extract_async(self):
+        response = await self.upload(AsyncClient(), 1)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["extracted_text"], "Latte 3.00\nTotal 3.00")
+        self.assertEqual(data["structured_data"]["total_price"], 3.0)
+        self.assertTrue(os.path.exists(os.path.join(TEMP_MEDIA, "receipts", "r1.png")))
+
+        # The same receipt again comes from the cache
+        again = (await self.upload(AsyncClient(), 1)).json()
+        self.assertTrue(again["cached"])
+
+    # Uploads wait on the LLM together rather than one after another
+    async def test_concurrent_uploads(self):
+        client = AsyncClient()
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(self.upload(client, i) for i in range(20)))
+        self.assertEqual({r.status_code for r in responses}, {200})
+        self.assertLess(time.perf_counter() - start, 2)  # 20 x 0.2s one after another would be 4s
+
+    @override_settings(OCR_ASYNC_MAX_PENDING=0)
+    async def test_busy(self):
+        response = await self.upload(AsyncClient(), 1)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "10")
+
+    async def test_upload_file_async(self):
+        client = AsyncClient()
+        response = await self.upload(client, 1, url="/api/upload/async/", field="file")
+        self.assertEqual(response.status_code, 200)
+        bad = await client.post("/api/upload/async/", {"file": SimpleUploadedFile("r.exe", b"MZ\x90\x00")})
+        self.assertEqual(bad.status_code, 400)
+
+
+# Tests for the upload checks: file types by magic bytes, size limits and streaming
+import tracemalloc
+from django.test import RequestFactory
+from api.ocrapp import uploads, views as ocr_views
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA)
+class OCRUploadTests(TestCase):
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, TEMP_MEDIA, ignore_errors=True)
+
+    def test_sniff(self):
+        self.assertEqual(uploads.sniff(png_bytes()), "png")
+        self.assertEqual(uploads.sniff(JPEG + b"photo"), "jpeg")
+        self.assertEqual(uploads.sniff(b"\x00\x00\x00\x18ftypheic\x00\x00"), "heic")
+        self.assertEqual(uploads.sniff(b"%PDF-1.7\n"), "pdf")
+        self.assertEqual(uploads.sniff(b"PK\x03\x04rest"), "zip")
+        self.assertEqual(uploads.sniff("Café receipt".encode()[:4]), "txt")  # cut mid-character
+        self.assertIsNone(uploads.sniff(b"MZ\x90\x00"))
+        self.assertIsNone(uploads.sniff(b""))
+
+    # A renamed file is judged by its contents
+    def test_wrong_type_refused(self):
+        upload = SimpleUploadedFile("receipt.jpg", b"MZ\x90\x00")
+        response = self.client.post("/api/ocr-extract/", {"image": upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OcrJob.objects.exists())
+
+    # An oversized file is cut off part way through and nothing is queued
+    @override_settings(OCR_UPLOAD_MAX_BYTES=100 * 1024)
+    def test_file_too_large(self):
+        upload = SimpleUploadedFile("big.jpg", JPEG + bytes(150 * 1024))
+        response = self.client.post("/api/ocr-extract/", {"image": upload})
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(OcrJob.objects.exists())
+
+    # The limit is only installed on the receipt views - other uploads keep the whole file
+    @override_settings(OCR_UPLOAD_MAX_BYTES=100 * 1024)
+    def test_limit_only_on_receipt_views(self):
+        for url in ("/api/upload/", "/api/upload/async/"):
+            upload = SimpleUploadedFile("big.jpg", JPEG + bytes(150 * 1024))
+            self.assertEqual(self.client.post(url, {"file": upload}).status_code, 413, url)
+
+        upload = SimpleUploadedFile("big.jpg", JPEG + bytes(150 * 1024))
+        request = RequestFactory().post("/api/prices/", {"file": upload})
+        self.assertEqual(request.FILES["file"].size, len(JPEG) + 150 * 1024)
+        self.assertFalse(uploads.too_large(request))
+
+    # A Content-Length that is already too big is refused before the body is read
+    @override_settings(OCR_UPLOAD_MAX_BYTES=1024)
+    def test_declared_length_too_large(self):
+        upload = SimpleUploadedFile("big.jpg", JPEG + bytes(100 * 1024))
+        request = RequestFactory().post("/api/ocr-extract/", {"image": upload})
+        with patch.object(request, "_load_post_and_files") as parse:
+            self.assertTrue(uploads.too_large(request))
+        parse.assert_not_called()
+
+    # A 20 MB PDF is streamed through to storage, never held in memory whole
+    def test_large_pdf_memory_bounded(self):
+        pdf = b"%PDF-1.4\n" + os.urandom(20 * 1024 * 1024)
+        request = RequestFactory().post("/api/ocr-extract/", {"image": SimpleUploadedFile("big.pdf", pdf)})
+        request.user = MagicMock(is_staff=False)
+        del pdf
+        tracemalloc.start()
+        try:
+            response = ocr_views.ocr_extract(request)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            request.close()  # as the request handler would, tidying up the temp file
+        self.assertEqual(response.status_code, 202)
+        self.assertLess(peak, 2 * 1024 * 1024)
+        job = OcrJob.objects.get()
+        self.assertEqual(os.path.getsize(os.path.join(TEMP_MEDIA, job.file)), 20 * 1024 * 1024 + 9)
+
+    # Long PDFs are rasterised a few pages at a time, not all at once
+    @override_settings(OCR_PDF_WORKERS=2)
+    @patch("pytesseract.image_to_string", return_value="Scanned page")
+    @patch("api.ocrapp.utils.convert_from_bytes")
+    @patch("api.ocrapp.utils.subprocess.run", side_effect=FileNotFoundError)
+    @patch("api.ocrapp.utils.pdfinfo_from_bytes", return_value={"Pages": 5})
+    def test_pdf_pages_rasterised_in_pieces(self, mock_info, mock_run, mock_convert, mock_ocr):
+        mock_convert.side_effect = lambda data, first_page, last_page, **kwargs: [
+            Image.new("L", (20, 20), 255) for _ in range(first_page, last_page + 1)
+        ]
+        with override_settings(OCR_ENGINES=["tesseract"]):
+            result = utils.extract_text_from_bytes(b"%PDF-1.4", "long.pdf")
+        self.assertEqual(result.split("\n\n"), ["Scanned page"] * 5)
+        pieces = [(c.kwargs["first_page"], c.kwargs["last_page"]) for c in mock_convert.call_args_list]
+        self.assertEqual(pieces, [(1, 2), (3, 4), (5, 5)])
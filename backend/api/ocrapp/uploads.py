@@ -0,0 +1,120 @@
+# ----------------------------------------------------------------
+# Checks on uploaded files before any OCR work is done.
+# File types are recognised from the first bytes of the file ("magic
+# bytes"), not from its name: a renamed .exe is refused, and a photo whose
+# name has no extension is still accepted.
+#
+# Size: the receipt views are wrapped in limit_upload_size, which puts
+# LimitedUploadHandler ahead of Django's own upload handlers for that request
+# only (other uploads - price receipts, the admin - keep Django's defaults).
+# It counts each file's bytes as Django reads them from the request and stops
+# reading once a file passes OCR_UPLOAD_MAX_BYTES. An oversized upload is never held in memory
+# or written to a temp file. Files under FILE_UPLOAD_MAX_MEMORY_SIZE stay in
+# memory. Bigger ones are streamed to a temp file by Django's own handlers, so
+# a 20 MB PDF costs the server about 64 KB of memory while it is received.
+# ref https://docs.djangoproject.com/en/5.2/topics/http/file-uploads/#upload-handlers
+# ref https://en.wikipedia.org/wiki/List_of_file_signatures
+# ----------------------------------------------------------------
+
+import codecs
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+HEAD_BYTES = 1024  # PDFs may have a little junk before %PDF-
+
+RECEIPT_TYPES = {"png", "jpeg", "heic", "pdf"}
+
+# Brands in an ISO media file's "ftyp" box that mean HEIC/HEIF (iPhone photos)
+HEIC_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1"}
+
+# Allowance for the multipart boundaries and headers around a file
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def sniff(head):
+    """The type of a file from its first bytes: "png", "jpeg", "gif", "heic", "pdf", "zip", "txt" or None."""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if head[4:8] == b"ftyp" and head[8:12] in HEIC_BRANDS:
+        return "heic"
+    if b"%PDF-" in head[:HEAD_BYTES]:
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "zip"
+    if head and b"\x00" not in head[:HEAD_BYTES]:
+        try:
+            # final=False: the head may end part way through a character
+            codecs.getincrementaldecoder("utf-8")().decode(head[:HEAD_BYTES], final=False)
+            return "txt"
+        except UnicodeDecodeError:
+            pass
+    return None
+
+
+def file_type(f):
+    """sniff() an open file (an upload, a zip member...) without moving its position."""
+    position = f.tell()
+    head = f.read(HEAD_BYTES)
+    f.seek(position)
+    return sniff(head)
+
+
+def too_large(request, files=1):
+    """True if the request is, or has turned out to be, over the upload size limit.
+    Checks the declared Content-Length first, so a big upload is refused before
+    its body is read. Otherwise it reads request.FILES, where
+    LimitedUploadHandler (see limit_upload_size) stops at the first file that is too big."""
+    try:
+        declared = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        declared = 0
+    if declared > files * settings.OCR_UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD:
+        return True
+    request.FILES  # parse the body (the handler below flags an oversized file)
+    return getattr(request, "upload_too_large", False)
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """Stops reading a request as soon as one of its files passes OCR_UPLOAD_MAX_BYTES."""
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.OCR_UPLOAD_MAX_BYTES:
+            self.request.upload_too_large = True
+            # Don't read (or store) the rest of the body
+            raise StopUpload(connection_reset=True)
+        return raw_data  # passed on to the next handler, which keeps it
+
+    def file_complete(self, file_size):
+        return None
+
+
+def limit_upload_size(view):
+    """Use LimitedUploadHandler for this view's uploads (see too_large).
+
+    It has to be installed before anything reads the request body. The CSRF
+    middleware reads it for views it checks, so such a view needs csrf_exempt
+    outside this decorator and csrf_protect inside it.
+    ref https://docs.djangoproject.com/en/5.2/topics/http/file-uploads/#modifying-upload-handlers-on-the-fly
+    """
+    if iscoroutinefunction(view):
+
+        @wraps(view)
+        async def limited(request, *args, **kwargs):
+            request.upload_handlers.insert(0, LimitedUploadHandler(request))
+            return await view(request, *args, **kwargs)
+
+    else:
+
+        @wraps(view)
+        def limited(request, *args, **kwargs):
+            request.upload_handlers.insert(0, LimitedUploadHandler(request))
+            return view(request, *args, **kwargs)
+
+    return limited
@@ -4,8 +4,12 @@
 # ----------------------------------------------------------------
 
 from django.urls import path
-from .views import ocr_extract
+from .views import ocr_batch, ocr_extract, ocr_extract_async, ocr_job, ocr_metrics
 
 urlpatterns = [
     path("ocr-extract/", ocr_extract, name="ocr-extract"),
+    path("ocr-extract/async/", ocr_extract_async, name="ocr-extract-async"),
+    path("ocr-jobs/<uuid:job_id>/", ocr_job, name="ocr-job"),
+    path("ocr-batch/", ocr_batch, name="ocr-batch"),
+    path("ocr-metrics/", ocr_metrics, name="ocr-metrics"),
 ]
@@ -13,31 +13,41 @@
 
 # ----------------------------------------------------------------
 
-import pytesseract
 import os
 import json
 import re
 import cv2
 import numpy as np
-from PIL import Image
-from pdf2image import convert_from_path
+from pdf2image import convert_from_bytes, pdfinfo_from_bytes
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
 from dotenv import load_dotenv
-import google.generativeai as genai
-import easyocr
+import logging
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from . import engines, imaging, llm, uploads
+from .resilience import CircuitOpen
+from .metrics import incr, observe_image, stage
 
 
+logger = logging.getLogger(__name__)
+
 # Loads environment variables (for Gemini API to work)
 load_dotenv()
 
-# Sets the correct Tesseract path
-pytesseract.pytesseract.tesseract_cmd = "/opt/homebrew/bin/tesseract"
+# The Tesseract path is now settings.OCR_TESSERACT_CMD (see engines.py)
+
+# OCR settings - these are also part of the result cache key (see result_cache.py),
+# so changing them means receipts are processed again rather than served from the cache
+TESSERACT_CONFIG = engines.TESSERACT_CONFIG
+SHARPEN_KERNEL = [[0, -1, 0], [-1, 5, -1], [0, -1, 0]]
 
 
-# Allowed file types:
-def allowed_file(filename):
-    ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "heic", "heif", "pdf"}
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+# Allowed file types - judged by the file's first bytes, not its name (see uploads.py)
+def allowed_file(file):
+    """True for an open file (upload, zip member...) that is a PNG, JPEG, HEIC or PDF."""
+    return uploads.file_type(file) in uploads.RECEIPT_TYPES
 
 
 #  Convert HEIC to JPG if uploading images from an apple device
@@ -53,115 +63,264 @@ def convert_heic_to_jpg(img_path):
 
 
 #  Extract text using EasyOCR - second option as fallback
-def easyocr_extract_text(image_path):
-    """Extracts text using EasyOCR."""
-    reader = easyocr.Reader(["en"])
-    result = reader.readtext(image_path, detail=0)
-    return "\n".join(result)
+def easyocr_extract_text(image):
+    """Extracts text using EasyOCR (from a numpy image or a file path)."""
+    return engines.ENGINES["easyocr"].read(image)
+
+
+# Decodes an uploaded image (bytes) into a greyscale image without touching the disk
+def load_image(data):
+    """Returns a greyscale numpy image."""
+    with stage("decode"):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("file is not an image OpenCV can read")
+    observe_image("upload", image)
+    return image
 
 
 # Preproceses Image for Better OCR to fix text extraction issues
-def preprocess_image(image_path):
-    """Apply light preprocessing (avoid over-processing)."""
-    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+def preprocess_image(image, name="receipt"):
+    """Apply light preprocessing (avoid over-processing). Works on the image in memory."""
+    # Phone photos are mostly background and far bigger than Tesseract needs -
+    # crop to the receipt, shrink text to a readable size and straighten it first
+    if settings.OCR_CROP_TO_RECEIPT:
+        with stage("crop"):
+            image = imaging.crop_to_receipt(image)
+    if settings.OCR_NORMALIZE_SCALE:
+        with stage("rescale"):
+            image = imaging.normalize_scale(image, settings.OCR_TARGET_TEXT_HEIGHT)
+    if settings.OCR_DESKEW:
+        with stage("deskew"):
+            image = imaging.deskew(image)
+    observe_image("preprocessed", image)
 
     # Lightly sharpens instead of thresholding - this has been manually adjusted to test results
-    kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
-    processed = cv2.filter2D(image, -1, kernel) # code from - https://stackoverflow.com/questions/32642421/opencv-altering-the-filter2d-function?rq=3
+    kernel = np.array(SHARPEN_KERNEL)
+    with stage("preprocess"):
+        processed = cv2.filter2D(image, -1, kernel) # code from - https://stackoverflow.com/questions/32642421/opencv-altering-the-filter2d-function?rq=3
 
-    # Save processed image
-    temp_path = image_path.rsplit(".", 1)[0] + "_preprocessed.png"
-    cv2.imwrite(temp_path, processed)
+    # Debug mode: keep a copy of what Tesseract actually sees
+    if settings.OCR_SAVE_INTERMEDIATES:
+        save_debug_image(processed, name)
 
-    if not os.path.exists(temp_path):
-        print(f" ERROR: Processed image did not save at {temp_path}")
-    else:
-        print(f" Processed Image Saved: {temp_path}")
+    return processed
 
-    return temp_path
 
+def save_debug_image(image, name):
+    ok, encoded = cv2.imencode(".png", image)
+    if not ok:
+        logger.error("Could not encode processed image for %s", name)
+        return None
+    stem = os.path.basename(name).rsplit(".", 1)[0]
+    path = default_storage.save(f"ocr_debug/{stem}_preprocessed.png", ContentFile(encoded.tobytes()))
+    logger.debug("Processed image saved: %s", path)
+    return path
 
-# Extracts text from images and PDFs
-def extract_text(file_path, use_easyocr=False):#change to true if you want to use easyocr
+
+# Runs OCR on one preprocessed image
+def ocr_image(image, use_easyocr=False):
+    # Tries the engines in settings.OCR_ENGINES, falling back (or racing) as configured
+    # in engines.py; use_easyocr=True asks for EasyOCR only
+    # The engines take the numpy image directly, so nothing is written to disk
+    return engines.recognise(image, ["easyocr"] if use_easyocr else None)
+
+
+# Reads the text layer of PDF pages (PDFs made by tills/invoicing software have one)
+def pdf_text_pages(data, first, last):
+    """Text of each page from first to last using poppler's pdftotext, or [] if it can't be run."""
     try:
+        with stage("pdf_text_layer"):
+            result = subprocess.run(
+                ["pdftotext", "-f", str(first), "-l", str(last), "-layout", "-", "-"],
+                input=data,
+                capture_output=True,
+                timeout=30,
+                check=True,
+            )
+    except (OSError, subprocess.SubprocessError):
+        return []
+    # pdftotext ends every page with a form feed
+    return result.stdout.decode("utf-8", "replace").split("\f")[: last - first + 1]
+
+
+def page_runs(pages):
+    """Groups sorted page numbers into (first, last) runs, e.g. [1, 2, 3, 5] -> [(1, 3), (5, 5)]."""
+    runs = []
+    for page in pages:
+        if runs and page == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], page)
+        else:
+            runs.append((page, page))
+    return runs
+
+
+# Extracts text from every page of a PDF (up to OCR_PDF_MAX_PAGES)
+def extract_pdf_text(data, filename, use_easyocr=False, pages=None):
+    """Pages with a text layer are read directly; only the rest are rasterised and OCR'd.
+    Returns None if the PDF has no pages in range."""
+    with stage("pdf_info"):
+        count = pdfinfo_from_bytes(data)["Pages"]
+    first, last = pages or (1, count)
+    last = min(last, count, first + settings.OCR_PDF_MAX_PAGES - 1)
+    if first > last:
+        return None
 
-        if file_path.lower().endswith(".pdf"):
-            images = convert_from_path(file_path, dpi=300)
-            if not images:
-                return "Error: No images found in PDF."
-            image = images[0]  # Use first page
-            image.save(file_path.replace(".pdf", ".jpg"))  # Convert for OCR
-            file_path = file_path.replace(".pdf", ".jpg")
+    texts = {}
+    for page, text in enumerate(pdf_text_pages(data, first, last), start=first):
+        if len(text.strip()) >= settings.OCR_PDF_TEXT_MIN_CHARS:
+            texts[page] = text
+
+    # Rasterise only the pages still missing, one pdftoppm call per run of pages.
+    # A page at 300 DPI is ~9 MB, so runs are cut into OCR_PDF_WORKERS pages at a
+    # time and each piece is OCR'd before the next is rendered - memory stays
+    # bounded however long the PDF is
+    missing = [page for page in range(first, last + 1) if page not in texts]
+    incr("pdf_pages_text_layer", len(texts))
+    incr("pdf_pages_ocr", len(missing))
+    step = settings.OCR_PDF_WORKERS
+
+    # Each page is OCR'd by its own tesseract process; the threads just wait on them
+    def ocr_page(page, image):
+        return ocr_image(preprocess_image(image, f"{filename}-page{page}"), use_easyocr)
+
+    with ThreadPoolExecutor(max_workers=step) as pool:
+        for run_first, run_last in page_runs(missing):
+            for piece_first in range(run_first, run_last + 1, step):
+                piece = range(piece_first, min(piece_first + step - 1, run_last) + 1)
+                with stage("pdf_rasterise"):
+                    rendered = convert_from_bytes(
+                        data,
+                        dpi=settings.OCR_PDF_DPI,
+                        first_page=piece[0],
+                        last_page=piece[-1],
+                        grayscale=True,
+                        thread_count=len(piece),
+                    )
+                images = {}
+                for page, image in zip(piece, rendered):
+                    images[page] = np.array(image.convert("L"))
+                    observe_image("pdf_page", images[page])
+                del rendered
+                texts.update(zip(images, pool.map(ocr_page, images, images.values())))
+
+    if not texts:
+        return None
+    # Merge in page order
+    return "\n\n".join(texts[page].strip() for page in sorted(texts))
 
-        processed_image_path = preprocess_image(file_path)
 
-        # Performs OCR with EasyOCR or Tesseract (added both incase one fails but currently only Tesseract is used)
-        if use_easyocr:
-            extracted_text = easyocr_extract_text(processed_image_path)
+# Extracts text from an uploaded image or PDF held in memory
+def extract_text_from_bytes(data, filename, use_easyocr=False, pages=None):
+    try:
+        if uploads.sniff(data[: uploads.HEAD_BYTES]) == "pdf":
+            extracted_text = extract_pdf_text(data, filename, use_easyocr, pages)
+            if extracted_text is None:
+                return "Error: No images found in PDF."
         else:
-            extracted_text = pytesseract.image_to_string(
-                Image.open(processed_image_path), lang="eng", config="--psm 4"
-            )
+            processed = preprocess_image(load_image(data), filename)
+            extracted_text = ocr_image(processed, use_easyocr)
 
         # Debugging Log - allows us to see the extracted text and check if it is empty
-        print(f"🔎 Extracted Text:\n{extracted_text}")
+        logger.debug("Extracted text from %s:\n%s", filename, extracted_text)
 
         # Returns text if it is not empty or else returns an error message
         return (
             extracted_text if extracted_text.strip() else "Error: No text found in OCR."
         )
 
+    except Exception as e:
+        incr("ocr_errors")
+        return f"Error processing file: {e}"
+
+
+# Extracts text from images and PDFs on disk
+def extract_text(file_path, use_easyocr=False):#change to true if you want to use easyocr
+    try:
+        with open(file_path, "rb") as f:
+            data = f.read()
     except Exception as e:
         return f"Error processing file: {e}"
+    return extract_text_from_bytes(data, file_path, use_easyocr)
+
+
+#  Prompt for Gemini AI to convert text into structured JSON
+#  This is a basic prompt and can be improved with more specific instructions
+# prompt guidance can be found here: https://ai.google.dev/gemini-api/docs/structured-output?lang=python
+def ai_prompt(text):
+    return (
+        "Analyze the extracted receipt text and convert it into structured JSON.\n"
+        "Provide valid JSON output containing:\n"
+        "- `establishment`: Name of the establishment\n"
+        "- `date`: Date of the receipt\n"
+        "- `items`: List of beverages and their prices\n"
+        "- `total_price`: Total amount paid\n\n"
+        f"Extracted text:\n{text}"
+    )
+
+
+def too_poor_for_ai(text):
+    return not text.strip() or len(text.split()) < 3
+
+
+POOR_TEXT_ERROR = {"error": "OCR output is too poor to process. Please try another image."}
+
+
+# Turns the model's reply into the structured data (or an error)
+def parse_ai_response(response_text):
+    #  Ensures AI response is not empty
+    if not response_text.strip():
+        return {"error": "Gemini AI returned an empty response."}
+
+    # Ensures AI response is valid JSON
+    try:
+        clean_response = re.sub(r"```json|```", "", response_text).strip() #re.sub() removes the code block formatting
+        #  This regex pattern removes any unwanted characters
+        #  and ensures the JSON is properly formatted
+        structured_data = json.loads(clean_response)
+        return structured_data  # Return valid JSON
+    except json.JSONDecodeError as e:
+        incr("gemini_bad_json")
+        return {
+            "error": f"Failed to parse AI response: {e}",
+            "raw_response": response_text,
+        }
+
+
+def ai_failure(e):
+    if isinstance(e, CircuitOpen):
+        # Gemini has been failing - answer straight away with just the OCR text
+        # rather than every receipt waiting for its own timeout
+        return {
+            "error": "AI extraction is unavailable right now, only the OCR text is available.",
+            "ai_unavailable": True,
+        }
+    incr("gemini_errors")
+    return {"error": f"Failed to generate structured data: {e}"}
 
 
 #  Extracts structured data from OCR text using Gemini AI
 def generate_json_ai(text):
+    if too_poor_for_ai(text):
+        return dict(POOR_TEXT_ERROR)
     try:
-        if not text.strip() or len(text.split()) < 3:
-            return {
-                "error": "OCR output is too poor to process. Please try another image."
-            }
-
-        api_key = os.getenv("TOKEN_API_GEMINI")# Gemini API Key is stored in .env file
-        if not api_key:
-            raise ValueError("API Key is missing. Set TOKEN_API_GEMINI in .env")
-
-        genai.configure(api_key=api_key) # configures the API key for Gemini AI
-        #  Initializes the Gemini AI model
-        model = genai.GenerativeModel("gemini-1.5-flash")
-
-        #  Prompt for Gemini AI to convert text into structured JSON
-        #  This is a basic prompt and can be improved with more specific instructions
-        # prompt guidance can be found here: https://ai.google.dev/gemini-api/docs/structured-output?lang=python
-        prompt = (
-            "Analyze the extracted receipt text and convert it into structured JSON.\n"
-            "Provide valid JSON output containing:\n"
-            "- `establishment`: Name of the establishment\n"
-            "- `date`: Date of the receipt\n"
-            "- `items`: List of beverages and their prices\n"
-            "- `total_price`: Total amount paid\n\n"
-            f"Extracted text:\n{text}"
-        )
+        # Gemini, or the offline fake when OCR_LLM_BACKEND is "fake" (see llm.py)
+        client = llm.client()
+        with stage("gemini"):
+            response_text = client.generate(ai_prompt(text))# Generates content using the model based on the prompt
+    except Exception as e:
+        return ai_failure(e)
+    return parse_ai_response(response_text)
 
-        response = model.generate_content(prompt)# Generates content using the model based on the prompt
-
-        #  Ensures AI response is not empty
-        if not response.text.strip():
-            return {"error": "Gemini AI returned an empty response."}
-
-        # Ensures AI response is valid JSON
-        try:
-            clean_response = re.sub(r"```json|```", "", response.text).strip() #re.sub() removes the code block formatting
-            #  This regex pattern removes any unwanted characters
-            #  and ensures the JSON is properly formatted
-            structured_data = json.loads(clean_response)
-            return structured_data  # Return valid JSON
-        except json.JSONDecodeError as e:
-            return {
-                "error": f"Failed to parse AI response: {e}",
-                "raw_response": response.text,
-            }
 
+# The same for async views: waits on Gemini without holding a thread
+async def generate_json_ai_async(text):
+    if too_poor_for_ai(text):
+        return dict(POOR_TEXT_ERROR)
+    try:
+        client = llm.client()
+        with stage("gemini"):
+            response_text = await client.generate_async(ai_prompt(text))
     except Exception as e:
-        return {"error": f"Failed to generate structured data: {e}"}
+        return ai_failure(e)
+    return parse_ai_response(response_text)
@@ -1,34 +1,199 @@
 # ---------------------------------------------------------------------
 # This file is used to handle OCR extraction from uploaded receipt images.
 # It uses Django's default storage to save the uploaded image and then
-# processes it to extract text and generate structured data.
+# queues it for the OCR workers, which extract the text and generate
+# structured data (see jobs.py). Clients poll ocr-jobs/<id>/ for the result.
  #resources: https://github.com/theiguim/gen_menu_ai, https://medium.com/@AnudeepthiKolagani/image-filtering-using-filter2d-fdda6161a860,https://www.smashingmagazine.com/2021/06/image-text-conversion-react-tesseract-js-ocr/
 # https://medium.com/@RiwajNeupane/ocr-with-pytesseract-and-easyocr-2747180e8b66 , https://pypi.org/project/pytesseract/, https://ai.google.dev/gemini-api/docs/structured-output?lang=python
 # https://stackoverflow.com/questions/32642421/opencv-altering-the-filter2d-function?rq=3 , https://stackoverflow.com/questions/79443225/how-to-use-gemini-api-to-process-and-extract-data-from-an-image
 # ----------------------------------------------------------------------------
-import json
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from itertools import islice
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from .utils import extract_text, generate_json_ai
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from . import metrics, result_cache
+from .batch import iter_uploads, ndjson_lines, process_batch
+from .jobs import QueueFull, enqueue, job_payload, wait_for
+from .models import OcrJob
+from .pipeline import in_flight, process_upload_async
+from .uploads import limit_upload_size, too_large
+from .utils import allowed_file
+
+
+def wants_profile(request):
+    """Staff (or anyone in DEBUG) can send X-OCR-Profile: 1 to get a profile of their receipt."""
+    header = request.headers.get("X-OCR-Profile", "").lower() in ("1", "true", "yes")
+    return header and (settings.DEBUG or is_staff(request))
+
+
+def is_staff(request):
+    """True if the request has a staff user's JWT. The upload views aren't DRF views
+    (see limit_upload_size), so the token is checked here."""
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return authenticated is not None and authenticated[0].is_staff
+
+
+def queue_receipt(uploaded_file, folder="receipts", profile=False):
+    """Queue an upload for OCR and return the 202 response with the job id to poll.
+    A receipt that has been processed before is answered straight from the cache."""
+    # A profiled receipt always goes through the pipeline, so skip the cache
+    cache_key = "" if profile else result_cache.key_for(uploaded_file)
+    cached = result_cache.lookup(cache_key)
+    if cached is not None:
+        return JsonResponse({"status": "done", "cached": True, **cached})
+
+    try:
+        job = enqueue(uploaded_file, folder, cache_key, profile)
+    except QueueFull:
+        return busy_response()
+    return JsonResponse(job_payload(job), status=202)
 
 
 @csrf_exempt
+@limit_upload_size
 def ocr_extract(request):
-    """Handles OCR extraction from uploaded receipt images."""
+    """Queues an uploaded receipt image for OCR extraction (see jobs.py)."""
+    if request.method == "POST" and too_large(request):
+        return too_large_response()
     if request.method == "POST" and request.FILES.get("image"):
-        image_file = request.FILES["image"]
-        path = default_storage.save(
-            f"receipts/{image_file.name}", ContentFile(image_file.read())
-        )
+        if not allowed_file(request.FILES["image"]):
+            return JsonResponse({"error": "Invalid file type"}, status=400)
+        return queue_receipt(request.FILES["image"], profile=wants_profile(request))
+
+    return JsonResponse({"error": "No image provided"}, status=400)
+
+
+def busy_response():
+    response = JsonResponse(
+        {"error": "Too many receipts are being processed, please try again shortly"},
+        status=503,
+    )
+    response["Retry-After"] = "10"
+    return response
+
+
+def too_large_response():
+    limit = settings.OCR_UPLOAD_MAX_BYTES // (1024 * 1024)
+    return JsonResponse({"error": f"File is too large (the limit is {limit} MB)"}, status=413)
+
+
+# Async version of queue_receipt for the async views. Rather than queueing a job
+# it processes the receipt during the request and returns the result: under an
+# ASGI server (uvicorn mycoffeeapp.asgi:application) the request isn't holding a
+# thread while it waits for OCR or Gemini, so there is no need to hand it off.
+async def process_receipt_now(uploaded_file, folder="receipts"):
+    # Hashed chunk by chunk, so the upload is never joined into one bytes object here
+    def look_up():
+        key = result_cache.key_for(uploaded_file)
+        return key, result_cache.lookup(key)
 
-        extracted_text = extract_text(default_storage.path(path))
-        structured_data = generate_json_ai(extracted_text)
+    cache_key, cached = await sync_to_async(look_up)()
+    if cached is not None:
+        return JsonResponse({"status": "done", "cached": True, **cached})
 
-        return JsonResponse(
-            {"extracted_text": extracted_text, "structured_data": structured_data}
-        )
+    try:
+        with in_flight():
+            # Streamed into storage like the queued path; storage has no async API
+            name = await sync_to_async(default_storage.save, thread_sensitive=False)(
+                f"{folder}/{uploaded_file.name}", uploaded_file
+            )
+            result = await process_upload_async(name)
+    except QueueFull:
+        return busy_response()
+    await sync_to_async(result_cache.store)(cache_key, result)
+    return JsonResponse({"status": "done", "cached": False, **result})
+
+
+@csrf_exempt
+@limit_upload_size
+async def ocr_extract_async(request):
+    """Like ocr_extract, but returns the OCR results in the response (see process_receipt_now)."""
+    if request.method == "POST" and await sync_to_async(too_large, thread_sensitive=False)(request):
+        return too_large_response()
+    if request.method == "POST" and request.FILES.get("image"):
+        if not allowed_file(request.FILES["image"]):
+            return JsonResponse({"error": "Invalid file type"}, status=400)
+        return await process_receipt_now(request.FILES["image"])
 
     return JsonResponse({"error": "No image provided"}, status=400)
 
+
+@require_GET
+async def ocr_job(request, job_id):
+    """Status of an OCR job, with the results once it is done.
+    ?wait=<seconds> holds the request open until the job finishes (long polling).
+    Under WSGI a waiting request still ties up a worker, so keep ?wait= short there."""
+    try:
+        wait = min(float(request.GET.get("wait", 0)), settings.OCR_LONG_POLL_MAX)
+    except ValueError:
+        return JsonResponse({"error": "wait must be a number of seconds"}, status=400)
+
+    try:
+        job = await wait_for(job_id, max(wait, 0))
+    except OcrJob.DoesNotExist:
+        return JsonResponse({"error": "Job not found"}, status=404)
+    return JsonResponse(job_payload(job))
+
+
+# Bulk import: POST many receipts (images, PDFs or zip archives of them) as
+# "files". Each is OCR'd and sent to Gemini in parallel (see batch.py) and the
+# results are streamed back as NDJSON, one line per file as it finishes, then
+# a summary line. At most OCR_BATCH_MAX_FILES files are handled per request.
+# Staff only (with a JWT, like the rest of the API), as it keeps a pool of
+# processes busy for the whole batch.
+@limit_upload_size
+@api_view(["POST"])
+@permission_classes([IsAdminUser])
+def ocr_batch(request):
+    if too_large(request, files=settings.OCR_BATCH_MAX_FILES):
+        return too_large_response()
+    uploads = request.FILES.getlist("files")
+    if not uploads:
+        return Response({"error": "No files provided"}, status=status.HTTP_400_BAD_REQUEST)
+
+    files = islice(iter_uploads(uploads), settings.OCR_BATCH_MAX_FILES)
+    use_ai = request.GET.get("ai", "true").lower() != "false"
+    return StreamingHttpResponse(
+        ndjson_lines(process_batch(files, use_ai=use_ai)), content_type="application/x-ndjson"
+    )
+
+
+# ocr_metrics as Prometheus text, chosen with ?format=prometheus
+class PrometheusRenderer(BaseRenderer):
+    media_type = "text/plain"
+    format = "prometheus"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if renderer_context["response"].exception:  # e.g. not staff
+            return f"{data['detail']}\n"
+        return metrics.prometheus_text(data)
+
+
+# Where OCR time is going: stage timing histograms (with p50/p95/p99), image
+# sizes, counters and gauges from every OCR process (see metrics.py). ?format=prometheus for scraping.
+# Staff only, with a JWT.
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+@renderer_classes([JSONRenderer, PrometheusRenderer])
+def ocr_metrics(request):
+    total = metrics.collect()
+    for histogram in total["stages"].values():
+        histogram["avg_ms"] = round(histogram["sum"] / histogram["count"], 3) if histogram["count"] else None
+        for q in (50, 95, 99):
+            value = metrics.percentile(histogram, q / 100)
+            histogram[f"p{q}_ms"] = round(value, 3) if value is not None else None
+    return Response(total)
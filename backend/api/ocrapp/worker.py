@@ -0,0 +1,60 @@
+# ----------------------------------------------------------------
+# Worker processes for the OCR job queue (see jobs.py).
+# Each worker is a separate process running one receipt at a time, so the
+# number of processes is the limit on how many receipts are OCR'd at once.
+# Processes are started with "spawn" rather than fork: OpenCV, Tesseract and
+# EasyOCR/torch all start their own threads, which don't survive a fork.
+# This module must not import any models at the top, because a spawned
+# process imports it before Django has been set up.
+# ref https://docs.python.org/3/library/multiprocessing.html#contexts-and-start-methods
+# ----------------------------------------------------------------
+
+import multiprocessing
+import os
+import signal
+import socket
+
+
+def run_worker(name, **options):
+    # Stop Tesseract's OpenMP threads fighting the other worker processes for CPU
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+    import django
+
+    django.setup()
+    from . import registry
+    from .jobs import work
+
+    # Load the OCR engines now rather than on this worker's first receipt
+    registry.warm()
+
+    stopping = []
+    # Finish the current receipt before exiting on Ctrl+C / SIGTERM
+    signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+    signal.signal(signal.SIGINT, lambda *args: stopping.append(True))
+    return work(name, should_stop=lambda: bool(stopping), **options)
+
+
+def start_pool(processes, **options):
+    """Start `processes` workers and wait for them all to exit."""
+    context = multiprocessing.get_context("spawn")
+    host = socket.gethostname()
+    workers = [
+        context.Process(
+            target=run_worker,
+            args=(f"{host}:{os.getpid()}:{i}",),
+            kwargs=options,
+            daemon=False,
+        )
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # The workers got the Ctrl+C too and are finishing their current job
+        for worker in workers:
+            worker.join()
+    return [worker.exitcode for worker in workers]
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class FhrsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "fhrs"  # This should be the name of the app
+
+    def ready(self):
+        import fhrs.receivers  # Keeps the in-memory coffee shop index up to date
@@ -0,0 +1,153 @@
+# ------------------------------------------------------------------
+# In-memory spatial index for "coffee shops near me".
+# Every coffee shop with coordinates is put in a grid of
+# FHRS_GEO_CELL_DEGREES cells. The points are kept in numpy arrays, sorted
+# by cell, and each grid row's cells are next to each other in that order.
+# A search works out which cells the radius can reach, then finds each
+# row's run of points with one binary search (np.searchsorted). Only those
+# points are ranked by haversine distance, so a query looks at a few
+# hundred points rather than the whole table, and does no database work
+# until the k results are fetched by primary key.
+#
+# Each process builds its own index on first use (or, under WSGI, at
+# startup - see warm_on_startup). A "generation" counter in Django's cache
+# tells every process to rebuild after an FHRS import or an edit to a
+# Business (see receivers.py), the same way the leaderboard stays in step.
+# ref https://en.wikipedia.org/wiki/Haversine_formula
+# ref https://numpy.org/doc/stable/reference/generated/numpy.searchsorted.html
+# ------------------------------------------------------------------
+
+import logging
+import math
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SynchronousOnlyOperation
+from django.db import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "fhrs:geo:generation"
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distance in km from one point to arrays of points (all in degrees)."""
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GridIndex:
+    def __init__(self, ids, lats, lons, cell_degrees=0.05):
+        self.cell = cell_degrees
+        self.columns = math.ceil(360 / cell_degrees) + 1
+        keys = self._rows(np.asarray(lats, dtype=np.float64)) * self.columns + self._columns(
+            np.asarray(lons, dtype=np.float64)
+        )
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.lats = np.asarray(lats, dtype=np.float64)[order]
+        self.lons = np.asarray(lons, dtype=np.float64)[order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _rows(self, lats):
+        return np.floor((lats + 90) / self.cell).astype(np.int64)
+
+    def _columns(self, lons):
+        return np.floor((lons + 180) / self.cell).astype(np.int64)
+
+    def candidates(self, lat, lon, radius_km):
+        """Positions of the points in the cells a circle of radius_km round (lat, lon) can touch."""
+        lat_span = radius_km / KM_PER_DEGREE
+        # Degrees of longitude shrink towards the poles; use the widest point of the circle
+        widest = min(abs(lat) + lat_span, 89.9)
+        lon_span = min(radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest))), 180)
+
+        rows = self._rows(np.array([lat - lat_span, lat + lat_span]))
+        columns = self._columns(np.array([lon - lon_span, lon + lon_span]))
+        row_numbers = np.arange(rows[0], rows[1] + 1)
+        starts = np.searchsorted(self.keys, row_numbers * self.columns + columns[0], side="left")
+        ends = np.searchsorted(self.keys, row_numbers * self.columns + columns[1], side="right")
+        runs = [np.arange(start, end) for start, end in zip(starts, ends) if end > start]
+        return np.concatenate(runs) if runs else np.empty(0, dtype=np.int64)
+
+    def nearest(self, lat, lon, radius_km, k):
+        """[(id, distance_km)] of the k closest points within radius_km, closest first."""
+        found = self.candidates(lat, lon, radius_km)
+        distances = haversine_km(lat, lon, self.lats[found], self.lons[found])
+        inside = distances <= radius_km
+        found, distances = found[inside], distances[inside]
+        if len(found) > k:
+            best = np.argpartition(distances, k - 1)[:k]
+            found, distances = found[best], distances[best]
+        order = np.argsort(distances, kind="stable")
+        return [(int(i), float(d)) for i, d in zip(self.ids[found[order]], distances[order])]
+
+
+def coffee_shops():
+    from .models import Business
+
+    return Business.objects.filter(
+        is_cafe=True,
+        latitude__isnull=False,
+        longitude__isnull=False,
+    )
+
+
+class GeoEngine:
+    """This process's GridIndex, rebuilt when the generation in the cache moves on."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.index = None
+        self.generation = None
+
+    def warm(self):
+        with self._lock:
+            self._build()
+
+    def _build(self):
+        self.generation = cache.get(GENERATION_KEY, 0)
+        cache.add(GENERATION_KEY, self.generation, timeout=None)
+        rows = np.array(list(coffee_shops().values_list("pk", "latitude", "longitude")), dtype=np.float64)
+        rows = rows.reshape(-1, 3)
+        self.index = GridIndex(rows[:, 0], rows[:, 1], rows[:, 2], settings.FHRS_GEO_CELL_DEGREES)
+
+    def nearest(self, lat, lon, radius_km, k):
+        """[(Business pk, distance_km)], closest first."""
+        with self._lock:
+            if self.index is None or cache.get(GENERATION_KEY, 0) != self.generation:
+                self._build()
+            index = self.index
+        return index.nearest(lat, lon, radius_km, k)
+
+    def invalidate(self):
+        """Make every process rebuild its index on its next search."""
+        with self._lock:
+            self.index = None
+            try:
+                cache.incr(GENERATION_KEY)
+            except ValueError:  # the key was evicted from the cache
+                cache.set(GENERATION_KEY, 1, timeout=None)
+
+
+engine = GeoEngine()
+
+
+def warm_on_startup():
+    """Called from wsgi.py so the first search doesn't pay for building the index."""
+    if not settings.FHRS_GEO_WARM_ON_STARTUP:
+        return
+    try:
+        engine.warm()
+    except (DatabaseError, SynchronousOnlyOperation) as e:
+        # e.g. migrations not run yet, or called inside an event loop - the index
+        # will be built on first use instead
+        logger.warning("Could not build the coffee shop index at startup: %s", e)
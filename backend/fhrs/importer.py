@@ -0,0 +1,322 @@
+# ------------------------------------------------------------------
+# Streaming import of the FHRS open data XML into the Business table.
+# The XML is read with iterparse, one EstablishmentDetail at a time. Each
+# element is dropped once it has been read, so memory stays flat however big
+# the authority's file is. Downloads go to a temp file in chunks rather than
+# into memory.
+# Coffee shops are written FHRS_IMPORT_BATCH_SIZE at a time with one
+# INSERT ... ON CONFLICT (fhrs_id) DO UPDATE per batch, each batch in its
+# own transaction. Before, every establishment had an update_or_create of
+# its own: a SELECT and an INSERT/UPDATE, each in its own transaction.
+#
+# Whether each establishment is a coffee shop (is_cafe) and its postcode are
+# worked out here, once, so the API filters on indexed columns (see models.py).
+#
+# Most establishments are the same from one snapshot to the next, so each
+# row's fields are hashed (content_hash) and compared with the hashes stored
+# on Business - one SELECT per batch - and only new and changed rows are
+# written. With prune=True, coffee shops of the file's local authorities
+# that are no longer in it are deleted. Every committed batch sends
+# signals.business_changed with the fhrs_ids created, updated and deleted.
+#
+# sync_feeds() imports any number of authority files. They are downloaded
+# FHRS_FETCH_WORKERS at a time on a thread pool, and each is imported (on the
+# calling thread) as its download finishes. Each download is a conditional
+# GET: the ETag / Last-Modified from the last import go with the request,
+# and a 304 means the file is skipped. The server doesn't always send
+# those, so each file's sha256 is kept as well. A file that comes back
+# byte-for-byte the same isn't imported again.
+# Sources can be authority codes (FHRS_FEED_URL is filled in), URLs - for a
+# local stand-in server - or paths to files already on disk.
+# ref https://docs.python.org/3/library/xml.etree.elementtree.html#xml.etree.ElementTree.iterparse
+# ref https://docs.djangoproject.com/en/5.2/ref/models/querysets/#bulk-create
+# ref https://ratings.food.gov.uk/open-data-resources/documents/FHRS_APIv1_guidance_april24.pdf
+# ref https://developer.mozilla.org/en-US/docs/Web/HTTP/Conditional_requests
+# ------------------------------------------------------------------
+
+import hashlib
+import json
+import tempfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Business, FhrsFeed, find_postcode, is_coffee_shop
+from .signals import business_changed
+
+CHUNK_SIZE = 64 * 1024
+
+ADDRESS_TAGS = ["AddressLine1", "AddressLine2", "AddressLine3", "PostCode"]
+
+# Everything the import sets from the XML - these make up the content hash
+IMPORTED_FIELDS = [
+    "name", "business_type", "address", "rating", "latitude", "longitude", "local_authority",
+    "postcode", "is_cafe",
+]
+# The columns updated when an establishment is already there
+UPDATE_FIELDS = IMPORTED_FIELDS + ["content_hash"]
+
+
+def text(element, path):
+    found = element.find(path)
+    if found is None or found.text is None or not found.text.strip():
+        return None
+    return found.text.strip()
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_establishment(element):
+    """The Business fields for one EstablishmentDetail element."""
+    business_type = text(element, "BusinessType") or ""
+    return {
+        "fhrs_id": int(text(element, "FHRSID")),
+        "name": text(element, "BusinessName") or "",
+        "business_type": business_type,
+        "address": ", ".join(
+            part for part in (text(element, tag) for tag in ADDRESS_TAGS) if part
+        ),
+        "rating": text(element, "RatingValue") or "Not Rated",
+        "latitude": to_float(text(element, "Geocode/Latitude")),
+        "longitude": to_float(text(element, "Geocode/Longitude")),
+        "local_authority": text(element, "LocalAuthorityCode") or "",
+        "postcode": find_postcode(text(element, "PostCode")),
+        "is_cafe": is_coffee_shop(business_type),
+    }
+
+
+def content_hash(row):
+    """sha256 of everything the import stores for an establishment."""
+    return hashlib.sha256(json.dumps([row[field] for field in IMPORTED_FIELDS]).encode()).hexdigest()
+
+
+def iter_establishments(source):
+    """Field dicts for every establishment in an FHRS XML file (a path or binary file object)."""
+    parents = []  # the elements currently open, outermost first
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag == "EstablishmentDetail":
+            yield parse_establishment(element)
+            # Drop the establishment from the tree now it has been read
+            parents[-1].remove(element)
+
+
+def notify(created=(), updated=(), deleted=()):
+    """Send business_changed once the current transaction commits."""
+    transaction.on_commit(
+        lambda: business_changed.send(
+            sender=Business, created=list(created), updated=list(updated), deleted=list(deleted)
+        )
+    )
+
+
+class ImportStats:
+    def __init__(self):
+        self.read = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.deleted = 0
+        self.seen = set()  # fhrs_ids of the coffee shops in the file
+        self.authorities = set()
+
+    @property
+    def written(self):
+        return self.created + self.updated
+
+    def count(self, rows):
+        for row in rows:
+            self.read += 1
+            if row["is_cafe"]:
+                self.seen.add(row["fhrs_id"])
+                if row["local_authority"]:
+                    self.authorities.add(row["local_authority"])
+                yield row
+
+    def summary(self):
+        return (
+            f"{self.created} new, {self.updated} updated, {self.unchanged} unchanged, "
+            f"{self.deleted} deleted ({self.read} establishments read)"
+        )
+
+
+def upsert(rows, batch_size=None, stats=None):
+    """Insert or update the coffee shops in `rows` that are new or have changed, batch_size at a time."""
+    batch_size = batch_size or settings.FHRS_IMPORT_BATCH_SIZE
+    stats = stats or ImportStats()
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        # One row per id - Postgres won't upsert the same row twice in a statement
+        batch = {row["fhrs_id"]: {**row, "content_hash": content_hash(row)} for row in batch}
+        stored = dict(
+            Business.objects.filter(fhrs_id__in=list(batch)).values_list("fhrs_id", "content_hash")
+        )
+        changed = [row for fhrs_id, row in batch.items() if stored.get(fhrs_id) != row["content_hash"]]
+        stats.unchanged += len(batch) - len(changed)
+        if not changed:
+            continue
+        created = [row["fhrs_id"] for row in changed if row["fhrs_id"] not in stored]
+        updated = [row["fhrs_id"] for row in changed if row["fhrs_id"] in stored]
+        with transaction.atomic():
+            Business.objects.bulk_create(
+                [Business(**row) for row in changed],
+                update_conflicts=True,
+                unique_fields=["fhrs_id"],
+                update_fields=UPDATE_FIELDS,
+            )
+            notify(created=created, updated=updated)
+        stats.created += len(created)
+        stats.updated += len(updated)
+    return stats
+
+
+def prune(seen, authorities, batch_size=None):
+    """Delete the coffee shops of these local authorities that aren't in `seen`. Returns how many."""
+    batch_size = batch_size or settings.FHRS_IMPORT_BATCH_SIZE
+    stored = Business.objects.filter(local_authority__in=authorities).values_list("fhrs_id", flat=True)
+    gone = [fhrs_id for fhrs_id in stored.iterator() if fhrs_id not in seen]
+    for start in range(0, len(gone), batch_size):
+        chunk = gone[start : start + batch_size]
+        with transaction.atomic():
+            Business.objects.filter(fhrs_id__in=chunk).delete()
+            notify(deleted=chunk)
+    return len(gone)
+
+
+def import_file(source, batch_size=None, prune_missing=False):
+    """Import coffee shops from an FHRS XML file (a path or binary file object)."""
+    stats = ImportStats()
+    upsert(stats.count(iter_establishments(source)), batch_size, stats)
+    if prune_missing and stats.authorities:
+        stats.deleted = prune(stats.seen, stats.authorities, batch_size)
+    return stats
+
+
+def location(source):
+    """Where to fetch a source from: authority codes become FHRS_FEED_URL, anything else is kept."""
+    return settings.FHRS_FEED_URL.format(authority=source) if source.isdigit() else source
+
+
+class Download:
+    """An authority file fetched to a temp file (or opened from disk), with its checksum."""
+
+    def __init__(self, file=None, checksum="", etag="", last_modified="", not_modified=False):
+        self.file = file
+        self.checksum = checksum
+        self.etag = etag
+        self.last_modified = last_modified
+        self.not_modified = not_modified
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def copy_hashing(chunks, file):
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+        file.write(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def fetch(url, etag="", last_modified=""):
+    """Download url unless it hasn't changed since the etag / last_modified given (a 304)."""
+    if not url.startswith(("http://", "https://")):
+        file = open(url, "rb")
+        checksum = hashlib.sha256()
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            checksum.update(chunk)
+        file.seek(0)
+        return Download(file, checksum.hexdigest())
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    with requests.get(url, headers=headers, stream=True, timeout=settings.FHRS_FETCH_TIMEOUT) as response:
+        if response.status_code == 304:
+            return Download(etag=etag, last_modified=last_modified, not_modified=True)
+        response.raise_for_status()
+        # On disk rather than in memory - some authority files are tens of MB
+        file = tempfile.TemporaryFile()
+        try:
+            checksum = copy_hashing(response.iter_content(CHUNK_SIZE), file)
+        except BaseException:
+            file.close()
+            raise
+        return Download(
+            file,
+            checksum,
+            etag=response.headers.get("ETag", ""),
+            last_modified=response.headers.get("Last-Modified", ""),
+        )
+
+
+class FeedResult:
+    def __init__(self, source, status, stats=None, error=""):
+        self.source = source
+        self.status = status  # "imported", "not_modified", "unchanged" or "failed"
+        self.stats = stats
+        self.error = error
+
+
+def sync_feeds(sources, workers=None, batch_size=None, force=False, prune_missing=False):
+    """Import each source that has changed since it was last imported, yielding a FeedResult
+    for each as it finishes. force=True imports them all regardless."""
+    feeds = [FhrsFeed.objects.get_or_create(source=source)[0] for source in dict.fromkeys(sources)]
+    with ThreadPoolExecutor(workers or settings.FHRS_FETCH_WORKERS) as pool:
+        pending = {
+            pool.submit(
+                fetch,
+                location(feed.source),
+                "" if force else feed.etag,
+                "" if force else feed.last_modified,
+            ): feed
+            for feed in feeds
+        }
+        for future in as_completed(pending):
+            feed = pending[future]
+            try:
+                download = future.result()
+            except (requests.RequestException, OSError) as e:
+                yield FeedResult(feed.source, "failed", error=str(e))
+                continue
+            try:
+                yield import_download(feed, download, batch_size, force, prune_missing)
+            except ET.ParseError as e:
+                yield FeedResult(feed.source, "failed", error=f"bad XML: {e}")
+            finally:
+                download.close()
+
+
+def import_download(feed, download, batch_size=None, force=False, prune_missing=False):
+    feed.last_checked = timezone.now()
+    feed.etag, feed.last_modified = download.etag, download.last_modified
+    if download.not_modified:
+        status, stats = "not_modified", None
+    elif download.checksum == feed.checksum and not force:
+        status, stats = "unchanged", None
+    else:
+        stats = import_file(download.file, batch_size, prune_missing)
+        status = "imported"
+        feed.checksum = download.checksum
+        feed.establishments, feed.coffee_shops = stats.read, stats.written
+        feed.last_imported = feed.last_checked
+    feed.save()
+    return FeedResult(feed.source, status, stats)
@@ -0,0 +1,79 @@
+# ------------------------------------------------------------------
+# Benchmark: the streaming, batched FHRS import vs the old one
+# (ET.fromstring + update_or_create per establishment), on a generated
+# authority file. Each is run twice - into an empty table, then again over
+# the rows it just wrote, like the nightly re-import - and reports time and
+# peak Python memory. The generated rows use FHRS ids from 900000000 up and
+# are deleted afterwards.
+# usage: python manage.py bench_fhrs_import --establishments 20000
+# ------------------------------------------------------------------
+
+import io
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from django.core.management.base import BaseCommand
+
+from fhrs import importer
+from fhrs.models import Business
+
+FIRST_ID = 900000000
+
+
+def generated_xml(count):
+    details = "".join(
+        f"<EstablishmentDetail><FHRSID>{FIRST_ID + i}</FHRSID>"
+        f"<BusinessName>Bench {i}</BusinessName>"
+        f"<BusinessType>{'Restaurant/Cafe/Canteen' if i % 2 else 'Retailers - other'}</BusinessType>"
+        f"<AddressLine1>{i} High Street</AddressLine1><AddressLine3>Belfast</AddressLine3>"
+        f"<PostCode>BT{i % 20} 1AA</PostCode><RatingValue>{i % 6}</RatingValue>"
+        f"<Geocode><Longitude>-5.93</Longitude><Latitude>54.59</Latitude></Geocode>"
+        f"</EstablishmentDetail>"
+        for i in range(count)
+    )
+    return (
+        f"<FHRSEstablishment><EstablishmentCollection>{details}"
+        f"</EstablishmentCollection></FHRSEstablishment>"
+    ).encode()
+
+
+def old_import(data):
+    """The import as it was: the whole document in memory and a query pair per row."""
+    root = ET.fromstring(data)
+    for element in root.findall(".//EstablishmentDetail"):
+        row = importer.parse_establishment(element)
+        if importer.is_coffee_shop(row["business_type"]):
+            Business.objects.update_or_create(fhrs_id=row.pop("fhrs_id"), defaults=row)
+
+
+class Command(BaseCommand):
+    help = "Compare the batched FHRS import with per-row update_or_create"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--establishments", type=int, default=20000)
+
+    def handle(self, *args, **options):
+        data = generated_xml(options["establishments"])
+        self.stdout.write(f"{options['establishments']} establishments, {len(data) / 1e6:.1f} MB of XML")
+        try:
+            for label, run in (
+                ("update_or_create", lambda: old_import(data)),
+                ("streaming + bulk", lambda: importer.import_file(io.BytesIO(data))),
+            ):
+                self.clear()
+                for attempt in ("empty table", "re-import"):
+                    tracemalloc.start()
+                    start = time.perf_counter()
+                    run()
+                    elapsed = time.perf_counter() - start
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                    self.stdout.write(
+                        f"{label:18} {attempt:12} {elapsed:7.2f}s  peak {peak / 1e6:6.1f} MB"
+                    )
+        finally:
+            self.clear()
+
+    def clear(self):
+        Business.objects.filter(fhrs_id__gte=FIRST_ID).delete()
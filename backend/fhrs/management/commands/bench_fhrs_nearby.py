@@ -0,0 +1,63 @@
+# ------------------------------------------------------------------
+# Benchmark: nearest coffee shops from the grid index (fhrs/geo.py) vs
+# measuring the distance to every shop. Random points are spread over the
+# UK - the default 600000 is about the size of the whole FHRS dataset, not
+# just its coffee shops - and each search is for the k closest within the
+# radius of a random point. Nothing is written to the database.
+# usage: python manage.py bench_fhrs_nearby --points 600000 --k 20 --radius 2
+# ------------------------------------------------------------------
+
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from fhrs.geo import GridIndex, haversine_km
+
+# Roughly mainland UK and Northern Ireland
+LAT_RANGE = (50.0, 58.6)
+LON_RANGE = (-8.0, 1.8)
+
+
+def scan(lats, lons, lat, lon, radius_km, k):
+    distances = haversine_km(lat, lon, lats, lons)
+    inside = np.flatnonzero(distances <= radius_km)
+    return inside[np.argsort(distances[inside])][:k]
+
+
+class Command(BaseCommand):
+    help = "Time nearest coffee shop searches on the grid index against a full scan"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--points", type=int, default=600000)
+        parser.add_argument("--searches", type=int, default=500)
+        parser.add_argument("--k", type=int, default=20)
+        parser.add_argument("--radius", type=float, default=2, help="km")
+        parser.add_argument("--cell", type=float, default=0.05, help="grid cell size in degrees")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        count = options["points"]
+        lats, lons = rng.uniform(*LAT_RANGE, count), rng.uniform(*LON_RANGE, count)
+        start = time.perf_counter()
+        index = GridIndex(np.arange(count), lats, lons, options["cell"])
+        self.stdout.write(f"{count} points, index built in {time.perf_counter() - start:.2f}s")
+
+        targets = zip(rng.uniform(*LAT_RANGE, options["searches"]), rng.uniform(*LON_RANGE, options["searches"]))
+        k, radius = options["k"], options["radius"]
+        timings = {"grid": [], "full scan": []}
+        for lat, lon in targets:
+            for label, search in (
+                ("grid", lambda: index.nearest(lat, lon, radius, k)),
+                ("full scan", lambda: scan(lats, lons, lat, lon, radius, k)),
+            ):
+                start = time.perf_counter()
+                search()
+                timings[label].append(time.perf_counter() - start)
+
+        for label, times in timings.items():
+            times = np.array(times) * 1000
+            self.stdout.write(
+                f"{label:10} k={k} radius={radius:g}km  p50 {np.percentile(times, 50):7.3f} ms  "
+                f"p95 {np.percentile(times, 95):7.3f} ms  max {times.max():7.3f} ms"
+            )
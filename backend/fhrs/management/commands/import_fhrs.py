@@ -1,16 +1,23 @@
 # ------------------------------------------------------------------
 # This script is used to import food hygiene ratings from the Food Hygiene Rating Scheme (FHRS) API
-# This is the library that wewill use to make the HTTP requests to the API
+# Any number of local authority files can be imported. They are downloaded
+# in parallel, files that haven't changed since the last import are skipped,
+# and coffee shops are saved in batches (see fhrs/importer.py). Only new and
+# changed coffee shops are written; --prune also deletes the ones that have
+# gone from their authority's file
 #ref https://ratings.food.gov.uk/open-data-resources/documents/FHRS_APIv1_guidance_april24.pdf
+# usage: python manage.py import_fhrs [807 808 ...] [--workers 4] [--force] [--prune]
+#   Authorities default to settings.FHRS_AUTHORITIES. A URL or the path of a
+#   downloaded file can be given instead of an authority code (for testing offline).
 # ------------------------------------------------------------------
 
-import xml.etree.ElementTree as ET  # This is the XML parser that we will use to parse the data from the API
+import time
 
-import requests
+from django.conf import settings
 from django.core.management.base import (
     BaseCommand,
 )  # Imports the BaseCommand class from Django
-from fhrs.models import Business  # Imports the Business model from the fhrs app
+from fhrs.importer import sync_feeds
 
 
 # This is the command class that will be used to import the data
@@ -19,58 +26,34 @@ from fhrs.models import Business  # Imports the Business model from the fhrs app
 class Command(BaseCommand):
     help = "Import food hygiene ratings from FHRS API"
 
-    def handle(self, *args, **kwargs):
-        url = "https://ratings.food.gov.uk/api/open-data-files/FHRS807en-GB.xml"
-        response = requests.get(url)
-
-        if response.status_code != 200:  # Check if the request was successful
-            self.stderr.write("Failed to fetch data")
-            return
-
-        root = ET.fromstring(response.content)
-
-        # Iterates over each business stored in the XML data and then extracts the relevant info
-        for establishment in root.findall(".//EstablishmentDetail"):
-            name = establishment.find("BusinessName").text
-            business_type = establishment.find("BusinessType").text
-            address_parts = [
-                establishment.find(tag).text
-                for tag in ["AddressLine1", "AddressLine2", "AddressLine3", "PostCode"]
-                if establishment.find(tag) is not None
-            ]
-            address = ", ".join(address_parts)
-            rating = (
-                establishment.find("RatingValue").text
-                if establishment.find("RatingValue") is not None
-                else "Not Rated"
-            )
-            fhrs_id = int(establishment.find("FHRSID").text)
-            latitude = (
-                float(establishment.find("Geocode/Latitude").text)
-                if establishment.find("Geocode/Latitude") is not None
-                else None
-            )
-            longitude = (
-                float(establishment.find("Geocode/Longitude").text)
-                if establishment.find("Geocode/Longitude") is not None
-                else None
-            )
-
-            # Filter only coffee shops or cafés - to redduce returned records
-            if "cafe" in business_type.lower() or "coffee" in business_type.lower():
-                obj, created = Business.objects.update_or_create(
-                    fhrs_id=fhrs_id,
-                    defaults={
-                        "name": name,
-                        "business_type": business_type,
-                        "address": address,
-                        "rating": rating,
-                        "latitude": latitude,
-                        "longitude": longitude,
-                    },
-                )
-                self.stdout.write(
-                    f"{'Created' if created else 'Updated'}: {name} - {rating}"
-                )
-
-        self.stdout.write("Import completed.")
+    def add_arguments(self, parser):
+        parser.add_argument("sources", nargs="*", help="Authority codes, URLs or XML files")
+        parser.add_argument("--workers", type=int, default=None, help="Files downloaded at once")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--force", action="store_true", help="Import even unchanged files")
+        parser.add_argument(
+            "--prune", action="store_true", help="Delete coffee shops no longer in their authority's file"
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        sources = options["sources"] or settings.FHRS_AUTHORITIES
+        written = deleted = failed = 0
+        for result in sync_feeds(
+            sources, options["workers"], options["batch_size"], options["force"], options["prune"]
+        ):
+            if result.status == "imported":
+                written += result.stats.written
+                deleted += result.stats.deleted
+                self.stdout.write(f"{result.source}: {result.stats.summary()}")
+            elif result.status == "failed":  # Check if the request was successful
+                failed += 1
+                self.stderr.write(f"{result.source}: failed to fetch data: {result.error}")
+            else:
+                reason = "not modified" if result.status == "not_modified" else "same checksum"
+                self.stdout.write(f"{result.source}: unchanged ({reason}), skipped")
+
+        self.stdout.write(
+            f"Import completed: {len(sources)} files, {written} coffee shops saved, "
+            f"{deleted} deleted, {failed} failed in {time.perf_counter() - start:.1f}s"
+        )
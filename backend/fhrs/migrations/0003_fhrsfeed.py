@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fhrs', '0002_alter_business_rating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FhrsFeed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=500, unique=True)),
+                ('etag', models.CharField(blank=True, max_length=255)),
+                ('last_modified', models.CharField(blank=True, max_length=64)),
+                ('checksum', models.CharField(blank=True, max_length=64)),
+                ('establishments', models.PositiveIntegerField(default=0)),
+                ('coffee_shops', models.PositiveIntegerField(default=0)),
+                ('last_checked', models.DateTimeField(blank=True, null=True)),
+                ('last_imported', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
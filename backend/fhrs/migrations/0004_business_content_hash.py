@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fhrs', '0003_fhrsfeed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='business',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='business',
+            name='local_authority',
+            field=models.CharField(blank=True, db_index=True, max_length=20),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fhrs', '0004_business_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='business',
+            name='is_cafe',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='business',
+            name='postcode',
+            field=models.CharField(blank=True, max_length=8),
+        ),
+        migrations.AddIndex(
+            model_name='business',
+            index=models.Index(condition=models.Q(('is_cafe', True)), fields=['rating', 'postcode'], name='fhrs_cafe_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='business',
+            index=models.Index(condition=models.Q(('is_cafe', True)), fields=['postcode'], name='fhrs_cafe_postcode_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
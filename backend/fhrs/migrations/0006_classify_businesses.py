@@ -0,0 +1,41 @@
+# Sets is_cafe and postcode on the businesses imported before they existed.
+# is_cafe is one UPDATE; postcodes are pulled out of the addresses and
+# written back BATCH_SIZE rows at a time.
+
+import re
+
+from django.db import migrations
+from django.db.models import Q
+
+BATCH_SIZE = 2000
+# A copy of fhrs.models.POSTCODE, so this migration doesn't change if that does
+POSTCODE = re.compile(r"\b([A-Z]{1,2}[0-9][A-Z0-9]?) ?([0-9][A-Z]{2})\b")
+
+
+def classify(apps, schema_editor):
+    Business = apps.get_model("fhrs", "Business")
+    Business.objects.filter(
+        Q(business_type__icontains="cafe") | Q(business_type__icontains="coffee")
+    ).update(is_cafe=True)
+
+    batch = []
+    for business in Business.objects.filter(postcode="").only("pk", "address").iterator(BATCH_SIZE):
+        match = POSTCODE.search(" ".join(business.address.upper().split()))
+        if match:
+            business.postcode = f"{match[1]} {match[2]}"
+            batch.append(business)
+        if len(batch) == BATCH_SIZE:
+            Business.objects.bulk_update(batch, ["postcode"])
+            batch = []
+    Business.objects.bulk_update(batch, ["postcode"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("fhrs", "0005_business_is_cafe_postcode"),
+    ]
+
+    operations = [
+        migrations.RunPython(classify, migrations.RunPython.noop),
+    ]
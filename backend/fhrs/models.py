@@ -1,10 +1,48 @@
 # ------------------------------------------------------------------
 # Django model for storing business information from the Food Hygiene Rating Scheme (FHRS)
 # This data can then be used in the application to display information about locations and ratings
+# FhrsFeed remembers each authority file that has been imported, so the next
+# import can skip files that haven't changed (see importer.py)
+# Whether an establishment is a coffee shop, and its postcode, are worked out
+# once when it is imported or saved, so the cafe list can filter on indexed
+# columns instead of running LIKE '%cafe%' over the business type and address.
 ##ref https://ratings.food.gov.uk/open-data-resources/documents/FHRS_APIv1_guidance_april24.pdf
 #  ------------------------------------------------------------------
 
+import re
+
 from django.db import models
+from django.db.models import Q
+
+# A full UK postcode: outward code, optional space, inward code
+POSTCODE = re.compile(r"\b([A-Z]{1,2}[0-9][A-Z0-9]?) ?([0-9][A-Z]{2})\b")
+OUTWARD_CODE = re.compile(r"[A-Z]{1,2}[0-9][A-Z0-9]?")
+
+
+def is_coffee_shop(business_type):
+    # Filter only coffee shops or cafés - to reduce stored records
+    business_type = (business_type or "").lower()
+    return "cafe" in business_type or "coffee" in business_type
+
+
+def normalise_postcode(value):
+    """Upper case with single spaces, and "BT11AA" written as "BT1 1AA"."""
+    value = " ".join((value or "").upper().split())
+    match = POSTCODE.fullmatch(value)
+    return f"{match[1]} {match[2]}" if match else value
+
+
+def postcode_prefix(value):
+    """What a stored postcode starts with for a search. A bare outward code
+    ("BT9") gets its space, so it finds BT9 but not BT95."""
+    value = normalise_postcode(value)
+    return value + " " if OUTWARD_CODE.fullmatch(value) else value
+
+
+def find_postcode(text):
+    """The first full postcode in text (e.g. an address), normalised, or ""."""
+    match = POSTCODE.search(" ".join((text or "").upper().split()))
+    return f"{match[1]} {match[2]}" if match else ""
 
 
 class Business(models.Model):
@@ -15,9 +53,62 @@ class Business(models.Model):
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
     business_type = models.CharField(max_length=255)
+    # The FHRS LocalAuthorityCode, so establishments that drop out of their
+    # authority's file can be found and removed
+    local_authority = models.CharField(max_length=20, blank=True, db_index=True)
+    # sha256 of the imported fields - a re-import only writes rows whose hash changed
+    content_hash = models.CharField(max_length=64, blank=True)
+    is_cafe = models.BooleanField(default=False)  # is_coffee_shop(business_type)
+    postcode = models.CharField(max_length=8, blank=True)  # e.g. "BT1 1AA"
 
     def __str__(self):
         return f"{self.name} ({self.rating}) - {self.address} - {self.business_type}"
 
+    # Fields worked out from another field whenever that one is saved
+    DERIVED_FIELDS = {"business_type": "is_cafe", "address": "postcode"}
+
+    def save(self, *args, **kwargs):
+        # The import sets these itself (bulk_create doesn't call save)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "business_type" in update_fields:
+            self.is_cafe = is_coffee_shop(self.business_type)
+        if update_fields is None or "address" in update_fields:
+            self.postcode = find_postcode(self.address)
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, *(
+                self.DERIVED_FIELDS[field] for field in update_fields if field in self.DERIVED_FIELDS
+            )}
+        super().save(*args, **kwargs)
+
     class Meta:
-        pass
+        # For the cafe list's filters (see views.py). Partial indexes - only the
+        # coffee shops - so they match the list's "WHERE is_cafe" on Postgres
+        # and SQLite alike. varchar_pattern_ops lets Postgres use the postcode
+        # index for LIKE 'BT9%' whatever the collation (ignored elsewhere).
+        indexes = [
+            models.Index(
+                fields=["rating", "postcode"], condition=Q(is_cafe=True), name="fhrs_cafe_rating_idx"
+            ),
+            models.Index(
+                fields=["postcode"],
+                condition=Q(is_cafe=True),
+                name="fhrs_cafe_postcode_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ]
+
+class FhrsFeed(models.Model):
+    # An authority code ("807"), a URL or a local path - whatever was imported
+    source = models.CharField(max_length=500, unique=True)
+    # Validators sent back to the server to ask "has this changed?"
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    # sha256 of the last file imported, for servers that don't send validators
+    checksum = models.CharField(max_length=64, blank=True)
+    establishments = models.PositiveIntegerField(default=0)
+    coffee_shops = models.PositiveIntegerField(default=0)
+    last_checked = models.DateTimeField(null=True, blank=True)
+    last_imported = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"FHRS feed {self.source}"
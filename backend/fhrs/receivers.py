@@ -0,0 +1,23 @@
+# ------------------------------------------------------------------
+# Keeps the in-memory coffee shop index (geo.py) in step with the database.
+# The import sends business_changed for its bulk writes; edits made one at
+# a time (the admin, the shell) send post_save / post_delete. Either way
+# every process rebuilds its index on its next search.
+# ------------------------------------------------------------------
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .geo import engine
+from .models import Business
+from .signals import business_changed
+
+
+@receiver(business_changed)
+def rebuild_after_import(sender, created, updated, deleted, **kwargs):
+    engine.invalidate()
+
+
+@receiver(post_save, sender=Business)
+@receiver(post_delete, sender=Business)
+def rebuild_after_edit(sender, instance, **kwargs):
+    engine.invalidate()
@@ -10,7 +10,9 @@ from .models import Business
 class BusinessSerializer(serializers.ModelSerializer):
     class Meta:
         model = Business
-        fields = "__all__"  # Can be changed to specific fields if needed - to make irt more suitable for the coffee tracker app
+        # What the coffee tracker app shows - the import's bookkeeping columns
+        # (local_authority, content_hash, is_cafe, postcode) stay private
+        fields = ["id", "fhrs_id", "name", "address", "rating", "latitude", "longitude", "business_type"]
 
 
 def get_queryset(self):
@@ -21,3 +23,10 @@ def get_queryset(self):
             address__icontains=postcode
         )  # Filter by postcode in address
     return queryset
+
+
+class NearbyBusinessSerializer(BusinessSerializer):
+    distance_km = serializers.FloatField(read_only=True)
+
+    class Meta(BusinessSerializer.Meta):
+        fields = BusinessSerializer.Meta.fields + ["distance_km"]
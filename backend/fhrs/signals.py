@@ -0,0 +1,15 @@
+# ------------------------------------------------------------------
+# Signals sent by the FHRS import (see importer.py).
+# The import writes with bulk_create and bulk deletes, which don't send
+# post_save / post_delete, so anything caching Business data should listen
+# for business_changed instead. It is sent once per batch, after the batch
+# has been committed, with lists of the fhrs_ids that were created, updated
+# and deleted:
+#
+#   @receiver(business_changed)
+#   def refresh(sender, created, updated, deleted, **kwargs): ...
+# ------------------------------------------------------------------
+
+from django.dispatch import Signal
+
+business_changed = Signal()
@@ -76,3 +76,443 @@ class CoffeeShopListViewTests(TestCase):
         print(data)
         self.assertGreaterEqual(len(data), 1)
         self.assertTrue(all(item["rating"] == "5" for item in data))
+
+
+# Tests for the streaming FHRS import (fhrs/importer.py)
+import io
+import tracemalloc
+
+from django.core.management import call_command
+from django.test import override_settings
+
+from fhrs import importer
+
+
+def establishment_xml(
+    fhrs_id, name, business_type, rating="5", postcode="BT1 1AA", lat="54.59", authority="807"
+):
+    return f"""
+        <EstablishmentDetail>
+            <FHRSID>{fhrs_id}</FHRSID>
+            <LocalAuthorityCode>{authority}</LocalAuthorityCode>
+            <BusinessName>{name}</BusinessName>
+            <BusinessType>{business_type}</BusinessType>
+            <AddressLine1>1 High Street</AddressLine1>
+            <AddressLine2 />
+            <AddressLine3>Belfast</AddressLine3>
+            <PostCode>{postcode}</PostCode>
+            <RatingValue>{rating}</RatingValue>
+            <Geocode><Longitude>-5.93</Longitude><Latitude>{lat}</Latitude></Geocode>
+        </EstablishmentDetail>"""
+
+
+def fhrs_xml(*establishments):
+    return (
+        "<FHRSEstablishment><Header><ItemCount>%d</ItemCount></Header>"
+        "<EstablishmentCollection>%s</EstablishmentCollection></FHRSEstablishment>"
+        % (len(establishments), "".join(establishments))
+    ).encode()
+
+
+SAMPLE_XML = fhrs_xml(
+    establishment_xml(101, "Bean There", "Restaurant/Cafe/Canteen"),
+    establishment_xml(102, "Chip Inn", "Takeaway/sandwich shop"),
+    establishment_xml(103, "Daily Grind", "Coffee shop", rating="4", lat=""),
+)
+
+
+class FhrsImportTests(TestCase):
+    # Only cafes and coffee shops are kept, with the address put together from its parts
+    def test_import_file(self):
+        stats = importer.import_file(io.BytesIO(SAMPLE_XML))
+        self.assertEqual((stats.read, stats.written), (3, 2))
+        cafe = Business.objects.get(fhrs_id=101)
+        self.assertEqual(cafe.address, "1 High Street, Belfast, BT1 1AA")
+        self.assertEqual(cafe.latitude, 54.59)
+        self.assertIsNone(Business.objects.get(fhrs_id=103).latitude)
+        self.assertFalse(Business.objects.filter(fhrs_id=102).exists())
+
+    # Importing again updates the rows in place, a batch per statement
+    @override_settings(FHRS_IMPORT_BATCH_SIZE=1)
+    def test_reimport_updates(self):
+        importer.import_file(io.BytesIO(SAMPLE_XML))
+        changed = fhrs_xml(establishment_xml(101, "Bean There Again", "Cafe", rating="3"))
+        with self.assertNumQueries(4):  # stored hashes, savepoint, upsert, release
+            importer.import_file(io.BytesIO(changed))
+        cafe = Business.objects.get(fhrs_id=101)
+        self.assertEqual((cafe.name, cafe.rating), ("Bean There Again", "3"))
+        self.assertEqual(Business.objects.count(), 2)
+
+    # Elements are dropped from the tree once read, so memory doesn't grow with the file
+    def test_memory_flat(self):
+        big = io.BytesIO(fhrs_xml(*(establishment_xml(i, f"Cafe {i}", "Cafe") for i in range(5000))))
+        tracemalloc.start()
+        try:
+            for _ in importer.iter_establishments(big):
+                pass
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 1024 * 1024)
+
+
+
+# Tests for importing many authorities with conditional requests (fhrs/importer.py)
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from fhrs.models import FhrsFeed
+
+
+class StandInHandler(SimpleHTTPRequestHandler):
+    """Serves a folder of XML files like the FHRS site does, ETags and all."""
+
+    requests_seen = []
+    etag = None
+
+    def send_head(self):
+        self.requests_seen.append(self.path)
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                self.etag = '"%s"' % hashlib.md5(f.read()).hexdigest()
+            if self.headers.get("If-None-Match") == self.etag:
+                self.send_response(304)
+                self.end_headers()
+                return None
+        return super().send_head()
+
+    def end_headers(self):
+        if self.etag:
+            self.send_header("ETag", self.etag)
+        super().end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FhrsFeedTests(TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.write("807", SAMPLE_XML)
+        self.write("808", fhrs_xml(establishment_xml(201, "Brew Bar", "Coffee shop")))
+
+        StandInHandler.requests_seen = []
+        server = ThreadingHTTPServer(("127.0.0.1", 0), partial(StandInHandler, directory=self.folder))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        feed_url = f"http://127.0.0.1:{server.server_port}/FHRS{{authority}}en-GB.xml"
+        stand_in = override_settings(FHRS_FEED_URL=feed_url, FHRS_FETCH_WORKERS=2)
+        stand_in.enable()
+        self.addCleanup(stand_in.disable)
+
+    def write(self, authority, data):
+        path = os.path.join(self.folder, f"FHRS{authority}en-GB.xml")
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def sync(self, sources, **kwargs):
+        return {r.source: r for r in importer.sync_feeds(sources, **kwargs)}
+
+    # Every authority is fetched and imported; a second run gets 304s and writes nothing
+    def test_conditional_fetch(self):
+        first = self.sync(["807", "808"])
+        self.assertEqual({r.status for r in first.values()}, {"imported"})
+        self.assertEqual(Business.objects.count(), 3)
+        self.assertTrue(FhrsFeed.objects.get(source="807").etag)
+
+        with self.assertNumQueries(4):  # looking up and saving the two feeds, nothing else
+            second = self.sync(["807", "808"])
+        self.assertEqual({r.status for r in second.values()}, {"not_modified"})
+
+        # Only the file that changed is imported again
+        self.write("808", fhrs_xml(establishment_xml(201, "Brew Bar", "Coffee shop", rating="2")))
+        third = self.sync(["807", "808"])
+        self.assertEqual(third["807"].status, "not_modified")
+        self.assertEqual(third["808"].status, "imported")
+        self.assertEqual(Business.objects.get(fhrs_id=201).rating, "2")
+        self.assertEqual(len(StandInHandler.requests_seen), 6)
+
+    # Local files are checksummed instead, and --force imports them anyway
+    def test_local_file_checksum(self):
+        path = self.write("900", SAMPLE_XML)
+        self.assertEqual(self.sync([path])[path].status, "imported")
+        self.assertEqual(self.sync([path])[path].status, "unchanged")
+        self.assertEqual(self.sync([path], force=True)[path].status, "imported")
+
+    # One bad source doesn't stop the others
+    def test_failed_source(self):
+        results = self.sync(["807", "/no/such/file.xml", "999"])
+        self.assertEqual(results["807"].status, "imported")
+        self.assertEqual(results["/no/such/file.xml"].status, "failed")
+        self.assertEqual(results["999"].status, "failed")  # 404 from the server
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command("import_fhrs", "807", "808", stdout=out)
+        call_command("import_fhrs", "807", stdout=out)
+        output = out.getvalue()
+        self.assertIn("807: 2 new, 0 updated, 0 unchanged, 0 deleted (3 establishments read)", output)
+        self.assertIn("807: unchanged (not modified), skipped", output)
+        self.assertIn("Import completed: 2 files, 3 coffee shops saved, 0 deleted, 0 failed", output)
+
+
+# Tests for re-imports that only write what changed
+from fhrs.signals import business_changed
+
+
+class FhrsDiffTests(TestCase):
+    def setUp(self):
+        importer.import_file(io.BytesIO(SAMPLE_XML))
+        Business.objects.create(
+            fhrs_id=999, name="Elsewhere Cafe", address="", business_type="Cafe", local_authority="900"
+        )
+        self.events = []
+
+        def record(sender, created, updated, deleted, **kwargs):
+            self.events.append((created, updated, deleted))
+
+        business_changed.connect(record)
+        self.addCleanup(business_changed.disconnect, record)
+
+    # An unchanged file only costs the SELECT of the stored hashes
+    def test_unchanged_not_written(self):
+        with self.assertNumQueries(1):
+            stats = importer.import_file(io.BytesIO(SAMPLE_XML))
+        self.assertEqual((stats.created, stats.updated, stats.unchanged), (0, 0, 2))
+
+    # Only the changed row is written, and listeners hear about it after the commit
+    def test_changed_row(self):
+        changed = fhrs_xml(
+            establishment_xml(101, "Bean There", "Restaurant/Cafe/Canteen", rating="2"),
+            establishment_xml(103, "Daily Grind", "Coffee shop", rating="4", lat=""),
+            establishment_xml(104, "New Brew", "Coffee shop"),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = importer.import_file(io.BytesIO(changed))
+        self.assertEqual(stats.summary(), "1 new, 1 updated, 1 unchanged, 0 deleted (3 establishments read)")
+        self.assertEqual(self.events, [([104], [101], [])])
+        self.assertEqual(Business.objects.get(fhrs_id=101).rating, "2")
+
+    # Pruning removes shops that left the file, but only from the file's own authorities
+    def test_prune(self):
+        smaller = fhrs_xml(establishment_xml(101, "Bean There", "Restaurant/Cafe/Canteen"))
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = importer.import_file(io.BytesIO(smaller), prune_missing=True)
+        self.assertEqual(stats.deleted, 1)
+        self.assertEqual(self.events, [([], [], [103])])
+        self.assertEqual(sorted(Business.objects.values_list("fhrs_id", flat=True)), [101, 999])
+
+        # Without prune nothing is deleted
+        importer.import_file(io.BytesIO(fhrs_xml()), prune_missing=False)
+        self.assertEqual(Business.objects.count(), 2)
+
+
+# Tests for the coffee shops near me search (fhrs/geo.py)
+import numpy as np
+
+from fhrs.geo import GridIndex, engine as geo_engine, haversine_km, warm_on_startup
+
+
+class GridIndexTests(TestCase):
+    # The grid gives the same answer as measuring the distance to every point
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(7)
+        lats, lons = rng.uniform(54.0, 55.2, 5000), rng.uniform(-7.0, -5.4, 5000)
+        index = GridIndex(np.arange(5000), lats, lons, cell_degrees=0.05)
+        for lat, lon, radius in ((54.597, -5.93, 2), (54.3, -6.5, 8), (55.19, -5.41, 3)):
+            distances = haversine_km(lat, lon, lats, lons)
+            inside = np.flatnonzero(distances <= radius)
+            expected = inside[np.argsort(distances[inside], kind="stable")][:20].tolist()
+            self.assertEqual([pk for pk, _ in index.nearest(lat, lon, radius, 20)], expected)
+
+    def test_empty_index(self):
+        index = GridIndex([], [], [])
+        self.assertEqual(index.nearest(54.6, -5.9, 5, 20), [])
+
+
+class CoffeeShopNearbyViewTests(TestCase):
+    url = "/api/cafes/nearby/"
+
+    def setUp(self):
+        # Belfast city centre, about 0.6 km and 2.5 km away, plus one in Derry
+        for fhrs_id, name, lat, lon in (
+            (1, "City Hall Cafe", 54.5965, -5.9301),
+            (2, "Lanyon Coffee", 54.5845, -5.9340),
+            (3, "Stranmillis Cafe", 54.5741, -5.9365),
+            (4, "Derry Coffee", 54.9966, -7.3086),
+        ):
+            Business.objects.create(
+                fhrs_id=fhrs_id, name=name, address="", rating="5", business_type="Cafe",
+                latitude=lat, longitude=lon,
+            )
+        Business.objects.create(fhrs_id=5, name="No Geocode Cafe", address="", business_type="Cafe")
+
+    def test_nearest_first(self):
+        response = self.client.get(self.url, {"lat": 54.5970, "lon": -5.9300, "radius": 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([shop["name"] for shop in response.json()], [
+            "City Hall Cafe", "Lanyon Coffee", "Stranmillis Cafe",
+        ])
+        distances = [shop["distance_km"] for shop in response.json()]
+        self.assertEqual(distances, sorted(distances))
+        self.assertLess(distances[0], 0.1)
+
+    def test_radius_and_k(self):
+        response = self.client.get(self.url, {"lat": 54.5970, "lon": -5.9300, "radius": 2, "k": 1})
+        self.assertEqual([shop["fhrs_id"] for shop in response.json()], [1])
+        response = self.client.get(self.url, {"lat": 54.5970, "lon": -5.9300, "radius": 2})
+        self.assertEqual([shop["fhrs_id"] for shop in response.json()], [1, 2])
+
+    def test_bad_parameters(self):
+        for params in ({"lat": 54.6}, {"lat": "x", "lon": 1}, {"lat": 95, "lon": 0},
+                       {"lat": 54.6, "lon": -5.9, "radius": 0}, {"lat": 54.6, "lon": -5.9, "k": "1.5"}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400, params)
+
+    # Both cafe endpoints leave out the import's bookkeeping columns
+    def test_public_fields_only(self):
+        nearby = self.client.get(self.url, {"lat": 54.5970, "lon": -5.9300, "radius": 1}).json()[0]
+        listed = self.client.get("/api/cafes/").json()[0]
+        for shop in (nearby, listed):
+            for field in ("content_hash", "local_authority", "is_cafe", "postcode"):
+                self.assertNotIn(field, shop)
+        self.assertEqual(nearby["name"], "City Hall Cafe")
+        self.assertIn("distance_km", nearby)
+
+    # Saves and imports make the index rebuild, so new shops are found straight away
+    def test_index_follows_changes(self):
+        params = {"lat": 54.9966, "lon": -7.3086, "radius": 1}
+        self.assertEqual(len(self.client.get(self.url, params).json()), 1)
+        Business.objects.create(
+            fhrs_id=6, name="Guildhall Cafe", address="", business_type="Cafe",
+            latitude=54.9960, longitude=-7.3200,
+        )
+        self.assertEqual(len(self.client.get(self.url, params).json()), 2)
+
+        # The import writes with bulk_create, so this relies on business_changed
+        generation = geo_engine.generation
+        xml = fhrs_xml(establishment_xml(7, "Walls Coffee", "Coffee shop", lat="54.9970"))
+        with self.captureOnCommitCallbacks(execute=True):
+            importer.import_file(io.BytesIO(xml))
+        params["lon"] = -5.93
+        self.assertEqual([shop["fhrs_id"] for shop in self.client.get(self.url, params).json()], [7])
+        self.assertNotEqual(geo_engine.generation, generation)
+
+    # After the index is built a search is one query, for the shops it found
+    def test_one_query(self):
+        params = {"lat": 54.5970, "lon": -5.9300}
+        self.client.get(self.url, params)
+        with self.assertNumQueries(1):
+            self.client.get(self.url, params)
+
+    # ASGI servers run inside an event loop, where the ORM can't be used synchronously
+    def test_warm_on_startup_in_event_loop(self):
+        import asyncio
+
+        async def startup():
+            warm_on_startup()
+
+        with self.assertLogs("fhrs.geo", "WARNING"):
+            asyncio.run(startup())
+
+
+# Tests for the indexed cafe classification (is_cafe / postcode)
+from importlib import import_module
+from unittest import skipUnless
+
+from django.apps import apps
+from django.db import connection
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from fhrs.models import find_postcode, normalise_postcode, postcode_prefix
+from fhrs.views import CoffeeShopListView
+
+
+class CafeClassificationTests(TestCase):
+    def test_postcodes(self):
+        self.assertEqual(find_postcode("12 Lisburn Rd, Belfast bt9  6ab"), "BT9 6AB")
+        self.assertEqual(find_postcode("SW1A1AA"), "SW1A 1AA")
+        self.assertEqual(find_postcode("Belfast"), "")
+        self.assertEqual(normalise_postcode(" bt9 "), "BT9")
+        self.assertEqual(normalise_postcode("bt95ab"), "BT9 5AB")
+        self.assertEqual(postcode_prefix("bt9"), "BT9 ")
+        self.assertEqual(postcode_prefix("BT9 5"), "BT9 5")
+
+    def test_import_classifies(self):
+        importer.import_file(io.BytesIO(SAMPLE_XML))
+        self.assertEqual(
+            list(Business.objects.order_by("fhrs_id").values_list("fhrs_id", "is_cafe", "postcode")),
+            [(101, True, "BT1 1AA"), (103, True, "BT1 1AA")],
+        )
+
+    def test_save_classifies(self):
+        shop = Business.objects.create(fhrs_id=1, name="A", address="1 Main St, BT7 1NN", business_type="Pub/bar")
+        self.assertEqual((shop.is_cafe, shop.postcode), (False, "BT7 1NN"))
+        shop.business_type = "Coffee shop"
+        shop.save()
+        self.assertTrue(Business.objects.get(pk=shop.pk).is_cafe)
+
+    # Editing the address moves the postcode with it, including saves of just that field
+    def test_save_updates_postcode(self):
+        shop = Business.objects.create(fhrs_id=1, name="A", address="1 Main St, BT7 1NN", business_type="Cafe")
+        shop.address = "2 High St, BT1 1AA"
+        shop.save()
+        self.assertEqual(Business.objects.get(pk=shop.pk).postcode, "BT1 1AA")
+        shop.address = "3 Low Rd, Belfast"
+        shop.save(update_fields=["address"])
+        self.assertEqual(Business.objects.get(pk=shop.pk).postcode, "")
+        shop.business_type = "Pub/bar"
+        shop.save(update_fields=["business_type"])
+        self.assertFalse(Business.objects.get(pk=shop.pk).is_cafe)
+
+    # Rows from before the columns existed are filled in by the data migration
+    def test_data_migration(self):
+        Business.objects.bulk_create([
+            Business(fhrs_id=1, name="A", address="1 Main St, BT7 1NN", business_type="Restaurant/Cafe/Canteen"),
+            Business(fhrs_id=2, name="B", address="Somewhere", business_type="Pub/bar"),
+        ])
+        import_module("fhrs.migrations.0006_classify_businesses").classify(apps, None)
+        self.assertEqual(
+            list(Business.objects.order_by("fhrs_id").values_list("is_cafe", "postcode")),
+            [(True, "BT7 1NN"), (False, "")],
+        )
+
+    def test_postcode_filter(self):
+        Business.objects.create(fhrs_id=1, name="A", address="1 Main St, BT9 5AB", business_type="Cafe")
+        Business.objects.create(fhrs_id=2, name="B", address="1 Main St, BT95 1AA", business_type="Cafe")
+        # An outward code is the whole district - BT9 isn't the start of BT95
+        for postcode, expected in (
+            ("bt9", [1]), ("bt9 5ab", [1]), ("bt95ab", [1]), ("BT95", [2]), ("BT", [1, 2]),
+        ):
+            response = self.client.get("/api/cafes/", {"postcode": postcode})
+            self.assertEqual(sorted(shop["fhrs_id"] for shop in response.json()), expected, postcode)
+
+
+# The cafe list's filters are answered from the indexes, not a scan of every business
+class CafeIndexExplainTests(TestCase):
+    def plan(self, **params):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")  # the test table is tiny
+        view = CoffeeShopListView()
+        view.request = Request(APIRequestFactory().get("/api/cafes/", params))
+        return view.get_queryset().explain()
+
+    def test_rating_uses_index(self):
+        self.assertIn("fhrs_cafe_rating_idx", self.plan(rating="5"))
+        self.assertIn("fhrs_cafe_rating_idx", self.plan(rating="5", postcode="BT9"))
+
+    # SQLite can't seek a LIKE prefix on a case-sensitive column, so this is Postgres only
+    @skipUnless(connection.vendor == "postgresql", "needs varchar_pattern_ops")
+    def test_postcode_uses_index(self):
+        self.assertIn("fhrs_cafe_postcode_idx", self.plan(postcode="BT9"))
+        self.assertIn("Index Cond", self.plan(postcode="BT9 5AB"))
@@ -3,9 +3,10 @@
 #ref https://ratings.food.gov.uk/open-data-resources/documents/FHRS_APIv1_guidance_april24.pdf
 # ---------------------------------------------------------------
 from django.urls import path
-from .views import CoffeeShopListView
+from .views import CoffeeShopListView, CoffeeShopNearbyView
 
 urlpatterns = [
     path("shop-profile/", CoffeeShopListView.as_view(), name="shop-profile"),
     path("api/cafes/", CoffeeShopListView.as_view(), name="api-cafes"),
+    path("api/cafes/nearby/", CoffeeShopNearbyView.as_view(), name="api-cafes-nearby"),
 ]
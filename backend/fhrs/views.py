@@ -3,20 +3,24 @@
 #ref https://ratings.food.gov.uk/open-data-resources/documents/FHRS_APIv1_guidance_april24.pdf
 # --------------------------------------------------------
 
-from django.db.models import Q
-from rest_framework import generics
+import math
 
-from .models import Business
-from .serializers import BusinessSerializer
+from django.conf import settings
+from rest_framework import generics, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .geo import engine as geo_engine
+from .models import Business, postcode_prefix
+from .serializers import BusinessSerializer, NearbyBusinessSerializer
 
 
 class CoffeeShopListView(generics.ListAPIView):
     serializer_class = BusinessSerializer
 
     def get_queryset(self):
-        queryset = Business.objects.filter(
-            Q(business_type__icontains="cafe") | Q(business_type__icontains="coffee")
-        )
+        # is_cafe and postcode are set at import, and indexed (see models.py)
+        queryset = Business.objects.filter(is_cafe=True)
 
         # Gets the query parameters from the URL
         rating = self.request.query_params.get("rating", None)
@@ -28,9 +32,46 @@ class CoffeeShopListView(generics.ListAPIView):
             queryset = queryset.filter(rating=rating)
         if postcode:
             queryset = queryset.filter(
-                address__startswith=postcode[:4].upper()
-            )  # Filter by postcode in address
+                postcode__startswith=postcode_prefix(postcode)
+            )  # "BT9" finds the whole district, "BT9 5AB" one postcode
         if name:
             queryset = queryset.filter(name__icontains=name)
 
         return queryset
+
+
+# Coffee shops near a point, closest first, from the in-memory grid (see geo.py)
+# usage: /api/cafes/nearby/?lat=54.597&lon=-5.930&radius=2&k=20  (radius in km)
+class CoffeeShopNearbyView(APIView):
+    def get(self, request):
+        params = request.query_params
+        try:
+            lat = float(params["lat"])
+            lon = float(params["lon"])
+            radius = float(params.get("radius", settings.FHRS_NEARBY_DEFAULT_RADIUS_KM))
+            k = int(params.get("k", settings.FHRS_NEARBY_DEFAULT_K))
+        except KeyError:
+            return Response({"error": "lat and lon are required"}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response(
+                {"error": "lat, lon and radius must be numbers and k a whole number"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return Response({"error": "lat or lon is out of range"}, status=status.HTTP_400_BAD_REQUEST)
+        if not math.isfinite(radius) or radius <= 0 or k <= 0:
+            return Response(
+                {"error": "radius and k must be greater than 0"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        radius = min(radius, settings.FHRS_NEARBY_MAX_RADIUS_KM)
+        nearest = geo_engine.nearest(lat, lon, radius, min(k, settings.FHRS_NEARBY_MAX_K))
+        # One query by primary key for the k shops found
+        shops = Business.objects.in_bulk([pk for pk, _ in nearest])
+        results = []
+        for pk, distance in nearest:
+            if pk in shops:  # skip any deleted since the index was built
+                shop = shops[pk]
+                shop.distance_km = round(distance, 3)
+                results.append(shop)
+        return Response(NearbyBusinessSerializer(results, many=True).data)
@@ -0,0 +1,13 @@
+# ------------------------------------------------------------
+# This file is used to configure the main mycoffeeapp application.
+# It makes sure the leaderboard signals are loaded when the app is ready.
+# ------------------------------------------------------------
+from django.apps import AppConfig
+
+
+class MycoffeeappConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "mycoffeeapp"
+
+    def ready(self):
+        import mycoffeeapp.signals  # Keeps the in-memory leaderboard up to date
@@ -20,3 +20,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mycoffeeapp.settings")
 
 application = get_asgi_application()
+
+# The in-memory leaderboard and coffee shop index are loaded by the first
+# request that reads them. ASGI servers such as uvicorn import this module
+# inside their event loop, where Django refuses synchronous database queries,
+# so they aren't warmed here as wsgi.py does.
@@ -33,7 +33,7 @@ class PriceEntryForm(forms.ModelForm):
 
     def clean_document(self):
         document = self.cleaned_data.get("document")
-        if document and not allowed_file(document.name):
+        if document and not allowed_file(document):
             raise forms.ValidationError("Invalid file type")
         return document
 
@@ -0,0 +1,346 @@
+# +-----------------------------------------------------+
+# In-memory leaderboard for the price guessing game.
+# Instead of sorting the whole Leaderboard table on every request, each
+# worker process keeps the current top scores in a small bounded min-heap,
+# plus a ranked list of every player's best score for the daily, weekly and
+# all-time windows so "what's my rank" is a binary search rather than a
+# COUNT(*) over the table. Everything is loaded from the database once (at
+# startup or on first use) and then updated as new scores are saved (see
+# signals.py), so reading the leaderboard does no database work at all.
+#
+# Each process has its own copy, so two counters are kept in Django's cache:
+# "writes" goes up when a new score is committed, telling the other processes
+# to fetch just the rows they have not seen yet (the table is append-only), and
+# "generation" goes up when entries are deleted or users renamed, telling
+# them to reload everything. Ids are handed out at insert but rows become
+# visible at commit, so a lower id can turn up after a higher one has been
+# fetched; a sync that finds fewer new rows than "writes" says were added
+# reloads everything rather than miss it. With a shared cache (Redis/Memcached) this keeps
+# every worker in step; with the default local-memory cache there is only
+# ever one process to worry about.
+# ref https://docs.python.org/3/library/heapq.html
+# ref https://docs.python.org/3/library/bisect.html
+# ref https://docs.djangoproject.com/en/5.1/topics/cache/#cache-versioning
+# +-----------------------------------------------------+
+
+import heapq
+import logging
+import threading
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SynchronousOnlyOperation
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "leaderboard:generation"
+WRITES_KEY = "leaderboard:writes"
+
+WINDOWS = ("daily", "weekly", "all")
+
+ENTRY_FIELDS = ("id", "user_id", "user__username", "points", "timestamp")
+
+
+def rank_key(points, timestamp, entry_id):
+    """Sort key where bigger is better: highest points first, then the earliest entry."""
+    return (points, -timestamp.timestamp(), -entry_id)
+
+
+def window_start(window, now=None):
+    """When the current daily / weekly window began (None for all-time)."""
+    if window == "all":
+        return None
+    now = timezone.localtime(now)
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == "weekly":
+        start -= timedelta(days=start.weekday())  # weeks start on Monday
+    return start
+
+
+class TopKLeaderboard:
+    """The best `k` scores, kept in a min-heap so the weakest entry is always at heap[0]."""
+
+    def __init__(self, k=10, unique_users=False):
+        self.k = k
+        self.unique_users = unique_users
+        self._heap = []  # (rank_key, user_id, username, points)
+        self._by_user = {}  # user_id -> heap item, only used when unique_users is on
+        self._snapshot = []
+
+    def __len__(self):
+        return len(self._heap)
+
+    def has_user(self, user_id):
+        return any(item[1] == user_id for item in self._heap)
+
+    def add(self, user_id, username, points, timestamp, entry_id):
+        """Offer a score to the board. Returns True if the board changed."""
+        item = (rank_key(points, timestamp, entry_id), user_id, username, points)
+
+        if self.unique_users and user_id in self._by_user:
+            # Only the user's best score is kept on the board
+            current = self._by_user[user_id]
+            if item[0] <= current[0]:
+                return False
+            self._heap.remove(current)
+            heapq.heapify(self._heap)
+            heapq.heappush(self._heap, item)
+        elif len(self._heap) < self.k:
+            heapq.heappush(self._heap, item)
+        elif item[0] > self._heap[0][0]:
+            evicted = heapq.heapreplace(self._heap, item)
+            self._by_user.pop(evicted[1], None)
+        else:
+            return False
+
+        if self.unique_users:
+            self._by_user[user_id] = item
+        self._snapshot = [
+            {"username": username, "points": points}
+            for _, _, username, points in sorted(self._heap, reverse=True)
+        ]
+        return True
+
+    def top(self):
+        """The board best-first, in the same shape as LeaderboardSerializer."""
+        return self._snapshot
+
+
+class RankedBoard:
+    """Every player's best score in one sorted list, so a rank is a single binary search.
+
+    Lookups are O(log n); inserting shifts the list along with a memmove, which
+    stays fast well into hundreds of thousands of players.
+    """
+
+    def __init__(self):
+        self._keys = []  # sorted best-first: (-points, timestamp, entry_id, user_id)
+        self._best = {}  # user_id -> that user's key in _keys
+        self._names = {}  # user_id -> username
+
+    def __len__(self):
+        return len(self._keys)
+
+    def has_user(self, user_id):
+        return user_id in self._best
+
+    def add(self, user_id, username, points, timestamp, entry_id):
+        key = (-points, timestamp.timestamp(), entry_id, user_id)
+        current = self._best.get(user_id)
+        if current is not None:
+            if key >= current:
+                return False  # not better than the score they already have
+            del self._keys[bisect_left(self._keys, current)]
+        insort(self._keys, key)
+        self._best[user_id] = key
+        self._names[user_id] = username
+        return True
+
+    def _entry(self, position):
+        key = self._keys[position]
+        return {
+            "rank": position + 1,
+            "username": self._names[key[3]],
+            "points": -key[0],
+        }
+
+    def top(self, n):
+        return [self._entry(i) for i in range(min(n, len(self._keys)))]
+
+    def rank(self, user_id):
+        key = self._best.get(user_id)
+        return None if key is None else bisect_left(self._keys, key) + 1
+
+    def around(self, user_id, n):
+        """The user's entry with up to n players either side of it."""
+        rank = self.rank(user_id)
+        if rank is None:
+            return []
+        first = max(0, rank - 1 - n)
+        last = min(len(self._keys), rank + n)
+        return [self._entry(i) for i in range(first, last)]
+
+
+class LeaderboardEngine:
+    """Holds this process's boards and keeps them in step with the database."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.board = None  # all-time TopKLeaderboard behind the classic top 10
+            self.windows = {}  # window name -> (window start, RankedBoard)
+            self.generation = None
+            self.writes = None
+            self.last_id = 0
+            self.counted_here = 0  # our own new scores included in "writes" since the last sync
+            self.loads = 0  # bumped by warm(), so a commit from before a reload isn't counted
+
+    # -- loading ------------------------------------------------------
+
+    def _entries(self, since=None):
+        from .models import Leaderboard
+
+        entries = Leaderboard.objects.values_list(*ENTRY_FIELDS)
+        if since is not None:
+            entries = entries.filter(timestamp__gte=since)
+        return entries
+
+    def _load_top(self):
+        board = TopKLeaderboard(
+            k=settings.LEADERBOARD_SIZE, unique_users=settings.LEADERBOARD_UNIQUE_USERS
+        )
+        entries = self._entries().order_by("-points", "timestamp", "id")
+        if not board.unique_users:
+            entries = entries[: board.k]
+
+        users = set()
+        for entry_id, user_id, username, points, timestamp in entries.iterator():
+            board.add(user_id, username, points, timestamp, entry_id)
+            users.add(user_id)
+            # Rows come back best first, so once k different users are seen we are done
+            if len(users) >= board.k:
+                break
+        return board
+
+    def _load_window(self, window, now=None):
+        start = window_start(window, now)
+        board = RankedBoard()
+        for entry_id, user_id, username, points, timestamp in self._entries(start).iterator():
+            board.add(user_id, username, points, timestamp, entry_id)
+            self.last_id = max(self.last_id, entry_id)
+        self.windows[window] = (start, board)
+
+    def warm(self):
+        """(Re)load every board from the database."""
+        with self._lock:
+            shared = cache.get_many([GENERATION_KEY, WRITES_KEY])
+            self.generation = shared.get(GENERATION_KEY, 0)
+            self.writes = shared.get(WRITES_KEY, 0)
+            cache.add(GENERATION_KEY, self.generation, timeout=None)
+            cache.add(WRITES_KEY, self.writes, timeout=None)
+
+            self.last_id = 0
+            self.counted_here = 0
+            self.loads += 1
+            self.board = self._load_top()
+            for window in WINDOWS:
+                self._load_window(window)
+
+    def _apply(self, entry_id, user_id, username, points, timestamp):
+        self.board.add(user_id, username, points, timestamp, entry_id)
+        for start, board in self.windows.values():
+            if start is None or timestamp >= start:
+                board.add(user_id, username, points, timestamp, entry_id)
+        self.last_id = max(self.last_id, entry_id)
+
+    def sync(self):
+        """Bring this process up to date. Costs one cache read when nothing has changed."""
+        with self._lock:
+            if self.board is None:
+                return self.warm()
+
+            shared = cache.get_many([GENERATION_KEY, WRITES_KEY])
+            if shared.get(GENERATION_KEY, 0) != self.generation:
+                return self.warm()
+
+            writes = shared.get(WRITES_KEY, 0)
+            if writes - self.writes != self.counted_here:
+                # Other processes saved scores - fetch only the rows we haven't seen
+                fetched = 0
+                new_entries = self._entries().filter(id__gt=self.last_id).order_by("id")
+                for entry in new_entries.iterator():
+                    self._apply(*entry)
+                    fetched += 1
+                if self.writes + self.counted_here + fetched < writes:
+                    # A score with a lower id than one we already had was committed late
+                    return self.warm()
+            self.writes = writes
+            self.counted_here = 0
+
+            # Start a fresh board when a new day / week begins
+            now = timezone.now()
+            for window, (start, _) in list(self.windows.items()):
+                if start is not None and start != window_start(window, now):
+                    self._load_window(window, now)
+
+    # -- reading ------------------------------------------------------
+
+    def top(self, window=None):
+        """The top scores - the classic all-time top 10, or the best per player in a window."""
+        self.sync()
+        if window is None:
+            return self.board.top()
+        return self.windows[window][1].top(settings.LEADERBOARD_SIZE)
+
+    def rank(self, user_id, window="all", around=5):
+        self.sync()
+        board = self.windows[window][1]
+        return {
+            "window": window,
+            "rank": board.rank(user_id),
+            "players": len(board),
+            "nearby": board.around(user_id, around),
+        }
+
+    # -- writing ------------------------------------------------------
+
+    def _bump(self, key):
+        try:
+            return cache.incr(key)
+        except ValueError:  # the key was evicted from the cache
+            cache.set(key, 1, timeout=None)
+            return 1
+
+    def record(self, entry):
+        """Add a newly saved Leaderboard entry to the boards.
+
+        It shows here straight away; the other processes are told once it is committed.
+        """
+        with self._lock:
+            applied = self.board is not None  # if not, the next read loads it with this entry
+            if applied:
+                self._apply(
+                    entry.pk, entry.user_id, entry.user.username, int(entry.points), entry.timestamp
+                )
+            loads = self.loads
+        transaction.on_commit(lambda: self._committed(applied, loads))
+
+    def _committed(self, applied, loads):
+        with self._lock:
+            self._bump(WRITES_KEY)
+            if applied and loads == self.loads:
+                self.counted_here += 1  # so our next sync doesn't go looking for it
+
+    def invalidate(self):
+        """Make every process reload (used when entries are deleted or users renamed)."""
+        with self._lock:
+            self.board = None
+            self._bump(GENERATION_KEY)
+
+    def has_user(self, user_id):
+        with self._lock:
+            if self.board is None:
+                return False
+            return any(board.has_user(user_id) for _, board in self.windows.values())
+
+
+engine = LeaderboardEngine()
+
+
+def warm_on_startup():
+    """Called from wsgi.py so the first request doesn't pay for loading the board."""
+    if not settings.LEADERBOARD_WARM_ON_STARTUP:
+        return
+    try:
+        engine.warm()
+    except (DatabaseError, SynchronousOnlyOperation) as e:
+        # e.g. migrations not run yet, or called inside an event loop - the board
+        # will load on first use instead
+        logger.warning("Could not load leaderboard at startup: %s", e)
@@ -0,0 +1,129 @@
+# ------------------------------------------------------------------
+# Load benchmark for the leaderboard.
+# Seeds some players and scores, then has several threads submit scores at the
+# same time (through the ORM, so the signals update the in-memory boards just
+# like the real view) while looking up ranks. Rank lookups from the in-memory
+# boards are compared with the COUNT(*) WHERE points > x query they replace.
+# The bench users (and their scores) are deleted again at the end.
+# usage: python manage.py bench_leaderboard --players 2000 --threads 8
+# ------------------------------------------------------------------
+
+import random
+import statistics
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from mycoffeeapp.leaderboard import engine
+from mycoffeeapp.models import Leaderboard
+
+PREFIX = "bench-player-"
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda p: samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+    return f"p50 {pick(0.5):7.3f}ms  p95 {pick(0.95):7.3f}ms  p99 {pick(0.99):7.3f}ms"
+
+
+class Command(BaseCommand):
+    help = "Benchmark concurrent score submissions and rank lookups on the leaderboard"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--players", type=int, default=1000)
+        parser.add_argument("--scores", type=int, default=10000)
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--submissions", type=int, default=200, help="per thread")
+
+    def handle(self, *args, **options):
+        try:
+            users = self.seed(options["players"], options["scores"])
+            start = time.perf_counter()
+            engine.reset()
+            engine.warm()
+            self.stdout.write(f"Loaded boards in {time.perf_counter() - start:.3f}s")
+            self.run_load(users, options["threads"], options["submissions"])
+            self.compare_rank_queries(users)
+        finally:
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+    def seed(self, players, scores):
+        User.objects.filter(username__startswith=PREFIX).delete()
+        User.objects.bulk_create(
+            [User(username=f"{PREFIX}{i}") for i in range(players)], batch_size=1000
+        )
+        users = list(User.objects.filter(username__startswith=PREFIX))
+        Leaderboard.objects.bulk_create(
+            [
+                Leaderboard(user=random.choice(users), points=random.randint(0, 1000))
+                for _ in range(scores)
+            ],
+            batch_size=5000,
+        )
+        return users
+
+    def run_load(self, users, threads, submissions):
+        submit_times, rank_times, errors = [], [], []
+        lock = threading.Lock()
+
+        def player():
+            local_submit, local_rank = [], []
+            try:
+                for _ in range(submissions):
+                    user = random.choice(users)
+                    start = time.perf_counter()
+                    Leaderboard.objects.create(user=user, points=random.randint(0, 1000))
+                    local_submit.append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    engine.rank(user.pk, random.choice(["daily", "weekly", "all"]))
+                    local_rank.append(time.perf_counter() - start)
+            except Exception as e:  # keep going and report at the end
+                errors.append(e)
+            finally:
+                connection.close()
+            with lock:
+                submit_times.extend(local_submit)
+                rank_times.extend(local_rank)
+
+        workers = [threading.Thread(target=player) for _ in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{len(submit_times)} submissions from {threads} threads in {elapsed:.2f}s "
+            f"({len(submit_times) / elapsed:.0f}/s)"
+        )
+        if submit_times:
+            self.stdout.write(f"submit            {percentiles(submit_times)}")
+            self.stdout.write(f"rank (in memory)  {percentiles(rank_times)}")
+        for error in errors[:5]:
+            self.stderr.write(f"error: {error}")
+
+    def compare_rank_queries(self, users):
+        sample = random.sample(users, min(200, len(users)))
+        timings = []
+        for user in sample:
+            best = (
+                Leaderboard.objects.filter(user=user).order_by("-points").values_list("points", flat=True).first()
+            )
+            start = time.perf_counter()
+            Leaderboard.objects.filter(points__gt=best or 0).values("user").distinct().count()
+            timings.append(time.perf_counter() - start)
+        self.stdout.write(f"rank (COUNT(*))   {percentiles(timings)}")
+        self.stdout.write(
+            f"mean speed-up: {statistics.mean(timings) / max(self.mean_rank_time(sample), 1e-9):.0f}x"
+        )
+
+    def mean_rank_time(self, sample):
+        start = time.perf_counter()
+        for user in sample:
+            engine.rank(user.pk, "all")
+        return (time.perf_counter() - start) / len(sample)
@@ -0,0 +1,18 @@
+# ------------------------------------------
+# Project middleware.
+# django_ratelimit's RatelimitMiddleware only works synchronously, and a
+# single sync-only middleware makes Django run every request - async views
+# included - through one thread under ASGI, one request at a time. This is
+# the same middleware with Django's MiddlewareMixin, which handles both sync
+# and async requests.
+# ref https://docs.djangoproject.com/en/5.1/topics/http/middleware/#asynchronous-support
+# ------------------------------------------
+
+from django.utils.deprecation import MiddlewareMixin
+from django_ratelimit.middleware import RatelimitMiddleware as SyncRatelimitMiddleware
+
+
+class RatelimitMiddleware(MiddlewareMixin):
+    """Turns Ratelimited exceptions into RATELIMIT_VIEW responses, for sync and async views."""
+
+    process_exception = SyncRatelimitMiddleware.process_exception
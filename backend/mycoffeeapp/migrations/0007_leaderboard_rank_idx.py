@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mycoffeeapp', '0006_alter_leaderboard_options'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['-points', 'timestamp'], name='leaderboard_rank_idx'),
+        ),
+    ]
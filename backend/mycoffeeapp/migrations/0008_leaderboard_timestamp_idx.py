@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mycoffeeapp', '0007_leaderboard_rank_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['timestamp'], name='leaderboard_timestamp_idx'),
+        ),
+    ]
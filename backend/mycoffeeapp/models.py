@@ -79,6 +79,12 @@ class Leaderboard(models.Model):
 
     class Meta:
         ordering = ["-points"]  # Shows highest scores first
+        indexes = [
+            # Lets the leaderboard be loaded best-first without sorting the whole table
+            models.Index(fields=["-points", "timestamp"], name="leaderboard_rank_idx"),
+            # Lets the daily / weekly boards load just their own window
+            models.Index(fields=["timestamp"], name="leaderboard_timestamp_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.points} - {self.timestamp}"
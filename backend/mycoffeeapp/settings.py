@@ -6,6 +6,8 @@
 
 import os
 import sys
+import shutil
+import tempfile
 from pathlib import Path
 from datetime import timedelta
 
@@ -78,7 +80,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",  # This middleware is required for Django authentication
     "django.contrib.messages.middleware.MessageMiddleware",  # This middleware is required for Django messages framework
     "django.middleware.clickjacking.XFrameOptionsMiddleware",  # This middleware is required for Clickjacking protection
-    "django_ratelimit.middleware.RatelimitMiddleware",  # Rate limiting middleware
+    "mycoffeeapp.middleware.RatelimitMiddleware",  # Rate limiting middleware (django_ratelimit's, made async-capable)
 ]
 
 
@@ -226,5 +228,106 @@ MEDIA_ROOT = (
 )  # This is the directory where user-uploaded files are stored
 MEDIA_URL = "/media/"
 
+# Uploads are read in chunks: small ones are kept in memory, bigger ones go to a
+# temp file. On the receipt (OCR) views any file over OCR_UPLOAD_MAX_BYTES is
+# cut off as well (see limit_upload_size in api/ocrapp/uploads.py)
+FILE_UPLOAD_HANDLERS = [
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 MB - Django's default, here so it is easy to find
+OCR_UPLOAD_MAX_BYTES = 25 * 1024 * 1024  # Largest file accepted (a 20 MB PDF fits)
+
 # Rate limiting which is required for security
 RATELIMIT_VIEW = "django_ratelimit.views.ratelimited"
+
+# How long (seconds) the coffee shop stats on the homepage are cached for.
+# The cache is also cleared whenever a coffee shop changes.
+COFFEE_STATS_CACHE_TTL = 60
+
+# Leaderboard for the price guessing game (see mycoffeeapp/leaderboard.py)
+LEADERBOARD_SIZE = 10  # How many top scores are shown
+LEADERBOARD_UNIQUE_USERS = False  # True keeps only each user's best score on the board
+LEADERBOARD_WARM_ON_STARTUP = True  # Load the board when a WSGI server starts (ASGI loads it on first use)
+
+# Receipt OCR job queue (see api/ocrapp/jobs.py)
+OCR_WORKER_PROCESSES = 2  # Default number of `manage.py ocr_worker` processes
+OCR_MAX_QUEUED_JOBS = 100  # Uploads are refused with a 503 beyond this
+OCR_JOB_TIMEOUT = 300  # Seconds before a running job is assumed dead and retried
+OCR_JOB_MAX_ATTEMPTS = 2
+OCR_LONG_POLL_MAX = 30  # Longest ?wait= (seconds) allowed on the job endpoint
+OCR_ASYNC_OCR_THREADS = 4  # Async views: receipts OCR'd at once per server process
+OCR_ASYNC_MAX_PENDING = 200  # Async views: uploads in progress before new ones get a 503
+
+# Which OCR engines read receipts, and how (see api/ocrapp/engines.py)
+OCR_TESSERACT_CMD = os.getenv("TESSERACT_CMD") or shutil.which("tesseract") or "/opt/homebrew/bin/tesseract"
+OCR_ENGINES = ["tesseract", "easyocr"]  # Tried in order until one reads OCR_MIN_WORDS words
+OCR_MIN_WORDS = 3  # A result with fewer words counts as a failed read (matches generate_json_ai)
+OCR_RACE = False  # Run all OCR_ENGINES at once and take the first good result (more CPU, lower tail latency)
+OCR_ENGINE_TIMEOUTS = {"tesseract": 30, "easyocr": 60}  # Seconds; None or missing means no limit
+
+# OCR / AI engines, created once per process (see api/ocrapp/registry.py)
+OCR_EASYOCR_LANGUAGES = ["en"]
+OCR_EASYOCR_GPU = False  # True only on a server with a CUDA GPU
+OCR_GEMINI_MODEL = "gemini-1.5-flash"
+OCR_LLM_BACKEND = os.getenv("OCR_LLM_BACKEND", "gemini")  # or "fake" to run without Google (see api/ocrapp/llm.py)
+OCR_FAKE_LLM = {
+    "latency": 1.5,  # Seconds per call, give or take `jitter`
+    "jitter": 0.5,
+    "error_rate": 0.0,  # Share of calls that raise ServiceUnavailable
+    "malformed_rate": 0.0,  # Share of calls that return broken JSON
+    "seed": 0,
+}
+OCR_LLM_TIMEOUT = 20  # Seconds per Gemini call
+OCR_LLM_RETRIES = 2  # Extra attempts after a transient error (503, 429, timeout)
+OCR_LLM_BACKOFF = 0.5  # Seconds before the first retry, doubling each time...
+OCR_LLM_BACKOFF_MAX = 8  # ...up to this
+OCR_LLM_BREAKER_FAILURES = 5  # Failed calls in a row before Gemini is skipped...
+OCR_LLM_BREAKER_RESET = 30  # ...for this many seconds, then one call is tried again
+OCR_WARM_ENGINES = []  # e.g. ["easyocr", "gemini"] to load them when a worker starts
+OCR_SAVE_INTERMEDIATES = False  # Debugging: save each preprocessed image to media/ocr_debug/
+
+# Local receipt parser that skips Gemini for clear receipts (see api/ocrapp/parser.py)
+OCR_PARSER_ENABLED = True
+OCR_PARSER_MIN_CONFIDENCE = 0.8  # Below this the text goes to Gemini instead
+
+# Receipt photo clean-up before OCR (see api/ocrapp/imaging.py)
+OCR_CROP_TO_RECEIPT = True  # Cut away the table/background round the receipt
+OCR_NORMALIZE_SCALE = True  # Resize so text is OCR_TARGET_TEXT_HEIGHT pixels tall
+OCR_TARGET_TEXT_HEIGHT = 30  # Pixels; Tesseract reads best at roughly 20-40
+OCR_DESKEW = True  # Straighten receipts photographed at a slight angle
+
+# PDF receipts (see extract_pdf_text in api/ocrapp/utils.py)
+OCR_PDF_MAX_PAGES = 10  # Pages after this are ignored
+OCR_PDF_DPI = 300
+OCR_PDF_WORKERS = 4  # Pages rasterised / OCR'd at the same time
+OCR_PDF_TEXT_MIN_CHARS = 20  # A page's text layer is used instead of OCR if it has this much text
+
+# Batch OCR for bulk imports (see api/ocrapp/batch.py)
+OCR_BATCH_PROCESSES = 4  # Receipts OCR'd at the same time
+OCR_BATCH_AI_CONCURRENCY = 4  # Gemini requests open at the same time
+OCR_BATCH_MAX_FILES = 200  # Most files handled by one request to the batch API
+
+# OCR stage timings and profiling (see api/ocrapp/metrics.py)
+OCR_METRICS_ENABLED = True
+OCR_METRICS_DIR = os.path.join(tempfile.gettempdir(), "coffeetracker-ocr-metrics")  # shared by OCR processes
+OCR_PROFILER = "cprofile"  # or "pyinstrument" if it is installed
+
+# Cache of OCR + AI results for receipts uploaded more than once (see api/ocrapp/result_cache.py)
+OCR_RESULT_CACHE_ENABLED = True
+OCR_RESULT_CACHE_MAX_ENTRIES = 1000  # Least recently used results are dropped beyond this
+
+# Food hygiene ratings import (see fhrs/importer.py)
+FHRS_FEED_URL = "https://ratings.food.gov.uk/api/open-data-files/FHRS{authority}en-GB.xml"
+FHRS_AUTHORITIES = ["807"]  # Local authorities imported by `manage.py import_fhrs`
+FHRS_FETCH_WORKERS = 4  # Authority files downloaded at the same time
+FHRS_IMPORT_BATCH_SIZE = 1000  # Coffee shops written per INSERT ... ON CONFLICT statement
+FHRS_FETCH_TIMEOUT = 60  # Seconds to wait for the FHRS server (per read, not for the whole file)
+
+# Coffee shops near a point (see fhrs/geo.py)
+FHRS_GEO_CELL_DEGREES = 0.05  # Grid cell size of the in-memory index (about 5.5 x 3.5 km in the UK)
+FHRS_GEO_WARM_ON_STARTUP = True  # Build the index when a WSGI server starts (ASGI builds it on first use)
+FHRS_NEARBY_DEFAULT_RADIUS_KM = 2
+FHRS_NEARBY_MAX_RADIUS_KM = 50
+FHRS_NEARBY_DEFAULT_K = 20
+FHRS_NEARBY_MAX_K = 100
@@ -0,0 +1,34 @@
+# -----------------------------------------------------------------
+# Keeps the in-memory leaderboard (leaderboard.py) in step with the database.
+# New scores are added to the board as they are saved, while deletes and
+# username changes simply make every process reload the board.
+# -----------------------------------------------------------------
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .leaderboard import engine
+from .models import Leaderboard
+
+
+@receiver(post_save, sender=Leaderboard)
+def add_score_to_leaderboard(sender, instance, created, **kwargs):
+    if created:
+        engine.record(instance)
+    else:
+        engine.invalidate()
+
+
+@receiver(post_delete, sender=Leaderboard)
+def remove_score_from_leaderboard(sender, instance, **kwargs):
+    engine.invalidate()
+
+
+@receiver(post_save, sender=User)
+def rename_on_leaderboard(sender, instance, created, update_fields, **kwargs):
+    # Usernames are stored on the board, so reload it if this user is on it.
+    # Saves that can't change the username (e.g. last_login on every login) are skipped
+    if created or (update_fields is not None and "username" not in update_fields):
+        return
+    if engine.has_user(instance.pk):
+        engine.invalidate()
@@ -20,6 +20,16 @@ import json
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from datetime import timedelta
+from django.utils import timezone
+from mycoffeeapp.leaderboard import (
+    WRITES_KEY,
+    RankedBoard,
+    TopKLeaderboard,
+    engine as leaderboard_engine,
+    warm_on_startup as warm_leaderboard,
+)
 
 
 # tests the string representation of the Shop model
@@ -87,6 +97,7 @@ class CoffeeAppModelTests(TestCase):
 # tests user and authentication for protected endpoints
 class CoffeeAppViewTests(TestCase):
     def setUp(self):
+        leaderboard_engine.reset()
         self.client = APIClient()
         self.user = User.objects.create_user(username="user1", password="pass123")
         self.client.force_authenticate(user=self.user)
@@ -156,7 +167,7 @@ class CoffeeAppViewTests(TestCase):
     # tests the upload with an unsupported file type
     def test_upload_file_invalid_type(self):
         fake_file = SimpleUploadedFile(
-            "test.doc", b"content", content_type="text/plain"
+            "test.doc", b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1content", content_type="application/msword"
         )
         response = self.client.post("/api/upload/", {"file": fake_file})
         self.assertEqual(response.status_code, 400)
@@ -186,3 +197,209 @@ class CoffeeAppViewTests(TestCase):
             response = self.client.get(url)
             self.assertEqual(response.status_code, 200)
             self.assertIn("csrf_token", response.json())
+
+
+# Tests the bounded top-K structure behind the leaderboard
+class TopKLeaderboardTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+
+    # Only the best k scores are kept, highest first
+    def test_keeps_best_k(self):
+        board = TopKLeaderboard(k=3)
+        for i, points in enumerate([5, 50, 20, 1, 40]):
+            board.add(i, f"user{i}", points, self.now, i)
+        self.assertEqual([e["points"] for e in board.top()], [50, 40, 20])
+
+    # Equal scores are ordered by who got there first
+    def test_ties_go_to_earliest(self):
+        board = TopKLeaderboard(k=2)
+        board.add(1, "late", 10, self.now, 2)
+        board.add(2, "early", 10, self.now - timedelta(minutes=1), 1)
+        board.add(3, "later", 10, self.now + timedelta(minutes=1), 3)
+        self.assertEqual([e["username"] for e in board.top()], ["early", "late"])
+
+    # With unique_users on, each user only appears once with their best score
+    def test_unique_users_keeps_best_score(self):
+        board = TopKLeaderboard(k=3, unique_users=True)
+        board.add(1, "alice", 10, self.now, 1)
+        board.add(1, "alice", 30, self.now, 2)
+        board.add(1, "alice", 20, self.now, 3)
+        board.add(2, "bob", 25, self.now, 4)
+        self.assertEqual(
+            board.top(),
+            [{"username": "alice", "points": 30}, {"username": "bob", "points": 25}],
+        )
+
+
+# Tests the sorted board behind the rank lookups
+class RankedBoardTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.board = RankedBoard()
+        for user_id, points in enumerate([30, 10, 50, 20, 40], start=1):
+            self.board.add(user_id, f"user{user_id}", points, self.now, user_id)
+
+    # Rank is the position of the player's best score
+    def test_rank(self):
+        self.assertEqual(self.board.rank(3), 1)
+        self.assertEqual(self.board.rank(2), 5)
+        self.assertIsNone(self.board.rank(99))
+
+    # A better score moves the player up, a worse one is ignored
+    def test_only_best_score_counts(self):
+        self.assertTrue(self.board.add(2, "user2", 60, self.now, 6))
+        self.assertFalse(self.board.add(2, "user2", 5, self.now, 7))
+        self.assertEqual(self.board.rank(2), 1)
+        self.assertEqual(len(self.board), 5)
+
+    # around() returns the player with their neighbours either side
+    def test_around(self):
+        nearby = self.board.around(1, 1)
+        self.assertEqual([e["rank"] for e in nearby], [2, 3, 4])
+        self.assertEqual(nearby[1], {"rank": 3, "username": "user1", "points": 30})
+        self.assertEqual([e["rank"] for e in self.board.around(3, 2)], [1, 2, 3])
+
+
+# Tests the leaderboard endpoints are served from memory once loaded
+class LeaderboardEngineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        leaderboard_engine.reset()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="player", password="pass123")
+        for points in range(15):
+            Leaderboard.objects.create(user=self.user, points=points)
+
+    # Once loaded, reading the leaderboard does not query the database
+    def test_read_path_runs_no_queries(self):
+        first = self.client.get("/api/leaderboard/").json()
+        self.assertEqual([e["points"] for e in first], list(range(14, 4, -1)))
+        with self.assertNumQueries(0):
+            self.client.get("/api/leaderboard/")
+
+    # New scores show up without reloading from the database
+    def test_new_score_added_to_board(self):
+        self.client.get("/api/leaderboard/")
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post("/api/update-leaderboard/", {"points": 99}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()[0]["points"], 99)
+        with self.assertNumQueries(0):
+            data = self.client.get("/api/leaderboard/").json()
+        self.assertEqual(data[0], {"username": "player", "points": 99})
+
+    # Deleting entries makes the board reload
+    def test_delete_reloads_board(self):
+        self.client.get("/api/leaderboard/")
+        Leaderboard.objects.filter(points__gte=10).delete()
+        data = self.client.get("/api/leaderboard/").json()
+        self.assertEqual(data[0]["points"], 9)
+
+    # Scores saved by another process are picked up from the writes counter
+    def test_catches_up_with_other_processes(self):
+        self.client.get("/api/leaderboard/")
+        other = User.objects.create_user(username="other", password="pass123")
+        # bulk_create skips the signals, like a save made in another worker
+        Leaderboard.objects.bulk_create([Leaderboard(user=other, points=500)])
+        cache.incr(WRITES_KEY)
+        data = self.client.get("/api/leaderboard/").json()
+        self.assertEqual(data[0], {"username": "other", "points": 500})
+
+    # A score committed after one with a higher id is still found (ids are given out at insert)
+    def test_catches_up_with_out_of_order_commits(self):
+        self.client.get("/api/leaderboard/")
+        other = User.objects.create_user(username="other", password="pass123")
+        newest = Leaderboard.objects.order_by("-id").first().pk
+        Leaderboard.objects.bulk_create([Leaderboard(id=newest + 10, user=other, points=500)])
+        cache.incr(WRITES_KEY)
+        self.client.get("/api/leaderboard/")
+        Leaderboard.objects.bulk_create([Leaderboard(id=newest + 5, user=other, points=600)])
+        cache.incr(WRITES_KEY)
+        data = self.client.get("/api/leaderboard/").json()
+        self.assertEqual([e["points"] for e in data[:2]], [600, 500])
+
+    # Renaming a user reloads the board, but logging in (which saves last_login) doesn't
+    def test_rename_reloads_board(self):
+        self.client.get("/api/leaderboard/")
+        self.assertTrue(self.client.login(username="player", password="pass123"))
+        with self.assertNumQueries(0):
+            self.client.get("/api/leaderboard/")
+
+        self.user.username = "renamed"
+        self.user.save()
+        data = self.client.get("/api/leaderboard/").json()
+        self.assertEqual(data[0]["username"], "renamed")
+
+    # Under ASGI this runs inside the event loop, where it must not stop the server starting
+    def test_warm_on_startup_in_event_loop(self):
+        import asyncio
+
+        async def startup():
+            warm_leaderboard()
+
+        with self.assertLogs("mycoffeeapp.leaderboard", "WARNING"):
+            asyncio.run(startup())
+
+    # Other processes are only told about a score once it is committed
+    def test_writes_counted_on_commit(self):
+        self.client.get("/api/leaderboard/")
+        before = cache.get(WRITES_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            Leaderboard.objects.create(user=self.user, points=99)
+            self.assertEqual(cache.get(WRITES_KEY), before)
+        self.assertEqual(cache.get(WRITES_KEY), before + 1)
+        # Our own score is already on the board, so catching up costs nothing
+        with self.assertNumQueries(0):
+            data = self.client.get("/api/leaderboard/").json()
+        self.assertEqual(data[0]["points"], 99)
+
+
+# Tests the daily / weekly / all-time windows and the rank endpoint
+class LeaderboardWindowTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        leaderboard_engine.reset()
+        self.client = APIClient()
+        self.users = [
+            User.objects.create_user(username=f"player{i}", password="pass123")
+            for i in range(4)
+        ]
+        for user, points in zip(self.users, [40, 30, 20, 10]):
+            Leaderboard.objects.create(user=user, points=points)
+        # An old high score only counts towards the all-time board
+        old = Leaderboard.objects.create(user=self.users[3], points=100)
+        Leaderboard.objects.filter(pk=old.pk).update(
+            timestamp=timezone.now() - timedelta(days=30)
+        )
+        leaderboard_engine.reset()
+
+    # Windows show each player's best score in that window
+    def test_window_leaderboards(self):
+        daily = self.client.get("/api/leaderboard/?window=daily").json()
+        self.assertEqual([e["points"] for e in daily], [40, 30, 20, 10])
+        all_time = self.client.get("/api/leaderboard/?window=all").json()
+        self.assertEqual(all_time[0], {"rank": 1, "username": "player3", "points": 100})
+        self.assertEqual(len(all_time), 4)
+
+    def test_invalid_window(self):
+        response = self.client.get("/api/leaderboard/?window=monthly")
+        self.assertEqual(response.status_code, 400)
+
+    # The rank endpoint returns the user's rank and the players around them
+    def test_rank_endpoint(self):
+        self.client.force_authenticate(user=self.users[3])
+        response = self.client.get("/api/leaderboard/rank/?window=daily&around=1")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data["rank"], data["players"]), (4, 4))
+        self.assertEqual([e["username"] for e in data["nearby"]], ["player2", "player3"])
+
+        data = self.client.get("/api/leaderboard/rank/").json()
+        self.assertEqual((data["window"], data["rank"]), ("all", 1))
+        with self.assertNumQueries(0):
+            self.client.get("/api/leaderboard/rank/?window=weekly")
+
+    def test_rank_requires_login(self):
+        response = self.client.get("/api/leaderboard/rank/")
+        self.assertIn(response.status_code, (401, 403))
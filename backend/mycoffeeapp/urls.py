@@ -11,6 +11,7 @@ from django.conf.urls.static import static
 # Views
 from .views import (
     upload_file,
+    upload_file_async,
     save_extracted_data,
     results_data,
     results_page,
@@ -18,14 +19,16 @@ from .views import (
     csrf_token,
     contact_form,
     leaderboard_list,
+    leaderboard_rank,
     update_leaderboard,
     user_profile,
     my_view,  # Added my_view for testing
 )
 
 # FHRS + Registration
-from fhrs.views import CoffeeShopListView
+from fhrs.views import CoffeeShopListView, CoffeeShopNearbyView
 from registration.views import (
+    CoffeeStatsAPIView,
     ForgotPasswordView,
     LoginView,
     ResetPasswordView,
@@ -70,6 +73,7 @@ urlpatterns = [
 
     # Leaderboard
     path("api/leaderboard/", leaderboard_list, name="leaderboard-list"),
+    path("api/leaderboard/rank/", leaderboard_rank, name="leaderboard-rank"),
     path("api/update-leaderboard/", update_leaderboard, name="update-leaderboard"),
 
     # for CSRF Token to work, dont remove
@@ -79,14 +83,19 @@ urlpatterns = [
 
     # File Upload + Results
     path("api/upload/", upload_file, name="upload"),
+    path("api/upload/async/", upload_file_async, name="upload-async"),
     path("api/save-extracted-data/", save_extracted_data, name="save_extracted_data"),
     path("api/results/", results_data, name="results"),
     path("results/", results_page, name="results_page"),
 
+    # Homepage coffee shop stats
+    path("api/coffee-stats/", CoffeeStatsAPIView.as_view(), name="coffee-stats"),
+
     # Coffee Shops (FHRS)
     path("fhrs/", include("fhrs.urls")),
     path("api/fhrs/", include("fhrs.urls")),
     path("api/cafes/", CoffeeShopListView.as_view(), name="api-cafes"),
+    path("api/cafes/nearby/", CoffeeShopNearbyView.as_view(), name="api-cafes-nearby"),
     path("shop-profile/", CoffeeShopListView.as_view(), name="shop-profile"),
 
     # for the Accounts App
@@ -4,6 +4,8 @@
 
 from django.utils.crypto import get_random_string
 
+from api.ocrapp.uploads import file_type
+
 
 def generate_secure_password():
     return get_random_string(length=12)  # Generates a 12-character random password
@@ -12,10 +14,10 @@ def generate_secure_password():
 # +-----------------------------------------------------+
 
 
-def allowed_file(filename):
-    """Check if the file type is allowed."""
-    ALLOWED_EXTENSIONS = {"txt", "pdf", "png", "jpg", "jpeg", "gif"}
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+def allowed_file(file):
+    """Check if the file type is allowed, going by the file's first bytes rather than its name."""
+    ALLOWED_TYPES = {"txt", "pdf", "png", "jpeg", "gif"}
+    return file_type(file) in ALLOWED_TYPES
 
 
 # +-----------------------------------------------------+
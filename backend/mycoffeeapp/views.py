@@ -3,19 +3,22 @@ import json
 import logging
 import smtplib
 
+from asgiref.sync import sync_to_async
+
 from django.shortcuts import render
 from django.http import JsonResponse, HttpResponseBadRequest
 from django.core.mail import send_mail
-from django.core.files.storage import default_storage
 from django.db import connection
 from django.conf import settings
 from django.middleware.csrf import get_token
-from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.views.decorators.http import require_POST
-from api.ocrapp.utils import extract_text, generate_json_ai
+from api.ocrapp.uploads import limit_upload_size, too_large
+from api.ocrapp.views import process_receipt_now, queue_receipt, too_large_response, wants_profile
 from .models import ShopResult, ContactMessage
 from .models import ContactMessage
 from .models import Leaderboard
+from .utils import allowed_file
 
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view, permission_classes
@@ -24,7 +27,7 @@ from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from .serializers import LeaderboardSerializer
+from .leaderboard import WINDOWS as LEADERBOARD_WINDOWS, engine as leaderboard_engine
 
 
 logger = logging.getLogger(__name__)
@@ -34,12 +37,40 @@ logger = logging.getLogger(__name__)
 # +-----------------------------------------------------+
 
 
+# The top scores are served from in-memory boards (see leaderboard.py)
+# so none of these views sort the Leaderboard table on each request.
 @api_view(["GET"])
 def leaderboard_list(request):
-    """Fetches the top 10 players sorted by highest score."""
-    top_players = Leaderboard.objects.order_by("-points", "timestamp")[:10]
-    serializer = LeaderboardSerializer(top_players, many=True)
-    return Response(serializer.data)
+    """Fetches the top 10 players sorted by highest score.
+
+    ?window=daily, weekly or all returns each player's best score in that window instead.
+    """
+    window = request.query_params.get("window")
+    if window is not None and window not in LEADERBOARD_WINDOWS:
+        return Response(
+            {"error": f"window must be one of {', '.join(LEADERBOARD_WINDOWS)}"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return Response(leaderboard_engine.top(window))
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def leaderboard_rank(request):
+    """Returns the user's rank in a window (?window=daily/weekly/all) and the players around them."""
+    window = request.query_params.get("window", "all")
+    if window not in LEADERBOARD_WINDOWS:
+        return Response(
+            {"error": f"window must be one of {', '.join(LEADERBOARD_WINDOWS)}"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        around = min(int(request.query_params.get("around", 5)), 50)
+    except ValueError:
+        return Response(
+            {"error": "around must be a number"}, status=status.HTTP_400_BAD_REQUEST
+        )
+    return Response(leaderboard_engine.rank(request.user.pk, window, max(around, 0)))
 
 
 @api_view(["POST"])
@@ -53,14 +84,11 @@ def update_leaderboard(request):
         return Response(
             {"error": "Points are required"}, status=status.HTTP_400_BAD_REQUEST
         )
-    new_entry = Leaderboard.objects.create(user=user, points=points)
+    # Saving the entry adds it to the in-memory board (see signals.py)
+    Leaderboard.objects.create(user=user, points=points)
 
     # Returns the full leaderboard sorted by highest score
-    top_players = Leaderboard.objects.order_by("-points")[:10]
-    return Response(
-        LeaderboardSerializer(top_players, many=True).data,
-        status=status.HTTP_201_CREATED,
-    )
+    return Response(leaderboard_engine.top(), status=status.HTTP_201_CREATED)
 
 
 # +-----------------------------------------------------+
@@ -130,29 +158,41 @@ UPLOAD_FOLDER = os.path.join(settings.MEDIA_ROOT, "uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 
-def allowed_file(filename):
-    """Check if the file type is allowed."""
-    ALLOWED_EXTENSIONS = {"txt", "pdf", "png", "jpg", "jpeg", "gif"}
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
-
-
+# csrf_exempt / csrf_protect so the size limit is in place before the CSRF check reads the body
+@csrf_exempt
+@limit_upload_size
+@csrf_protect
 def upload_file(request):
-    """Handle file upload, extract text, and process with AI."""
+    """Handle file upload and queue it for OCR + AI extraction (poll the returned job for results)."""
+    if request.method == "POST" and too_large(request):
+        return too_large_response()
     if request.method == "POST" and request.FILES.get("file"):
         file = request.FILES["file"]
 
-        if not allowed_file(file.name):
+        if not allowed_file(file):
             return JsonResponse({"error": "Invalid file type"}, status=400)
 
-        file_path = default_storage.save(f"uploads/{file.name}", file)
+        # OCR and the Gemini call run on the OCR workers, not in this request
+        return queue_receipt(file, folder="uploads", profile=wants_profile(request))
+
+    return JsonResponse({"error": "Invalid request"}, status=400)
 
-        # Extract text with OCR
-        text = extract_text(file_path)
 
-        # Process text with Gemini AI
-        extracted_data = generate_json_ai(text)
+@csrf_exempt
+@limit_upload_size
+@csrf_protect
+async def upload_file_async(request):
+    """Async version of upload_file for ASGI servers: OCR + AI extraction happen in the
+    request and the results come back in the response, without holding a thread."""
+    if request.method == "POST" and await sync_to_async(too_large, thread_sensitive=False)(request):
+        return too_large_response()
+    if request.method == "POST" and request.FILES.get("file"):
+        file = request.FILES["file"]
+
+        if not allowed_file(file):
+            return JsonResponse({"error": "Invalid file type"}, status=400)
 
-        return JsonResponse({"extracted_data": extracted_data})
+        return await process_receipt_now(file, folder="uploads")
 
     return JsonResponse({"error": "Invalid request"}, status=400)
 
@@ -20,3 +20,14 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mycoffeeapp.settings")
 
 application = get_wsgi_application()
+
+# Loads the in-memory leaderboard and coffee shop index before the first request comes in
+from django.db import connections  # noqa: E402
+from fhrs import geo  # noqa: E402
+from mycoffeeapp import leaderboard  # noqa: E402
+
+leaderboard.warm_on_startup()
+geo.warm_on_startup()
+# Don't hand the connection used for that to the workers a preloading server
+# (gunicorn --preload) forks from here - they would all share one socket
+connections.close_all()
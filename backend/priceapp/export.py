@@ -0,0 +1,120 @@
+# ------------------------------------------------------------------
+# Streaming export of price submissions as NDJSON or CSV.
+# Rows are read with a server-side cursor (iterator) and turned into plain
+# dicts straight from values_list() tuples, skipping the DRF serializer
+# machinery, so memory use stays flat however many rows are exported.
+# The output matches PriceSubmissionSerializer field for field.
+# ref https://docs.djangoproject.com/en/5.1/howto/outputting-csv/#streaming-large-csv-files
+# ref https://docs.djangoproject.com/en/5.1/ref/models/querysets/#iterator
+# ------------------------------------------------------------------
+
+import csv
+import json
+
+from django.core.files.storage import default_storage
+
+from .pagination import ORDERING
+
+# Order matters - rows come back from the database as tuples in this order
+COLUMNS = [
+    "id",
+    "establishment",
+    "date",
+    "beverage",
+    "price",
+    "submitter_name",
+    "coffee_taste",
+    "coffee_options",
+    "service",
+    "atmosphere",
+    "value_for_money",
+    "dog_friendly",
+    "wifi",
+    "outdoor_seating",
+    "plant_milks",
+    "brunch_lunch",
+    "wheelchair_access",
+    "receipt",
+]
+
+RATING_KEYS = ["coffeeTaste", "coffeeOptions", "service", "atmosphere", "valueForMoney"]
+FEATURE_KEYS = [
+    "dogFriendly",
+    "wifi",
+    "outdoorSeating",
+    "plantMilks",
+    "brunchLunch",
+    "wheelchairAccess",
+]
+
+CSV_HEADER = (
+    ["id", "establishment", "date", "beverage", "price", "submitterName"]
+    + RATING_KEYS
+    + FEATURE_KEYS
+    + ["receipt"]
+)
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def filter_submissions(queryset, date_from=None, date_to=None, establishment=None):
+    """Apply the export filters - all optional."""
+    if date_from:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(date__lte=date_to)
+    if establishment:
+        queryset = queryset.filter(establishment=establishment)
+    return queryset
+
+
+def iter_rows(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    return queryset.order_by(*ORDERING).values_list(*COLUMNS).iterator(
+        chunk_size=chunk_size
+    )
+
+
+# Same URL the serializer's FileField would give (absolute when there is a request)
+def receipt_url(name, request=None):
+    if not name:
+        return None
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def row_to_dict(row, request=None):
+    """Turn a values_list() tuple into the same dict PriceSubmissionSerializer returns."""
+    return {
+        "id": row[0],
+        "establishment": row[1],
+        "date": row[2].isoformat(),
+        "beverage": row[3],
+        "price": str(row[4]),
+        "submitterName": row[5],
+        "ratings": dict(zip(RATING_KEYS, row[6:11])),
+        "features": dict(zip(FEATURE_KEYS, row[11:17])),
+        "receipt": receipt_url(row[17], request),
+    }
+
+
+def ndjson_lines(queryset, request=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    for row in iter_rows(queryset, chunk_size):
+        yield json.dumps(row_to_dict(row, request)) + "\n"
+
+
+# csv.writer needs something with a write() method - this just hands the line back
+# so it can be yielded straight into the StreamingHttpResponse
+class Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(queryset, request=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for row in iter_rows(queryset, chunk_size):
+        yield writer.writerow(
+            [row[0], row[1], row[2].isoformat(), row[3], str(row[4]), row[5]]
+            + list(row[6:17])
+            + [receipt_url(row[17], request) or ""]
+        )
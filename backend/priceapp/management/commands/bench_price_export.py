@@ -0,0 +1,93 @@
+# ------------------------------------------------------------------
+# Benchmark for the price export.
+# Seeds a number of fake price submissions, then compares the old path
+# (PriceSubmissionSerializer(many=True) + one big json.dumps) against the
+# streaming fast path in priceapp/export.py, measuring time and peak memory.
+# Everything runs inside a transaction that is rolled back, so no data is kept.
+# usage: python manage.py bench_price_export --rows 100000
+# ref https://docs.python.org/3/library/tracemalloc.html
+# ------------------------------------------------------------------
+
+import json
+import random
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from priceapp.export import csv_lines, ndjson_lines
+from priceapp.models import PriceSubmission
+from priceapp.serializers import PriceSubmissionSerializer
+
+
+def measure(func):
+    """Run func twice: once for wall time, once under tracemalloc for peak MB."""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+
+    # tracemalloc slows everything down, so memory is measured on a separate run
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / (1024 * 1024)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the streaming price export against the DRF serializer"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=20000)
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        chunk_size = options["chunk_size"]
+
+        with transaction.atomic():
+            self.seed(rows)
+            queryset = PriceSubmission.objects.all()
+
+            def serializer_path():
+                data = PriceSubmissionSerializer(queryset.order_by("date", "id"), many=True).data
+                json.dumps(data)
+
+            def consume(lines):
+                for _ in lines:
+                    pass
+
+            results = [
+                ("serializer (json list)", measure(serializer_path)),
+                ("export ndjson", measure(lambda: consume(ndjson_lines(queryset, chunk_size=chunk_size)))),
+                ("export csv", measure(lambda: consume(csv_lines(queryset, chunk_size=chunk_size)))),
+            ]
+
+            self.stdout.write(f"{rows} rows, chunk size {chunk_size}")
+            for name, (seconds, peak) in results:
+                self.stdout.write(
+                    f"{name:<24} {seconds:8.3f}s  {rows / seconds:10.0f} rows/s  peak {peak:8.1f} MB"
+                )
+
+            # Throw the fake rows away again
+            transaction.set_rollback(True)
+
+    def seed(self, rows):
+        beverages = ["Latte", "Flat White", "Cappuccino", "Americano", "Mocha"]
+        start = date(2024, 1, 1)
+        batch = [
+            PriceSubmission(
+                establishment=f"Bench Cafe {i % 200}",
+                date=start + timedelta(days=i % 365),
+                beverage=random.choice(beverages),
+                price=Decimal(random.randint(150, 550)) / 100,
+                submitter_name="bench",
+                coffee_taste=random.randint(0, 5),
+                wifi=bool(i % 2),
+            )
+            for i in range(rows)
+        ]
+        PriceSubmission.objects.bulk_create(batch, batch_size=5000)
@@ -0,0 +1,22 @@
+# ------------------------------------------------------------------
+# Rebuilds the PriceDailyAggregate rollup table from scratch.
+# The rollups are normally kept up to date as submissions are saved, but rows
+# changed behind the model's back (bulk updates, raw SQL, restores) can leave
+# them out of step - this recounts everything with a single GROUP BY.
+# usage: python manage.py rebuild_price_rollups
+# ------------------------------------------------------------------
+
+from django.core.management.base import BaseCommand
+
+from priceapp.rollups import rebuild_all
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily price rollups from the raw price submissions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        created = rebuild_all(batch_size=options["batch_size"])
+        self.stdout.write(f"Rebuilt {created} price rollup buckets.")
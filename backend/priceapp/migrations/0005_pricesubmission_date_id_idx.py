@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('priceapp', '0004_pricesubmission_verified'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pricesubmission',
+            index=models.Index(fields=['date', 'id'], name='price_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:22
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+# Fills the new rollup table from the submissions that already exist
+def build_rollups(apps, schema_editor):
+    PriceSubmission = apps.get_model('priceapp', 'PriceSubmission')
+    PriceDailyAggregate = apps.get_model('priceapp', 'PriceDailyAggregate')
+    grouped = (
+        PriceSubmission.objects.values('establishment', 'beverage', 'date')
+        .annotate(count=Count('id'), total=Sum('price'), min_price=Min('price'), max_price=Max('price'))
+        .order_by()
+    )
+    PriceDailyAggregate.objects.bulk_create(
+        (PriceDailyAggregate(day=row.pop('date'), **row) for row in grouped.iterator()),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('priceapp', '0005_pricesubmission_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceDailyAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('establishment', models.CharField(max_length=255)),
+                ('beverage', models.CharField(max_length=100)),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=4)),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=4)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pricesubmission',
+            index=models.Index(fields=['establishment', 'beverage', 'date'], name='price_bucket_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pricedailyaggregate',
+            index=models.Index(fields=['beverage', 'day'], name='price_rollup_beverage_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='pricedailyaggregate',
+            constraint=models.UniqueConstraint(fields=('establishment', 'beverage', 'day'), name='price_rollup_bucket'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
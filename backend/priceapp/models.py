@@ -1,9 +1,10 @@
 # ------------------------------------------------------------------
 # This file defines the models for the price app.
-# It includes the PriceSubmission model which is used to store information about price submissions.
+# It includes the PriceSubmission model which is used to store information about price submissions,
+# and the PriceDailyAggregate rollup table that the price stats API reads from.
 # ------------------------------------------------------------------
 
-from django.db import models
+from django.db import models, transaction
 
 class PriceSubmission(models.Model):
     establishment = models.CharField(max_length=255)
@@ -14,9 +15,34 @@ class PriceSubmission(models.Model):
     verified = models.BooleanField(default=False)
     
     def save(self, *args, **kwargs):
+        from . import rollups  # imported here as rollups.py imports this module
+
         if self.beverage:
             self.beverage = self.beverage.strip().title()  # Converts "latte" -> "Latte" reference: https://stackoverflow.com/questions/45121744/how-to-strip-and-use-title-in-list-and-dictionary
-        super().save(*args, **kwargs)
+        adding = self._state.adding
+        # Keeps the daily price rollups in step with the raw rows - in one
+        # transaction, so a failed rollup update doesn't leave the row saved
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            rollups.submission_saved(self, adding, getattr(self, "_loaded_values", None))
+        self._loaded_values = {f: getattr(self, f) for f in rollups.KEY_FIELDS}
+
+    def delete(self, *args, **kwargs):
+        from . import rollups
+
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            rollups.submission_deleted(self, getattr(self, "_loaded_values", None))
+        return result
+
+    # Remembers the values the row had in the database so that when it is edited
+    # the rollup bucket it used to belong to can be corrected as well
+    # ref https://docs.djangoproject.com/en/5.1/ref/models/instances/#customizing-model-loading
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
 
     # Features as Boolean Fields so they can be used in the frontend as checkboxes
     dog_friendly = models.BooleanField(default=False)
@@ -36,5 +62,43 @@ class PriceSubmission(models.Model):
     # File Upload model - receipt
     receipt = models.FileField(upload_to="receipts/", blank=True, null=True) #ref:https://www.geeksforgeeks.org/filefield-django-models/
 
+    class Meta:
+        indexes = [
+            # Matches the (date, id) ordering used by the price list pagination
+            models.Index(fields=["date", "id"], name="price_date_id_idx"),
+            # Lets a single rollup bucket be recounted without a table scan
+            models.Index(
+                fields=["establishment", "beverage", "date"], name="price_bucket_idx"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.establishment} - {self.beverage} (£{self.price})"
+
+
+# One row per (establishment, beverage, day) holding the count, sum, min and max price
+# of the submissions in that bucket. Maintained by rollups.py as submissions are
+# saved and deleted, and rebuilt in bulk with `manage.py rebuild_price_rollups`.
+class PriceDailyAggregate(models.Model):
+    establishment = models.CharField(max_length=255)
+    beverage = models.CharField(max_length=100)
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    min_price = models.DecimalField(max_digits=4, decimal_places=2)
+    max_price = models.DecimalField(max_digits=4, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["establishment", "beverage", "day"], name="price_rollup_bucket"
+            )
+        ]
+        indexes = [models.Index(fields=["beverage", "day"], name="price_rollup_beverage_idx")]
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def __str__(self):
+        return f"{self.establishment} - {self.beverage} - {self.day} ({self.count})"
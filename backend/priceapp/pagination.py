@@ -0,0 +1,104 @@
+# ------------------------------------------------------------------
+# Keyset (cursor) pagination for price submissions.
+# Rows are ordered by (date, id) and each page starts straight after the last
+# row of the previous page, so the database never counts or skips rows and a
+# page deep into the table costs the same as the first one.
+# ref https://www.django-rest-framework.org/api-guide/pagination/#custom-pagination-styles
+# ref https://use-the-index-luke.com/no-offset
+# ------------------------------------------------------------------
+
+import base64
+import binascii
+import json
+from datetime import date
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+ORDERING = ("date", "id")
+
+
+# The cursor is just the (date, id) of the last row that was sent, base64 encoded
+# so the frontend can treat it as an opaque string
+def encode_cursor(day, pk):
+    raw = json.dumps([day.isoformat(), pk])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        day, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return date.fromisoformat(day), int(pk)
+    except (ValueError, TypeError, binascii.Error):
+        raise NotFound("Invalid cursor")
+
+
+def keyset_page(queryset, after=None, size=50):
+    """Return one page of rows after the (date, id) position plus a has_more flag."""
+    queryset = queryset.order_by(*ORDERING)
+    if after is not None:
+        day, pk = after
+        queryset = queryset.filter(Q(date__gt=day) | Q(date=day, id__gt=pk))
+
+    # Fetching one extra row tells us if there is another page without a COUNT(*)
+    rows = list(queryset[: size + 1])
+    return rows[:size], len(rows) > size
+
+
+def iter_keyset_pages(queryset, size=500):
+    """Yield pages of rows one query at a time so only a single page is ever in memory."""
+    after = None
+    while True:
+        rows, has_more = keyset_page(queryset, after, size)
+        if rows:
+            yield rows
+        if not has_more:
+            return
+        after = (rows[-1].date, rows[-1].pk)
+
+
+class PriceCursorPagination(BasePagination):
+    page_size = 50
+    max_page_size = 500
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        after = decode_cursor(cursor) if cursor else None
+
+        rows, has_more = keyset_page(queryset, after, self.get_page_size(request))
+        self.next_cursor = (
+            encode_cursor(rows[-1].date, rows[-1].pk) if has_more else None
+        )
+        return rows
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
@@ -0,0 +1,123 @@
+# ------------------------------------------------------------------
+# Keeps the PriceDailyAggregate rollup table in step with PriceSubmission.
+# A brand new submission is added to its bucket with a single UPDATE
+# (count + 1, total + price, least/greatest for min/max). Edits and deletes
+# can't take a price back out of a min/max, so those buckets are recounted
+# from the raw rows instead - that only touches the rows of one
+# (establishment, beverage, day) bucket thanks to price_bucket_idx.
+# ref https://docs.djangoproject.com/en/5.1/ref/models/expressions/#f-expressions
+# ref https://docs.djangoproject.com/en/5.1/ref/models/database-functions/#greatest
+# ------------------------------------------------------------------
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Max, Min, Sum, Value
+from django.db.models.functions import Greatest, Least
+
+from .models import PriceDailyAggregate, PriceSubmission
+
+# Fields that decide which bucket a submission belongs to, plus its price
+KEY_FIELDS = ("establishment", "beverage", "date", "price")
+
+
+def _clean(field, value):
+    return PriceSubmission._meta.get_field(field).to_python(value)
+
+
+def bucket_of(values):
+    """(establishment, beverage, day) for a dict of field values, or None if any are missing."""
+    if values is None or any(f not in values for f in KEY_FIELDS):
+        return None
+    return (values["establishment"], values["beverage"], _clean("date", values["date"]))
+
+
+def add_to_bucket(establishment, beverage, day, price):
+    price = _clean("price", price)
+    price_value = Value(price, output_field=DecimalField(max_digits=4, decimal_places=2))
+
+    with transaction.atomic():
+        rollup, created = PriceDailyAggregate.objects.select_for_update().get_or_create(
+            establishment=establishment,
+            beverage=beverage,
+            day=day,
+            defaults={"count": 1, "total": price, "min_price": price, "max_price": price},
+        )
+        if not created:
+            PriceDailyAggregate.objects.filter(pk=rollup.pk).update(
+                count=F("count") + 1,
+                total=F("total") + price_value,
+                min_price=Least(F("min_price"), price_value),
+                max_price=Greatest(F("max_price"), price_value),
+            )
+
+
+def refresh_bucket(establishment, beverage, day):
+    """Recount one bucket from the raw submissions (removing it if it is now empty)."""
+    stats = PriceSubmission.objects.filter(
+        establishment=establishment, beverage=beverage, date=day
+    ).aggregate(
+        count=Count("id"), total=Sum("price"), min_price=Min("price"), max_price=Max("price")
+    )
+
+    bucket = PriceDailyAggregate.objects.filter(
+        establishment=establishment, beverage=beverage, day=day
+    )
+    if not stats["count"]:
+        bucket.delete()
+        return
+    PriceDailyAggregate.objects.update_or_create(
+        establishment=establishment, beverage=beverage, day=day, defaults=stats
+    )
+
+
+def submission_saved(submission, adding, previous=None):
+    current = {f: getattr(submission, f) for f in KEY_FIELDS}
+    new_bucket = bucket_of(current)
+
+    if adding:
+        add_to_bucket(*new_bucket, current["price"])
+        return
+
+    old_bucket = bucket_of(previous)
+    if old_bucket == new_bucket and _clean("price", previous["price"]) == _clean(
+        "price", current["price"]
+    ):
+        return  # nothing the rollups care about has changed
+
+    if old_bucket is not None and old_bucket != new_bucket:
+        refresh_bucket(*old_bucket)
+    refresh_bucket(*new_bucket)
+
+
+def submission_deleted(submission, previous=None):
+    bucket = bucket_of(previous) or bucket_of(
+        {f: getattr(submission, f) for f in KEY_FIELDS}
+    )
+    refresh_bucket(*bucket)
+
+
+def rebuild_all(batch_size=5000):
+    """Throw away every rollup row and rebuild them with one GROUP BY over the raw table."""
+    grouped = (
+        PriceSubmission.objects.values("establishment", "beverage", "date")
+        .annotate(
+            count=Count("id"),
+            total=Sum("price"),
+            min_price=Min("price"),
+            max_price=Max("price"),
+        )
+        .order_by()
+    )
+
+    created = 0
+    with transaction.atomic():
+        PriceDailyAggregate.objects.all().delete()
+        batch = []
+        for row in grouped.iterator(chunk_size=batch_size):
+            batch.append(PriceDailyAggregate(day=row.pop("date"), **row))
+            if len(batch) >= batch_size:
+                PriceDailyAggregate.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        PriceDailyAggregate.objects.bulk_create(batch)
+        created += len(batch)
+    return created
@@ -10,7 +10,52 @@ class PriceSubmissionSerializer(serializers.ModelSerializer):
     submitterName = serializers.CharField(source="submitter_name")
     ratings = serializers.SerializerMethodField()
     features = serializers.SerializerMethodField()
-    
+
+    # The model columns each output field reads - used with .only() so the
+    # database does not load columns for fields the client did not ask for
+    MODEL_FIELDS = {
+        "id": ["id"],
+        "establishment": ["establishment"],
+        "date": ["date"],
+        "beverage": ["beverage"],
+        "price": ["price"],
+        "submitterName": ["submitter_name"],
+        "ratings": [
+            "coffee_taste",
+            "coffee_options",
+            "service",
+            "atmosphere",
+            "value_for_money",
+        ],
+        "features": [
+            "dog_friendly",
+            "wifi",
+            "outdoor_seating",
+            "plant_milks",
+            "brunch_lunch",
+            "wheelchair_access",
+        ],
+        "receipt": ["receipt"],
+    }
+
+    # An optional `fields` argument limits the output to the given field names
+    # ref https://www.django-rest-framework.org/api-guide/serializers/#dynamically-modifying-fields
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def model_fields_for(cls, fields=None):
+        """Columns needed to render `fields` (date and id are always needed for paging)."""
+        names = fields if fields is not None else cls.MODEL_FIELDS.keys()
+        columns = {"id", "date"}
+        for name in names:
+            columns.update(cls.MODEL_FIELDS[name])
+        return sorted(columns)
+
     class Meta:
         model = PriceSubmission
         fields = [
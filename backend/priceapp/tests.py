@@ -9,9 +9,12 @@
 from django.test import TestCase
 from rest_framework.test import APIClient
 from rest_framework import status
-from priceapp.models import PriceSubmission
+from priceapp.models import PriceDailyAggregate, PriceSubmission
 from priceapp.serializers import PriceSubmissionSerializer
 import json
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework.test import APITestCase
@@ -85,7 +88,7 @@ class PriceSubmissionViewTests(APITestCase):
         )
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertGreaterEqual(len(response.data), 1)
+        self.assertGreaterEqual(len(response.data["results"]), 1)
 
     # Tests file upload alongside valid formData
     def test_post_with_file_upload(self):
@@ -164,7 +167,7 @@ class PriceTestCase(TestCase):
         prices = PriceSubmission.objects.all()
         serializer = PriceSubmissionSerializer(prices, many=True)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data["results"], serializer.data)
 
     # Tests successful price submission via POST
     def test_price_submission_view(self):
@@ -297,3 +300,217 @@ class PriceTestCase(TestCase):
             self.url, data={"file": file, "formData": form_data}
         )
         self.assertEqual(response.status_code, 201)
+
+
+# Tests the cursor pagination, field selection and streaming on the price list
+class PriceListPaginationTests(APITestCase):
+    def setUp(self):
+        self.url = "/api/prices/"
+        for day in range(1, 8):
+            PriceSubmission.objects.create(
+                establishment=f"Cafe {day}",
+                date=f"2024-01-0{day}",
+                beverage="latte",
+                price="3.00",
+                submitter_name="Tester",
+            )
+
+    # Walks every page using the next link and checks rows come back once, in date order
+    def test_cursor_pages_cover_all_rows_in_order(self):
+        seen = []
+        url = self.url + "?page_size=3"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), 3)
+            seen.extend(item["date"] for item in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(seen), 7)
+
+    # Tests that only the requested fields are returned
+    def test_fields_parameter_limits_output(self):
+        response = self.client.get(self.url, {"fields": "establishment,price"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(response.data["results"][0].keys()), {"establishment", "price"}
+        )
+
+    # Tests that unknown field names are rejected
+    def test_unknown_field_returns_error(self):
+        response = self.client.get(self.url, {"fields": "establishment,secret"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("secret", response.json()["error"])
+
+    # Tests that a corrupted cursor is reported rather than crashing
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    # Tests that streaming mode returns every row as a single JSON list
+    def test_stream_returns_full_list(self):
+        response = self.client.get(self.url, {"stream": "true", "fields": "id,date"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(data), 7)
+        self.assertEqual(set(data[0].keys()), {"id", "date"})
+
+
+# Tests the streaming NDJSON / CSV export
+class PriceExportTests(APITestCase):
+    def setUp(self):
+        self.url = "/api/prices/export/"
+        PriceSubmission.objects.create(
+            establishment="Cafe A",
+            date="2024-01-01",
+            beverage="latte",
+            price="3.20",
+            submitter_name="Alice",
+            wifi=True,
+            coffee_taste=4,
+        )
+        PriceSubmission.objects.create(
+            establishment="Cafe B",
+            date="2024-02-01",
+            beverage="mocha",
+            price="3.90",
+            submitter_name="Bob",
+        )
+
+    def read_lines(self, response):
+        return b"".join(response.streaming_content).decode().splitlines()
+
+    # The fast path should give exactly what the serializer gives
+    def test_ndjson_matches_serializer(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in self.read_lines(response)]
+        expected = PriceSubmissionSerializer(
+            PriceSubmission.objects.order_by("date", "id"), many=True
+        ).data
+        self.assertEqual(rows, json.loads(json.dumps(expected)))
+
+    # Tests the CSV export has a header row plus one line per submission
+    def test_csv_export(self):
+        response = self.client.get(self.url, {"format": "csv"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = self.read_lines(response)
+        self.assertTrue(lines[0].startswith("id,establishment,date"))
+        self.assertEqual(len(lines), 3)
+
+    # Tests the date range and establishment filters
+    def test_filters(self):
+        response = self.client.get(self.url, {"date_from": "2024-01-15"})
+        rows = [json.loads(line) for line in self.read_lines(response)]
+        self.assertEqual([row["establishment"] for row in rows], ["Cafe B"])
+
+        response = self.client.get(self.url, {"establishment": "Cafe A"})
+        rows = [json.loads(line) for line in self.read_lines(response)]
+        self.assertEqual([row["establishment"] for row in rows], ["Cafe A"])
+
+    # Tests bad parameters are rejected
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url, {"format": "xml"}).status_code, 400)
+        self.assertEqual(
+            self.client.get(self.url, {"date_to": "2024-13-45"}).status_code, 400
+        )
+
+
+# Tests the daily price rollups and the stats API that reads from them
+class PriceRollupTests(APITestCase):
+    def create(self, price, day="2024-03-01", establishment="Cafe A", beverage="latte"):
+        return PriceSubmission.objects.create(
+            establishment=establishment,
+            date=day,
+            beverage=beverage,
+            price=price,
+            submitter_name="Tester",
+        )
+
+    def bucket(self, **kwargs):
+        lookup = {"establishment": "Cafe A", "beverage": "Latte", "day": "2024-03-01"}
+        lookup.update(kwargs)
+        return PriceDailyAggregate.objects.get(**lookup)
+
+    # New submissions are added straight into their bucket
+    def test_insert_updates_bucket(self):
+        self.create("3.00")
+        self.create("4.00")
+        self.create(2.50)
+        bucket = self.bucket()
+        self.assertEqual(bucket.count, 3)
+        self.assertEqual(bucket.total, Decimal("9.50"))
+        self.assertEqual(bucket.min_price, Decimal("2.50"))
+        self.assertEqual(bucket.max_price, Decimal("4.00"))
+
+    # Editing a submission moves it between buckets and fixes min/max
+    def test_update_moves_between_buckets(self):
+        self.create("3.00")
+        cheapest = self.create("2.00")
+
+        cheapest = PriceSubmission.objects.get(pk=cheapest.pk)
+        cheapest.date = "2024-03-02"
+        cheapest.save()
+
+        self.assertEqual(self.bucket().count, 1)
+        self.assertEqual(self.bucket().min_price, Decimal("3.00"))
+        self.assertEqual(self.bucket(day="2024-03-02").count, 1)
+
+    # Deleting the last submission in a bucket removes the bucket
+    def test_delete_removes_empty_bucket(self):
+        submission = self.create("3.00")
+        submission.delete()
+        self.assertFalse(PriceDailyAggregate.objects.exists())
+
+    # If the rollup can't be updated the row isn't written either, so they can't drift apart
+    def test_rollup_failure_rolls_back(self):
+        from unittest.mock import patch
+
+        submission = self.create("3.00")
+        with patch("priceapp.rollups.submission_saved", side_effect=RuntimeError("db gone")):
+            with self.assertRaises(RuntimeError):
+                self.create("5.00")
+        with patch("priceapp.rollups.submission_deleted", side_effect=RuntimeError("db gone")):
+            with self.assertRaises(RuntimeError):
+                submission.delete()
+        self.assertEqual(PriceSubmission.objects.count(), 1)
+        self.assertEqual(self.bucket().count, 1)
+
+    # The rebuild command recreates rollups that have drifted
+    def test_rebuild_command(self):
+        self.create("3.00")
+        self.create("5.00", establishment="Cafe B")
+        PriceDailyAggregate.objects.all().delete()
+        call_command("rebuild_price_rollups", stdout=StringIO())
+        self.assertEqual(PriceDailyAggregate.objects.count(), 2)
+        self.assertEqual(self.bucket(establishment="Cafe B").total, Decimal("5.00"))
+
+    # Tests the stats API groups the rollups by day
+    def test_stats_by_day(self):
+        self.create("3.00")
+        self.create("4.00")
+        self.create("5.00", establishment="Cafe B")
+        self.create("2.00", day="2024-03-02")
+        response = self.client.get("/api/prices/stats/", {"beverage": "latte"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first_day = response.data["results"][0]
+        self.assertEqual(first_day["count"], 3)
+        self.assertEqual(first_day["mean"], "4.00")
+        self.assertEqual(first_day["min"], "3.00")
+        self.assertEqual(first_day["max"], "5.00")
+        self.assertEqual(len(response.data["results"]), 2)
+
+    # Tests the stats API filters and rejects unknown groupings
+    def test_stats_filters(self):
+        self.create("3.00")
+        self.create("5.00", establishment="Cafe B")
+        response = self.client.get(
+            "/api/prices/stats/", {"group_by": "establishment", "establishment": "Cafe B"}
+        )
+        self.assertEqual(
+            response.data["results"],
+            [{"establishment": "Cafe B", "count": 1, "mean": "5.00", "min": "5.00", "max": "5.00"}],
+        )
+        response = self.client.get("/api/prices/stats/", {"group_by": "week"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
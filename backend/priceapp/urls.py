@@ -2,7 +2,7 @@
 # urls for the priceapp
 # --------------------------------------------------------------------------------
 from django.urls import path
-from .views import PriceSubmissionView
+from .views import PriceStatsView, PriceSubmissionView, export_prices
 from priceapp.views import PriceListView
 
 
@@ -11,4 +11,6 @@ urlpatterns = [
         "", PriceSubmissionView.as_view(), name="submit-price"
     ), 
     path("api/prices/", PriceListView.as_view(), name="price-list"),
+    path("export/", export_prices, name="price-export"),
+    path("stats/", PriceStatsView.as_view(), name="price-stats"),
 ]
@@ -7,9 +7,16 @@ import json
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from .models import PriceSubmission
+from .models import PriceDailyAggregate, PriceSubmission
+from .pagination import PriceCursorPagination, iter_keyset_pages
 from .serializers import PriceSubmissionSerializer
 from django.core.exceptions import ValidationError
+from django.db.models import Max, Min, Sum
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import require_GET
+from .export import csv_lines, filter_submissions, ndjson_lines
 
 
 # Helper function to convert string to boolean
@@ -22,11 +29,82 @@ def str_to_bool(value):
     return value.lower() == "true"
 
 
+# Reads the optional ?date_from= / ?date_to= (YYYY-MM-DD) parameters
+def parse_date_range(params):
+    dates = {}
+    for param in ("date_from", "date_to"):
+        value = params.get(param)
+        if not value:
+            continue
+        try:
+            dates[param] = parse_date(value)
+        except ValueError:
+            dates[param] = None
+        if dates[param] is None:
+            raise ValueError(f"Invalid {param}")
+    return dates
+
+
+# Reads the optional ?fields=establishment,price,... parameter
+# Returns None when every field is wanted
+def parse_fields(request):
+    value = request.query_params.get("fields")
+    if not value:
+        return None
+    fields = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in fields if name not in PriceSubmissionSerializer.MODEL_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+# Streams every submission as one JSON array, a page at a time,
+# so the full table is never loaded into memory at once
+def stream_prices(queryset, fields, context):
+    yield "["
+    first = True
+    for rows in iter_keyset_pages(queryset, PriceCursorPagination.max_page_size):
+        data = PriceSubmissionSerializer(rows, many=True, fields=fields, context=context).data
+        for item in data:
+            yield ("" if first else ",") + json.dumps(item, cls=DjangoJSONEncoder)
+            first = False
+    yield "]"
+
+
+# Shared GET logic for both price list routes.
+# ?cursor= / ?page_size= page through the results ordered by (date, id),
+# ?fields= limits the fields returned and ?stream=true returns everything as a streamed list.
+def list_prices(request):
+    try:
+        fields = parse_fields(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    queryset = PriceSubmission.objects.only(
+        *PriceSubmissionSerializer.model_fields_for(fields)
+    )
+    context = {"request": request}
+
+    if str_to_bool(request.query_params.get("stream", "false")):
+        return StreamingHttpResponse(
+            stream_prices(queryset, fields, context), content_type="application/json"
+        )
+
+    paginator = PriceCursorPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    serializer = PriceSubmissionSerializer(page, many=True, fields=fields, context=context)
+    return paginator.get_paginated_response(serializer.data)
+
+
 # GET all submissions from the PriceSubmission model
-# This view retrieves all price submissions from the database.
+# This view retrieves price submissions from the database a page at a time.
 class PriceListView(generics.ListAPIView):
     queryset = PriceSubmission.objects.all()
     serializer_class = PriceSubmissionSerializer
+    pagination_class = PriceCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        return list_prices(request)
 
 
 # POST new submission + GET all (duplicate route fallback)
@@ -85,9 +163,97 @@ class PriceSubmissionView(APIView):
         except (KeyError, ValueError, TypeError, ValidationError) as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    # This method handles GET requests to retrieve all submissions.
+    # This method handles GET requests to retrieve submissions (paginated, see list_prices).
     def get(self, request):
-        """Retrieve all submissions"""
-        submissions = PriceSubmission.objects.all()
-        serializer = PriceSubmissionSerializer(submissions, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        """Retrieve submissions"""
+        return list_prices(request)
+
+
+# GET a full export of the price table for analysts.
+# ?format=ndjson (default) or ?format=csv, with optional ?date_from=, ?date_to=
+# (YYYY-MM-DD) and ?establishment= filters. The response is streamed so the
+# table is never held in memory - see export.py.
+@require_GET
+def export_prices(request):
+    export_format = request.GET.get("format", "ndjson").lower()
+    if export_format not in ("ndjson", "csv"):
+        return JsonResponse({"error": "format must be ndjson or csv"}, status=400)
+
+    try:
+        dates = parse_date_range(request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    queryset = filter_submissions(
+        PriceSubmission.objects.all(),
+        establishment=request.GET.get("establishment"),
+        **dates,
+    )
+
+    if export_format == "csv":
+        response = StreamingHttpResponse(
+            csv_lines(queryset, request), content_type="text/csv"
+        )
+        response["Content-Disposition"] = 'attachment; filename="prices.csv"'
+        return response
+
+    return StreamingHttpResponse(
+        ndjson_lines(queryset, request), content_type="application/x-ndjson"
+    )
+
+
+# GET price statistics served from the daily rollup table (see rollups.py), so the
+# cost depends on how many (establishment, beverage, day) buckets match rather than
+# how many raw submissions there are.
+# Optional filters: ?establishment=, ?beverage=, ?date_from=, ?date_to=
+# ?group_by= day (default), establishment or beverage
+class PriceStatsView(APIView):
+    GROUP_BY = ("day", "establishment", "beverage")
+
+    def get(self, request):
+        group_by = request.query_params.get("group_by", "day")
+        if group_by not in self.GROUP_BY:
+            return Response(
+                {"error": f"group_by must be one of {', '.join(self.GROUP_BY)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            dates = parse_date_range(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        buckets = PriceDailyAggregate.objects.all()
+        establishment = request.query_params.get("establishment")
+        beverage = request.query_params.get("beverage")
+        if establishment:
+            buckets = buckets.filter(establishment=establishment)
+        if beverage:
+            # Beverages are stored title cased (see PriceSubmission.save)
+            buckets = buckets.filter(beverage=beverage.strip().title())
+        if "date_from" in dates:
+            buckets = buckets.filter(day__gte=dates["date_from"])
+        if "date_to" in dates:
+            buckets = buckets.filter(day__lte=dates["date_to"])
+
+        rows = (
+            buckets.values(group_by)
+            .annotate(
+                count=Sum("count"),
+                total=Sum("total"),
+                min=Min("min_price"),
+                max=Max("max_price"),
+            )
+            .order_by(group_by)
+        )
+
+        results = [
+            {
+                group_by: row[group_by],
+                "count": row["count"],
+                "mean": f"{row['total'] / row['count']:.2f}",
+                "min": f"{row['min']:.2f}",
+                "max": f"{row['max']:.2f}",
+            }
+            for row in rows
+        ]
+        return Response({"results": results}, status=status.HTTP_200_OK)
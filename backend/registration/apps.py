@@ -8,3 +8,6 @@ from django.apps import AppConfig
 class RegistrationConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "registration"
+
+    def ready(self):
+        import registration.signals  # Clears the coffee stats cache when shops change
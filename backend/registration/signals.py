@@ -0,0 +1,15 @@
+# -----------------------------------------------------------------
+# Clears the cached coffee shop statistics whenever a CoffeeShop changes
+# so CoffeeStatsAPIView never serves numbers that are out of date.
+# -----------------------------------------------------------------
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CoffeeShop
+from .stats import invalidate_coffee_stats
+
+
+@receiver(post_save, sender=CoffeeShop)
+@receiver(post_delete, sender=CoffeeShop)
+def clear_coffee_stats(sender, **kwargs):
+    invalidate_coffee_stats()
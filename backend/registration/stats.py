@@ -0,0 +1,77 @@
+# ------------------------------------------------------------------
+# Coffee shop statistics used by CoffeeStatsAPIView (polled by the homepage).
+# Everything is worked out from a single GROUP BY query - one row per
+# (location, coffee) pair - and the result is cached for a short time.
+# The cache is cleared whenever a CoffeeShop is saved or deleted (see signals.py)
+# so a cache hit costs no database work at all.
+# ref https://docs.djangoproject.com/en/5.1/topics/cache/#the-low-level-cache-api
+# ------------------------------------------------------------------
+
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+
+from .models import CoffeeShop
+
+CACHE_KEYS = {
+    False: "coffee_stats:summary",
+    True: "coffee_stats:by_location",
+}
+
+
+def _summary(count, price_sum, coffees):
+    most_popular = coffees.most_common(1)
+    return {
+        "total_shops": count,
+        "avg_price": (price_sum / count).quantize(Decimal("0.01")),
+        "most_popular_coffee": most_popular[0][0] if most_popular else None,
+    }
+
+
+def compute_coffee_stats(by_location=False):
+    """Work out the stats from one query. Returns None when there are no shops."""
+    rows = (
+        CoffeeShop.objects.values("location", "most_popular_coffee")
+        .annotate(shops=Count("id"), price_sum=Sum("average_price"))
+        .order_by()
+    )
+
+    count, price_sum, coffees = 0, Decimal("0"), Counter()
+    locations = {}
+    for row in rows:
+        count += row["shops"]
+        price_sum += row["price_sum"]
+        coffees[row["most_popular_coffee"]] += row["shops"]
+
+        if by_location:
+            totals = locations.setdefault(row["location"], [0, Decimal("0"), Counter()])
+            totals[0] += row["shops"]
+            totals[1] += row["price_sum"]
+            totals[2][row["most_popular_coffee"]] += row["shops"]
+
+    if count == 0:
+        return None
+
+    data = _summary(count, price_sum, coffees)
+    if by_location:
+        data["locations"] = {
+            location: _summary(*totals) for location, totals in sorted(locations.items())
+        }
+    return data
+
+
+def get_coffee_stats(by_location=False):
+    key = CACHE_KEYS[by_location]
+    data = cache.get(key)
+    if data is None:
+        # "No shops" is cached too (as an empty dict) so it doesn't hit the database each poll
+        data = compute_coffee_stats(by_location) or {}
+        cache.set(key, data, settings.COFFEE_STATS_CACHE_TTL)
+    return data or None
+
+
+def invalidate_coffee_stats():
+    cache.delete_many(list(CACHE_KEYS.values()))
@@ -15,6 +15,9 @@ from rest_framework.test import APIClient
 from django.core import mail
 from django.contrib.auth.models import User
 from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from decimal import Decimal
+from registration.models import CoffeeShop
 
 
 
@@ -207,3 +210,64 @@ class ResetPasswordViewTest(TestCase):
         )
         response = self.client.post(url, {"password": "newpass123"})
         self.assertEqual(response.status_code, 400)
+
+
+# ------------------------------
+# Coffee Stats View Tests
+# ------------------------------
+class CoffeeStatsViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = reverse("coffee-stats")
+        CoffeeShop.objects.create(
+            name="Bean There", location="Belfast", average_price="3.00",
+            rating=4.5, most_popular_coffee="Latte",
+        )
+        CoffeeShop.objects.create(
+            name="Grind", location="Belfast", average_price="4.00",
+            rating=4.0, most_popular_coffee="Latte",
+        )
+        CoffeeShop.objects.create(
+            name="Perk Up", location="Derry", average_price="3.50",
+            rating=3.5, most_popular_coffee="Flat White",
+        )
+
+    # tests the stats are worked out correctly
+    def test_stats_summary(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["total_shops"], 3)
+        self.assertEqual(response.data["avg_price"], Decimal("3.50"))
+        self.assertEqual(response.data["most_popular_coffee"], "Latte")
+
+    # tests a cached response does not touch the database
+    def test_cache_hit_runs_no_queries(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data["total_shops"], 3)
+
+    # tests the cache is cleared when a shop is added
+    def test_cache_invalidated_on_change(self):
+        self.client.get(self.url)
+        CoffeeShop.objects.create(
+            name="New Brew", location="Derry", average_price="5.00",
+            rating=5.0, most_popular_coffee="Mocha",
+        )
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["total_shops"], 4)
+
+    # tests the breakdown by location
+    def test_stats_by_location(self):
+        response = self.client.get(self.url, {"by": "location"})
+        locations = response.data["locations"]
+        self.assertEqual(locations["Belfast"]["total_shops"], 2)
+        self.assertEqual(locations["Belfast"]["avg_price"], Decimal("3.50"))
+        self.assertEqual(locations["Derry"]["most_popular_coffee"], "Flat White")
+
+    # tests the message returned when there are no shops
+    def test_no_shops(self):
+        CoffeeShop.objects.all().delete()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["message"], "No coffee shop data available.")
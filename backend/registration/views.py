@@ -9,7 +9,6 @@ from django.contrib.auth.models import User
 from accounts.models import UserProfile
 from django.contrib.auth.tokens import default_token_generator
 from django.core.mail import send_mail
-from django.db.models import Avg, Count
 from django.http import JsonResponse, QueryDict
 from django.utils.crypto import get_random_string
 from django.utils.decorators import method_decorator
@@ -22,8 +21,8 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from .models import CoffeeShop
 from .serializers import UserLoginSerializer, UserRegistrationSerializer
+from .stats import get_coffee_stats
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -211,26 +210,14 @@ class DashboardView(View):
 
 
 # APIView for coffee shop statistics -- consider moving to main folder
+# The numbers come from one cached query (see stats.py) as the homepage polls this.
+# Add ?by=location for a breakdown per location.
 class CoffeeStatsAPIView(APIView):
     def get(self, request):
-        total_shops = CoffeeShop.objects.count()
-        if total_shops == 0:
+        by_location = request.query_params.get("by") == "location"
+        data = get_coffee_stats(by_location)
+        if data is None:
             return Response(
                 {"message": "No coffee shop data available."}, status=status.HTTP_200_OK
             )
-
-        avg_price = CoffeeShop.objects.aggregate(Avg("price"))["price__avg"]
-        most_popular = (
-            CoffeeShop.objects.values("coffee_type")
-            .annotate(count=Count("coffee_type"))
-            .order_by("-count")
-            .first()
-        )
-        most_popular_coffee = most_popular["coffee_type"] if most_popular else None
-
-        data = {
-            "total_shops": total_shops,
-            "avg_price": avg_price,
-            "most_popular_coffee": most_popular_coffee,
-        }
         return Response(data, status=status.HTTP_200_OK)